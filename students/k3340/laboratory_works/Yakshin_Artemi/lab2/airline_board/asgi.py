@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'airline_board.settings')
+# Настройки, зависящие от сервера: например, CONN_MAX_AGE без пула
+os.environ.setdefault('ASGI', 'True')
 
 application = get_asgi_application()
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flights.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +56,8 @@ ROOT_URLCONF = 'airline_board.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга для Server-Timing
+        'BACKEND': 'flights.profiling.ProfilingTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,6 +76,17 @@ WSGI_APPLICATION = 'airline_board.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Драйвер — psycopg 3 (requirements.txt: psycopg[binary,pool]), пул соединений
+# (DB_POOL=True) без него недоступен; с пулом постоянные соединения Django
+# (CONN_MAX_AGE) отключаются.
+# Под ASGI синхронный код каждого запроса выполняется в новом потоке, и
+# постоянное соединение потока больше не используется, но остается открытым
+# до CONN_MAX_AGE — так можно исчерпать max_connections. Поэтому под ASGI
+# (airline_board.asgi задает ASGI=True) без пула CONN_MAX_AGE по умолчанию 0;
+# для повторного использования соединений под ASGI включайте DB_POOL
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+ASGI = config('ASGI', default=False, cast=bool)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -82,9 +95,169 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD', default=''),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        # Соединение живет между запросами и перед повторным использованием
+        # проверяется, поэтому обрыв со стороны сервера не дает ошибку запроса
+        'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=0 if ASGI else 600, cast=int),
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+        'OPTIONS': {},
+    }
+}
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+    }
+
+# Реплика для чтения табло (flights.routers.ReplicaRouter); без DB_REPLICA_HOST
+# все запросы идут в default
+DB_REPLICA_HOST = config('DB_REPLICA_HOST', default='')
+if DB_REPLICA_HOST:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        'HOST': DB_REPLICA_HOST,
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'OPTIONS': {**DATABASES['default']['OPTIONS']},
+        # В тестах реплика указывает на тестовую БД default
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['flights.routers.ReplicaRouter']
+
+# Сколько секунд после брони или правки пользователь читает основную БД
+# (должно перекрывать типичную задержку репликации)
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=15, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# По умолчанию локальная память процесса; для нескольких воркеров укажите
+# общий бэкенд, например django.core.cache.backends.redis.RedisCache
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='airline-board'),
     }
 }
 
+# Время жизни закэшированных страниц табло (секунды); актуальность
+# обеспечивается версиями в flights.cache, а не таймаутом
+BOARD_CACHE_TIMEOUT = config('BOARD_CACHE_TIMEOUT', default=300, cast=int)
+
+# Живое табло (Server-Sent Events, /live/). Брокер в памяти работает в
+# пределах одного процесса; для нескольких воркеров используйте
+# flights.live.RedisBroker и BOARD_BROKER_URL
+BOARD_BROKER = config('BOARD_BROKER', default='flights.live.InProcessBroker')
+BOARD_BROKER_URL = config('BOARD_BROKER_URL', default='redis://localhost:6379/0')
+# Интервал пустых сообщений, чтобы прокси не закрывали простаивающие соединения
+BOARD_STREAM_KEEPALIVE = config('BOARD_STREAM_KEEPALIVE', default=15, cast=int)
+
+
+# Профилирование запросов (flights.profiling): заголовок Server-Timing
+# с временем БД/шаблонов и журнал медленных запросов и запросов с повторяющимся
+# SQL. Работает без DEBUG; в журнал попадает доля PROFILING_SAMPLE_RATE.
+# Server-Timing раскрывает время запросов клиенту, поэтому по умолчанию
+# отдается только при DEBUG
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=True, cast=bool)
+PROFILING_SERVER_TIMING = config('PROFILING_SERVER_TIMING', default=DEBUG, cast=bool)
+PROFILING_SLOW_MS = config('PROFILING_SLOW_MS', default=500, cast=int)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.1, cast=float)
+PROFILING_LOG_FILE = config('PROFILING_LOG_FILE', default=str(BASE_DIR / 'slow_requests.log'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'profiling': {'format': '{asctime} {message}', 'style': '{'},
+    },
+    'handlers': {
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': PROFILING_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            # Файл создается только при первой записи
+            'delay': True,
+            'formatter': 'profiling',
+        },
+    },
+    'loggers': {
+        'flights.profiling': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Метрики Prometheus (/metrics, flights.metrics). Для нескольких воркеров
+# укажите общий каталог: процессы сохраняют в него срезы раз в
+# METRICS_FLUSH_SECONDS, а /metrics суммирует их. Без токена /metrics
+# доступен только персоналу; Prometheus передает METRICS_TOKEN заголовком
+# Authorization: Bearer <token>
+METRICS_MULTIPROCESS_DIR = config('METRICS_MULTIPROCESS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=int)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+
+# Потоковые выгрузки броней (flights.exports): строк за одно обращение к
+# серверному курсору
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+
+# Номера билетов (flights.tickets): процесс берет у БД блок порядковых номеров
+# такого размера; ключ перестановки по умолчанию выводится из SECRET_KEY
+TICKET_BLOCK_SIZE = config('TICKET_BLOCK_SIZE', default=100, cast=int)
+TICKET_NUMBER_KEY = config('TICKET_NUMBER_KEY', default='')
+
+
+# Списки админки без фильтров: при большем числе строк в таблице показывается
+# оценка из статистики PostgreSQL вместо точного COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = config('ADMIN_ESTIMATED_COUNT_THRESHOLD', default=100000, cast=int)
+
+
+# Массовые действия админки над рейсами (flights.bulk): выборка больше
+# ADMIN_BULK_BACKGROUND_THRESHOLD рейсов выполняется заданием очереди,
+# по ADMIN_BULK_CHUNK_SIZE рейсов в транзакции
+ADMIN_BULK_BACKGROUND_THRESHOLD = config('ADMIN_BULK_BACKGROUND_THRESHOLD', default=1000, cast=int)
+ADMIN_BULK_CHUNK_SIZE = config('ADMIN_BULK_CHUNK_SIZE', default=500, cast=int)
+
+
+# Очередь фоновых заданий в БД (flights.tasks, команда run_worker): воркер
+# держит задание TASK_LEASE_SECONDS (потом его заберет другой воркер),
+# повторяет упавшее до TASK_MAX_ATTEMPTS раз с задержкой от TASK_RETRY_DELAY
+# секунд, удваивая ее, и проверяет очередь раз в TASK_POLL_SECONDS
+TASK_LEASE_SECONDS = config('TASK_LEASE_SECONDS', default=300, cast=int)
+TASK_MAX_ATTEMPTS = config('TASK_MAX_ATTEMPTS', default=5, cast=int)
+TASK_RETRY_DELAY = config('TASK_RETRY_DELAY', default=10, cast=float)
+TASK_POLL_SECONDS = config('TASK_POLL_SECONDS', default=1, cast=float)
+# Выполненные задания (каждая бронь ставит письмо) воркер удаляет через
+# столько часов после завершения; 0 — не удалять. Упавшие остаются
+TASK_PURGE_DONE_AFTER_HOURS = config('TASK_PURGE_DONE_AFTER_HOURS', default=168, cast=int)
+
+# Письма с подтверждением брони; по умолчанию выводятся в консоль воркера
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@airline-board.local')
+
+
+# Сессии и пользователь авторизованного запроса. По умолчанию сессия и User
+# читаются из БД (два SELECT на запрос). С общим кэшем (Redis, Memcached)
+# можно указать SESSION_ENGINE=django.contrib.sessions.backends.cached_db или
+# ...signed_cookies (сессия в подписанной cookie, без обращения к серверу) и
+# USER_CACHE_TIMEOUT > 0: flights.auth.CachedModelBackend берет User из кэша.
+# С локальным кэшем выход и смена пароля не видны другим процессам до
+# истечения таймаута, поэтому по умолчанию кэш пользователя выключен
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+AUTHENTICATION_BACKENDS = ['flights.auth.CachedModelBackend']
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=0, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -104,6 +277,11 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Быстрый хэш паролей для тестов и нагрузочных замеров (не для боевой БД:
+# MD5 без растяжения ключа); по умолчанию PBKDF2
+if config('FAST_PASSWORD_HASHERS', default=False, cast=bool):
+    PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
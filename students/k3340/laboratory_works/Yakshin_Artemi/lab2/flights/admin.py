@@ -1,7 +1,19 @@
-from django.contrib import admin
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Airline, Flight, Reservation, Review, UserProfile
+from django.db import IntegrityError
+from django.db.models import F
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.html import format_html
+from . import bulk, tasks
+from .exports import export_response
+from .forms import DelayForm, GateChangeForm
+from .pagination import EstimatedCountPaginator
+from .models import Airline, BackgroundJob, Flight, Reservation, Review, SeatLayout, UserProfile
 
 
 class UserProfileInline(admin.StackedInline):
@@ -14,44 +26,213 @@ class UserAdmin(BaseUserAdmin):
     inlines = (UserProfileInline,)
 
 
+@admin.display(description='Рейтинг', ordering='rating_count')
+def rating(obj):
+    """Средний рейтинг из сохраненной сводки, без запроса к отзывам"""
+    if not obj.rating_count:
+        return '—'
+    return f'{obj.average_rating:.1f} ({obj.rating_count})'
+
+
+@admin.display(description='Свободно мест', ordering=F('capacity') - F('reserved_count'))
+def available_seats(obj):
+    """Из счетчика reserved_count в строке рейса; сортировка тем же выражением в SQL"""
+    return obj.available_seats
+
+
+class RatingFilter(admin.SimpleListFilter):
+    """Фильтр по оценке с фиксированными вариантами, без SELECT DISTINCT по отзывам"""
+    title = 'рейтинг'
+    parameter_name = 'rating'
+
+    def lookups(self, request, model_admin):
+        return [(str(value), str(value)) for value in range(10, 0, -1)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(rating=self.value())
+        return queryset
+
+
+class CounterFieldsAdmin(admin.ModelAdmin):
+    """Изменение объекта не перезаписывает счетчики, которые ведут сигналы"""
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save(update_fields=obj.editable_fields())
+        else:
+            obj.save()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Списки больших таблиц: один COUNT(*) или его оценка, связи одним JOIN"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(Airline)
-class AirlineAdmin(admin.ModelAdmin):
-    list_display = ['name', 'code']
+class AirlineAdmin(CounterFieldsAdmin):
+    list_display = ['name', 'code', rating]
     search_fields = ['name', 'code']
+    readonly_fields = ['rating_sum', 'rating_count']
+
+
+@admin.register(SeatLayout)
+class SeatLayoutAdmin(admin.ModelAdmin):
+    list_display = ['name', 'rows', 'seat_letters']
+    search_fields = ['name']
 
 
 @admin.register(Flight)
-class FlightAdmin(admin.ModelAdmin):
+class FlightAdmin(CounterFieldsAdmin, LargeTableAdmin):
     list_display = ['flight_number', 'airline', 'origin', 'destination', 
-                   'departure_time', 'arrival_time', 'flight_type', 'gate_number', 'available_seats']
+                   'departure_time', 'arrival_time', 'flight_type', 'gate_number', available_seats, rating]
     list_filter = ['airline', 'flight_type', 'departure_time']
+    list_select_related = ['airline']
     search_fields = ['flight_number', 'origin', 'destination']
-    date_hierarchy = 'departure_time'
+    # date_hierarchy не используется: для навигации он выполняет MIN/MAX и
+    # SELECT DISTINCT по дням через всю таблицу рейсов; фильтр по
+    # departure_time дает те же периоды без запросов
     ordering = ['departure_time']
+    autocomplete_fields = ['airline', 'seat_layout']
+    readonly_fields = ['reserved_count', 'rating_sum', 'rating_count']
+    actions = ['change_gate', 'delay', 'cancel_reservations', 'reconcile_seat_counters',
+               'export_manifest_csv', 'export_manifest_ndjson']
+    
+    @admin.action(description='Сменить гейт выбранных рейсов')
+    def change_gate(self, request, queryset):
+        return self.bulk_action(request, queryset, 'change_gate', GateChangeForm)
+    
+    @admin.action(description='Задержать вылет выбранных рейсов')
+    def delay(self, request, queryset):
+        return self.bulk_action(request, queryset, 'delay', DelayForm)
+    
+    @admin.action(description='Отменить все брони выбранных рейсов')
+    def cancel_reservations(self, request, queryset):
+        return self.bulk_action(request, queryset, 'cancel_reservations', forms.Form)
+    
+    @admin.action(description='Пересчитать счетчики мест выбранных рейсов')
+    def reconcile_seat_counters(self, request, queryset):
+        flight_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        job = tasks.enqueue('reconcile_seat_counters', {'flight_ids': flight_ids}, user=request.user)
+        url = reverse('admin:flights_backgroundjob_change', args=[job.pk])
+        self.message_user(request, format_html(
+            'Пересчет счетчиков {} рейсов: <a href="{}">задание №{}</a> поставлено в очередь',
+            len(flight_ids), url, job.pk))
+    
+    def bulk_action(self, request, queryset, action, form_class):
+        """Страница параметров (или подтверждения), затем действие из flights.bulk"""
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            context = {
+                **self.admin_site.each_context(request),
+                'title': bulk.ACTIONS[action].label,
+                'opts': self.model._meta,
+                'form': form,
+                'action': request.POST['action'],
+                'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+                'select_across': request.POST.get('select_across', '0'),
+                'flights_count': queryset.count(),
+            }
+            context['background'] = context['flights_count'] > settings.ADMIN_BULK_BACKGROUND_THRESHOLD
+            return TemplateResponse(request, 'admin/flights/flight/bulk_action.html', context)
+        
+        flight_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        label = bulk.ACTIONS[action].label
+        if len(flight_ids) > settings.ADMIN_BULK_BACKGROUND_THRESHOLD:
+            job = bulk.start_job(action, flight_ids, form.cleaned_data, request.user)
+            url = reverse('admin:flights_backgroundjob_change', args=[job.pk])
+            self.message_user(request, format_html(
+                '{}: <a href="{}">задание №{}</a> для {} рейсов поставлено в очередь', label, url, job.pk, len(flight_ids)))
+            return None
+        try:
+            bulk.run(action, flight_ids, form.cleaned_data)
+        except (IntegrityError, bulk.BulkActionError) as exc:
+            self.message_user(request, f'{label}: не выполнено ({exc})', messages.ERROR)
+        else:
+            self.message_user(request, f'{label}: обработано рейсов — {len(flight_ids)}')
+        return None
+    
+    @admin.action(description='Выгрузить манифест выбранных рейсов (CSV)')
+    def export_manifest_csv(self, request, queryset):
+        return export_response(request, Reservation.objects.filter(flight__in=queryset), 'csv', 'manifest')
+    
+    @admin.action(description='Выгрузить манифест выбранных рейсов (NDJSON)')
+    def export_manifest_ndjson(self, request, queryset):
+        return export_response(request, Reservation.objects.filter(flight__in=queryset), 'ndjson', 'manifest')
+    
+    def get_queryset(self, request):
+        # Flight.__str__ показывает код авиакомпании: без JOIN подсказки
+        # автодополнения в формах броней и отзывов делали бы запрос на рейс
+        return super().get_queryset(request).select_related('airline')
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Другая сетка мест — биты карты нужно разложить заново
+        if change and {'seat_layout', 'capacity'} & set(form.changed_data):
+            obj.rebuild_seat_bitmap()
 
 
 @admin.register(Reservation)
-class ReservationAdmin(admin.ModelAdmin):
+class ReservationAdmin(LargeTableAdmin):
     list_display = ['user', 'flight', 'seat_number', 'ticket_number', 'created_at']
     list_filter = ['flight__airline', 'created_at']
+    list_select_related = ['user', 'flight__airline']
     search_fields = ['user__username', 'flight__flight_number', 'ticket_number']
+    autocomplete_fields = ['user', 'flight']
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['export_csv', 'export_ndjson']
     
-    def get_form(self, request, obj=None, **kwargs):
-        form = super().get_form(request, obj, **kwargs)
-        if 'flight' in form.base_fields:
-            form.base_fields['flight'].queryset = Flight.objects.select_related('airline')
-        return form
+    @admin.action(description='Выгрузить выбранные брони (CSV)')
+    def export_csv(self, request, queryset):
+        return export_response(request, queryset, 'csv', 'reservations')
+    
+    @admin.action(description='Выгрузить выбранные брони (NDJSON)')
+    def export_ndjson(self, request, queryset):
+        return export_response(request, queryset, 'ndjson', 'reservations')
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     list_display = ['user', 'flight', 'rating', 'created_at']
-    list_filter = ['rating', 'created_at', 'flight__airline']
+    list_filter = [RatingFilter, 'created_at', 'flight__airline']
+    list_select_related = ['user', 'flight__airline']
+    autocomplete_fields = ['user', 'flight']
     search_fields = ['user__username', 'flight__flight_number', 'text']
     readonly_fields = ['created_at']
 
 
+@admin.display(description='Прогресс')
+def job_progress(job):
+    return f'{job.processed}/{job.total} ({job.progress}%)'
+
+
+@admin.display(description='Действие')
+def job_action(job):
+    registered = tasks.TASKS.get(job.action)
+    return registered.label if registered else job.action
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', job_action, 'status', job_progress, 'attempts', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'action']
+    list_select_related = ['created_by']
+    # Список id рейсов может быть длинным: на странице задания он не выводится
+    fields = [job_action, 'params', 'status', job_progress, 'attempts', 'max_attempts', 'run_after',
+              'worker', 'error', 'created_by', 'created_at', 'started_at', 'finished_at']
+    readonly_fields = fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('object_ids')
+
+
 # Переопределяем стандартную регистрацию User
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
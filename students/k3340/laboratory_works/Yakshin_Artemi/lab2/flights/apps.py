@@ -6,4 +6,8 @@ class FlightsConfig(AppConfig):
     name = 'flights'
     
     def ready(self):
-        import flights.signals
\ No newline at end of file
+        import flights.signals
+        # Обертка SQL-запросов ставится на соединения с момента их открытия
+        import flights.profiling
+        # Задания очереди регистрируются при импорте модулей (нужно воркеру)
+        import flights.bulk
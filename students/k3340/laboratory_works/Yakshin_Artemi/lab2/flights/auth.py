@@ -0,0 +1,38 @@
+"""Пользователь авторизованного запроса из кэша
+
+CachedModelBackend — ModelBackend, который в get_user() берет User из кэша
+на USER_CACHE_TIMEOUT секунд вместо SELECT на каждый запрос. Ключ содержит
+версию пользователя, которую сигналы post_save и post_delete User
+увеличивают после фиксации транзакции (вход обновляет last_login, смена
+пароля и блокировка сохраняют User). Поэтому объект, прочитанный из БД до
+изменения, под новой версией не окажется. QuerySet.update() сигналов не
+отправляет: после массовых правок пользователей версию нужно сбросить
+через flights.cache.bump_user.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache as default_cache
+
+from . import cache
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        timeout = settings.USER_CACHE_TIMEOUT
+        if not timeout:
+            return super().get_user(user_id)
+        key = cache.user_key(user_id)
+        user = default_cache.get(key)
+        if user is None:
+            # Неактивный или удаленный пользователь не кэшируется
+            user = super().get_user(user_id)
+            if user is not None:
+                default_cache.set(key, user, timeout)
+        return user
+
+    async def aget_user(self, user_id):
+        # request.auser() (async-представления и cache_anonymous_page) идет сюда
+        if not settings.USER_CACHE_TIMEOUT:
+            return await super().aget_user(user_id)
+        return await sync_to_async(self.get_user)(user_id)
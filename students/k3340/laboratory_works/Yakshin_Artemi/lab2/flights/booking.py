@@ -0,0 +1,123 @@
+"""Бронирование мест без гонок
+
+Корректность обеспечивает сама БД, а не проверка в Python:
+- уникальный индекс (flight, seat_number) не дает занять место дважды;
+- CHECK reserved_count <= capacity на рейсе не дает превысить вместимость:
+  счетчик увеличивается тем же UPDATE, что выполняет обработчик post_save.
+
+Вставка брони и увеличение счетчика идут в одной транзакции, блокируется
+только строка рейса и только до конца транзакции. Нарушение ограничения
+превращается в понятную ошибку, временные конфликты блокировок повторяются.
+"""
+import random
+import re
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+
+from .metrics import BOOKING_CONFLICTS, RESERVATIONS_CREATED
+from .models import Reservation
+from .tasks import enqueue
+from .tickets import next_ticket_number
+
+CAPACITY_CONSTRAINT = 'flight_reserved_count_lte_capacity'
+# unique_together (flight, seat_number): в тексте ошибки SQLite — столбцы
+# "flights_reservation.flight_id, flights_reservation.seat_number", у PostgreSQL —
+# имя индекса "..._flight_id_seat_number_..._uniq" и "Key (flight_id, seat_number)"
+SEAT_CONSTRAINT = re.compile(r'flight_id[\W_]+(?:\w+\.)?seat_number')
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 0.02
+
+
+class BookingError(Exception):
+    """Бронирование не состоялось; текст пригоден для показа пользователю"""
+
+
+class SeatTaken(BookingError):
+    pass
+
+
+class FlightFull(BookingError):
+    pass
+
+
+def book_seat(user, flight, seat_number, attempts=MAX_ATTEMPTS):
+    """Создает бронь места на рейсе или бросает SeatTaken/FlightFull"""
+    _check_seat(flight, seat_number)
+    # Номер выдается из блока процесса до начала транзакции и уникален сам
+    # по себе, повторы из-за него не нужны
+    ticket_number = next_ticket_number()
+    for attempt in _attempts(attempts):
+        reservation = Reservation(user=user, flight=flight, seat_number=seat_number,
+                                  ticket_number=ticket_number)
+        try:
+            with transaction.atomic():
+                reservation.save()
+                # Письмо с подтверждением: задание фиксируется вместе с бронью
+                enqueue('send_confirmation', {'reservation_id': reservation.pk})
+            RESERVATIONS_CREATED.inc(airline=flight.airline.code)
+            return reservation
+        except IntegrityError as exc:
+            error = _classify(exc)
+            if error is not None:
+                raise error from exc
+            # Номер совпал с билетом, выданным до flights.tickets старой
+            # случайной схемой, — берем следующий
+            ticket_number = next_ticket_number()
+        except OperationalError:
+            # Блокировка или взаимоблокировка: транзакция откатана целиком
+            BOOKING_CONFLICTS.inc(reason='lock')
+            if attempt == attempts - 1:
+                raise
+    raise BookingError('Не удалось оформить бронь, попробуйте еще раз.')
+
+
+def change_seat(reservation, seat_number, attempts=MAX_ATTEMPTS):
+    """Переносит бронь на другое место того же рейса"""
+    _check_seat(reservation.flight, seat_number)
+    reservation.seat_number = seat_number
+    for attempt in _attempts(attempts):
+        try:
+            with transaction.atomic():
+                reservation.save(update_fields=['seat_number', 'updated_at'])
+            return reservation
+        except IntegrityError as exc:
+            raise _classify(exc) or SeatTaken('Это место уже занято.') from exc
+        except OperationalError:
+            BOOKING_CONFLICTS.inc(reason='lock')
+            if attempt == attempts - 1:
+                raise
+    raise BookingError('Не удалось изменить бронь, попробуйте еще раз.')
+
+
+def _check_seat(flight, seat_number):
+    if not flight.seat_map.is_valid(seat_number):
+        raise BookingError('Такого места нет в салоне этого рейса.')
+
+
+def _attempts(attempts):
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(RETRY_DELAY * attempt * random.uniform(0.5, 1.5))
+        yield attempt
+
+
+def _classify(exc):
+    """Ошибка для пользователя по имени нарушенного ограничения
+
+    Имя ограничения присутствует в тексте ошибки и у PostgreSQL, и у SQLite.
+    None — конфликт номера билета (только со старыми случайными номерами),
+    который имеет смысл повторить. Остальные ошибки (внешний ключ, NOT NULL)
+    — не конфликт бронирования и пробрасываются как есть.
+    """
+    message = str(exc)
+    if CAPACITY_CONSTRAINT in message:
+        BOOKING_CONFLICTS.inc(reason='flight_full')
+        return FlightFull('На рейсе не осталось свободных мест.')
+    if SEAT_CONSTRAINT.search(message):
+        BOOKING_CONFLICTS.inc(reason='seat_taken')
+        return SeatTaken('Это место уже занято.')
+    if 'ticket_number' in message:
+        BOOKING_CONFLICTS.inc(reason='ticket_number')
+        return None
+    raise exc
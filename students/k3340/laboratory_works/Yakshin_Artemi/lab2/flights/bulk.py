@@ -0,0 +1,165 @@
+"""Массовые действия над рейсами для админки
+
+Каждое действие — несколько UPDATE/DELETE на пачку рейсов вместо сохранения
+объектов по одному: сигналы не вызываются, поэтому счетчики мест, карты
+мест, кэш табло, живое табло и метрики поддерживаются здесь же, в той же
+транзакции или после ее фиксации. Небольшие выборки выполняются сразу, большие
+— заданием очереди flights.tasks, которое обрабатывает рейсы пачками и
+сохраняет прогресс вместе с каждой пачкой.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef
+from django.utils import timezone
+
+from . import cache, live, tasks
+from .metrics import RESERVATIONS_CANCELLED
+from .models import Flight, Reservation
+
+ACTIONS = {}
+CHECKS = {}
+
+
+class BulkActionError(tasks.TaskFailed):
+    """Действие неприменимо к выборке; задание не повторяется, текст — для админки"""
+
+
+def bulk_action(name, label, check=None):
+    """Регистрирует действие: функция(id рейсов пачки, **параметры) -> None
+
+    Одноименное задание очереди выполняет действие над большой выборкой.
+    check(id рейсов, **параметры) проверяет всю выборку до первой пачки и
+    бросает BulkActionError.
+    """
+    def decorator(func):
+        func.label = label
+        ACTIONS[name] = func
+        if check is not None:
+            CHECKS[name] = check
+        tasks.register(name, run_job, label)
+        return func
+    return decorator
+
+
+def flights_changed(flight_ids):
+    """Кэш страниц рейсов, табло и живое табло — после фиксации транзакции"""
+    flight_ids = list(flight_ids)
+
+    def notify():
+        cache.bump_flights(flight_ids)
+        for flight_id in flight_ids:
+            live.publish_flight(flight_id)
+    transaction.on_commit(notify)
+
+
+def chunks(ids, size):
+    for offset in range(0, len(ids), size):
+        yield ids[offset:offset + size]
+
+
+def validate(action, flight_ids, params):
+    """Проверка всей выборки, чтобы ошибка не оставила часть пачек примененной"""
+    if action in CHECKS:
+        CHECKS[action](flight_ids, **params)
+
+
+def run(action, flight_ids, params):
+    """Выполняет действие сразу, пачками по ADMIN_BULK_CHUNK_SIZE"""
+    validate(action, flight_ids, params)
+    for chunk in chunks(flight_ids, settings.ADMIN_BULK_CHUNK_SIZE):
+        ACTIONS[action](chunk, **params)
+
+
+def start_job(action, flight_ids, params, user=None):
+    """Ставит действие в очередь заданий; выполнит его воркер (run_worker)"""
+    return tasks.enqueue(action, params, object_ids=flight_ids, user=user)
+
+
+def run_job(job):
+    """Задание очереди: действие пачками, прогресс фиксируется вместе с пачкой
+
+    При повторной доставке обработанные пачки пропускаются, а прерванная
+    откатывается вместе со своим прогрессом, поэтому задержка вылета не
+    применяется к рейсу дважды.
+    """
+    processed = job.processed
+    validate(job.action, job.object_ids[processed:], job.params)
+    for chunk in chunks(job.object_ids[processed:], settings.ADMIN_BULK_CHUNK_SIZE):
+        processed += len(chunk)
+        with transaction.atomic():
+            ACTIONS[job.action](chunk, **job.params)
+            tasks.heartbeat(job, processed=processed)
+
+
+@bulk_action('change_gate', 'Смена гейта')
+def change_gate(flight_ids, gate_number):
+    with transaction.atomic():
+        Flight.objects.filter(pk__in=flight_ids).update(gate_number=gate_number)
+        flights_changed(flight_ids)
+
+
+def check_delay(flight_ids, minutes):
+    """Сдвинутый вылет не должен совпасть с ключом расписания другого рейса
+
+    Иначе UPDATE нарушит flight_schedule_key, а повтор задания упадет так же.
+    Рейсы выборки тоже учитываются: уникальность проверяется по строкам, пока
+    сдвинута только часть из них.
+    """
+    shift = timedelta(minutes=minutes)
+    for chunk in chunks(flight_ids, settings.ADMIN_BULK_CHUNK_SIZE):
+        conflicts = list(
+            Flight.objects.filter(pk__in=chunk)
+            .filter(Exists(Flight.objects.filter(
+                airline_id=OuterRef('airline_id'),
+                flight_number=OuterRef('flight_number'),
+                departure_time=OuterRef('departure_time') + shift,
+            )))
+            .order_by('departure_time').values_list('flight_number', 'departure_time')[:5]
+        )
+        if conflicts:
+            names = ', '.join(f'{number} {timezone.localtime(departure):%d.%m.%Y %H:%M}'
+                              for number, departure in conflicts)
+            raise BulkActionError(
+                f'после задержки на {minutes} мин. рейсы совпадут с другими рейсами расписания: {names}')
+
+
+@bulk_action('delay', 'Задержка вылета', check=check_delay)
+def delay(flight_ids, minutes):
+    shift = timedelta(minutes=minutes)
+    with transaction.atomic():
+        # Повторная проверка пачки: расписание могло измениться после validate()
+        check_delay(flight_ids, minutes)
+        Flight.objects.filter(pk__in=flight_ids).update(
+            departure_time=F('departure_time') + shift,
+            arrival_time=F('arrival_time') + shift,
+        )
+        flights_changed(flight_ids)
+
+
+@bulk_action('cancel_reservations', 'Отмена всех броней')
+def cancel_reservations(flight_ids):
+    with transaction.atomic():
+        # Блокировка рейсов: брони, которые оформляются параллельно, дождутся
+        # конца транзакции и учтут себя уже в обнуленных счетчиках
+        list(Flight.objects.select_for_update().filter(pk__in=flight_ids).values_list('pk', flat=True))
+        reservations = Reservation.objects.filter(flight_id__in=flight_ids)
+        per_airline = list(
+            reservations.values_list('flight__airline__code').annotate(total=Count('pk')).order_by()
+        )
+        # DELETE одним запросом: QuerySet.delete() из-за обработчиков
+        # post_delete загрузил бы и удалил брони по одной. На брони никто не
+        # ссылается, каскадов нет
+        table = connection.ops.quote_name(Reservation._meta.db_table)
+        column = connection.ops.quote_name(Reservation._meta.get_field('flight').column)
+        placeholders = ', '.join(['%s'] * len(flight_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', list(flight_ids))
+        Flight.objects.filter(pk__in=flight_ids).update(reserved_count=0, seat_bitmap=b'')
+        flights_changed(flight_ids)
+
+        def count_cancelled():
+            for code, total in per_airline:
+                RESERVATIONS_CANCELLED.inc(total, airline=code)
+        transaction.on_commit(count_cancelled)
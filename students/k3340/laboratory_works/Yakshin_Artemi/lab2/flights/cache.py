@@ -0,0 +1,165 @@
+"""Кэш публичных страниц табло с версионированием
+
+Страницы для анонимных посетителей хранятся под ключами, в которые входит
+номер версии. Сигналы на изменение рейсов, броней и отзывов увеличивают
+версию, поэтому старые записи просто перестают читаться и вытесняются
+бэкендом кэша сами. Работает с любым бэкендом Django (locmem, Redis,
+Memcached), так как использует только get/add/incr/set.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .metrics import CACHE_REQUESTS
+from .routers import use_primary
+
+BOARD_VERSION_KEY = 'flights:board:version'
+BOARD_CHANGED_KEY = 'flights:board:changed'
+AIRLINES_VERSION_KEY = 'flights:airlines:version'
+FLIGHT_VERSION_KEY = 'flights:flight:{}:version'
+USER_VERSION_KEY = 'flights:user:{}:version'
+
+
+def get_version(key):
+    """Текущая версия; при отсутствии ключа начинаем с уникального значения,
+    чтобы после вытеснения счетчика не прочитать записи старого поколения"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def bump_board():
+    bump_version(BOARD_VERSION_KEY)
+    cache.set(BOARD_CHANGED_KEY, time.time(), None)
+
+
+def bump_flight(flight_id):
+    bump_version(FLIGHT_VERSION_KEY.format(flight_id))
+    bump_board()
+
+
+def bump_flights(flight_ids):
+    """Массовое изменение рейсов (импорт расписания): табло сбрасывается один раз"""
+    for flight_id in flight_ids:
+        bump_version(FLIGHT_VERSION_KEY.format(flight_id))
+    bump_board()
+
+
+def bump_airlines():
+    bump_version(AIRLINES_VERSION_KEY)
+    bump_board()
+
+
+def bump_user(user_id):
+    """Сбрасывает пользователя в кэше flights.auth"""
+    bump_version(USER_VERSION_KEY.format(user_id))
+
+
+def user_key(user_id):
+    """Ключ пользователя: прочитанный до изменения User не попадет под новую версию"""
+    return f'flights:user:{user_id}:{get_version(USER_VERSION_KEY.format(user_id))}'
+
+
+def board_changed_at():
+    """Время последнего изменения рейсов, броней или отзывов (для Last-Modified)"""
+    changed = cache.get(BOARD_CHANGED_KEY)
+    if changed is None:
+        cache.add(BOARD_CHANGED_KEY, time.time(), None)
+        changed = cache.get(BOARD_CHANGED_KEY)
+    return datetime.fromtimestamp(changed, tz=timezone.utc)
+
+
+def _board_params(request):
+    params = '\0'.join(request.GET.get(name, '') for name in ('search', 'type', 'page', 'cursor'))
+    return hashlib.md5(params.encode()).hexdigest()
+
+
+def board_page_key(request):
+    """Ключ страницы табло: (поиск, тип, страница или курсор) + версия табло"""
+    return f'flights:board:{get_version(BOARD_VERSION_KEY)}:{_board_params(request)}'
+
+
+def board_etag(request):
+    """ETag выдачи табло: меняется вместе с версией табло"""
+    return f'{get_version(BOARD_VERSION_KEY)}-{_board_params(request)}'
+
+
+def flight_page_key(request, flight_id):
+    """Ключ страницы рейса: версия рейса + версия справочника авиакомпаний"""
+    return 'flights:flight:{}:{}:{}'.format(
+        flight_id,
+        get_version(FLIGHT_VERSION_KEY.format(flight_id)),
+        get_version(AIRLINES_VERSION_KEY),
+    )
+
+
+def cache_anonymous_page(key_func):
+    """Отдает анонимным посетителям готовый HTML из кэша
+
+    key_func(request, *args, **kwargs) строит ключ страницы. Авторизованные
+    пользователи и запросы с отложенными flash-сообщениями идут мимо кэша.
+    Страница для кэша строится по основной БД: версия в ключе увеличивается
+    при фиксации на основной БД, и отставшая реплика записала бы под новую
+    версию старые данные. Подходит и для обычных, и для async-представлений.
+    """
+    def lookup(request, *args, **kwargs):
+        """(ключ, HTML из кэша); ключ None — страницу кэшировать нельзя"""
+        if (request.method != 'GET' or request.user.is_authenticated
+                or len(messages.get_messages(request))):
+            return None, None
+        key = key_func(request, *args, **kwargs)
+        content = cache.get(key)
+        CACHE_REQUESTS.inc(cache=key_func.__name__, result='miss' if content is None else 'hit')
+        return key, content
+
+    def store(key, response):
+        if key is not None and response.status_code == 200 and not response.streaming:
+            cache.set(key, response.content, settings.BOARD_CACHE_TIMEOUT)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Пользователь загружается один раз: дальше его берут
+                # и request.user, и request.auser() представления
+                request.user = await request.auser()
+                key, content = await sync_to_async(lookup)(request, *args, **kwargs)
+                if content is not None:
+                    return HttpResponse(content)
+                if key is None:
+                    return await view(request, *args, **kwargs)
+                with use_primary():
+                    response = await view(request, *args, **kwargs)
+                await sync_to_async(store)(key, response)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, content = lookup(request, *args, **kwargs)
+            if content is not None:
+                return HttpResponse(content)
+            if key is None:
+                return view(request, *args, **kwargs)
+            with use_primary():
+                response = view(request, *args, **kwargs)
+            store(key, response)
+            return response
+        return wrapper
+    return decorator
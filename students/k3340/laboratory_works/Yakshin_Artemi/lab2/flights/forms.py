@@ -1,6 +1,6 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Reservation, Review, UserProfile
+from .models import Flight, Reservation, Review, UserProfile
 
 
 class ReservationForm(forms.ModelForm):
@@ -24,13 +24,10 @@ class ReservationForm(forms.ModelForm):
         self.flight = flight
         
         if flight:
-            # Получаем занятые места
-            occupied_seats = Reservation.objects.filter(flight=flight).values_list('seat_number', flat=True)
-            if self.instance.pk:
-                # Исключаем текущее место при редактировании
-                occupied_seats = occupied_seats.exclude(pk=self.instance.pk)
-            
-            self.occupied_seats = list(occupied_seats)
+            # Карта мест уже загружена вместе с рейсом: брони не читаем
+            self.seat_map = flight.seat_map
+            letters = self.seat_map.letters
+            self.fields['seat_number'].widget.attrs['pattern'] = f'[0-9]+[{letters}]'
     
     def clean_seat_number(self):
         seat_number = self.cleaned_data['seat_number'].upper()
@@ -38,13 +35,18 @@ class ReservationForm(forms.ModelForm):
         if not seat_number:
             raise ValidationError('Необходимо указать номер места.')
         
-        # Проверяем формат
-        import re
-        if not re.match(r'^[0-9]+[A-F]$', seat_number):
-            raise ValidationError('Неверный формат номера места. Используйте формат: номер ряда + буква (например, 12A)')
+        if not hasattr(self, 'seat_map'):
+            return seat_number
         
-        # Проверяем, не занято ли место
-        if hasattr(self, 'occupied_seats') and seat_number in self.occupied_seats:
+        # Проверяем, что место есть в салоне
+        if not self.seat_map.is_valid(seat_number):
+            raise ValidationError(
+                f'Такого места нет в салоне. Ряды 1–{self.seat_map.rows}, '
+                f'буквы {", ".join(self.seat_map.letters)} (например, 12A)'
+            )
+        
+        # Проверяем, не занято ли место (свое текущее место при редактировании считается свободным)
+        if seat_number != self.instance.seat_number and not self.seat_map.is_free(seat_number):
             raise ValidationError('Это место уже занято.')
         
         return seat_number
@@ -114,3 +116,22 @@ class FlightSearchForm(forms.Form):
         widget=forms.Select(attrs={'class': 'form-control'}),
         label='Тип рейса'
     )
+
+
+class GateChangeForm(forms.Form):
+    """Параметры массовой смены гейта в админке"""
+    gate_number = forms.CharField(label='Новый гейт', max_length=Flight._meta.get_field('gate_number').max_length)
+
+
+class DelayForm(forms.Form):
+    """Параметры массовой задержки вылета в админке"""
+    minutes = forms.IntegerField(
+        label='Задержка, минут', min_value=-24 * 60, max_value=24 * 60,
+        help_text='Отрицательное значение переносит вылет на более раннее время',
+    )
+    
+    def clean_minutes(self):
+        minutes = self.cleaned_data['minutes']
+        if not minutes:
+            raise ValidationError('Задержка не может быть нулевой.')
+        return minutes
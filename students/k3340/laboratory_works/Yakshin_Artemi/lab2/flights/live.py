@@ -0,0 +1,178 @@
+"""Живое табло: рассылка изменений рейсов подписчикам (SSE)
+
+Изменение рейса превращается в одно событие одним запросом к БД
+(``flight_event``), после чего брокер раздает готовую строку всем открытым
+соединениям из памяти — тысячи простаивающих экранов не обращаются к БД.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import Flight
+
+
+EVENT_FIELDS = (
+    'id', 'flight_number', 'airline_code', 'flight_type', 'origin', 'destination',
+    'departure_time', 'arrival_time', 'gate_number', 'capacity', 'available_seats',
+)
+
+
+class Subscription:
+    """Очередь событий одного соединения, привязанная к его event loop"""
+
+    def __init__(self, broker, queue_size):
+        self.broker = broker
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+
+    def deliver(self, message):
+        """Передает сообщение из любого потока в event loop подписчика"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Event loop уже закрыт: соединение завершилось
+            self.broker.unsubscribe(self)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Медленный клиент: вместо накопления очереди просим его
+            # перечитать табло целиком
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_event('resync', {}))
+
+    async def get(self, timeout):
+        """Следующее сообщение или None, если за timeout ничего не пришло"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Брокер в памяти процесса: достаточно для одного ASGI-воркера и тестов"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscribers_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def has_listeners(self):
+        """Есть ли кому отправлять: без подписчиков событие не строится"""
+        return self.subscribers_count() > 0
+
+    def publish(self, message):
+        self.deliver_local(message)
+
+    def deliver_local(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+
+class RedisBroker(InProcessBroker):
+    """Брокер для нескольких воркеров через Redis Pub/Sub
+
+    Каждый процесс держит одну подписку на канал и раздает сообщения своим
+    соединениям из памяти. Требуется пакет redis.
+    """
+
+    channel = 'flights:live'
+
+    def __init__(self, url=None, queue_size=100):
+        import redis
+
+        super().__init__(queue_size)
+        self.url = url or settings.BOARD_BROKER_URL
+        self._client = redis.Redis.from_url(self.url)
+        self._listener = None
+
+    def subscribe(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+        return super().subscribe()
+
+    def has_listeners(self):
+        # Подписчики могут быть в других процессах
+        return True
+
+    def publish(self, message):
+        self._client.publish(self.channel, message)
+
+    def _listen(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for item in pubsub.listen():
+            self.deliver_local(item['data'].decode())
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Брокер из настройки BOARD_BROKER (один на процесс)"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.BOARD_BROKER)()
+        return _broker
+
+
+def format_event(event, data):
+    """Сообщение в формате text/event-stream"""
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+def flight_event(flight_id):
+    """Текущее состояние рейса для табло — ровно один запрос"""
+    # Только что зафиксированное изменение читаем с основной БД: реплика
+    # может еще не получить его
+    row = (
+        Flight.objects.using(DEFAULT_DB_ALIAS).filter(pk=flight_id)
+        .annotate(airline_code=F('airline__code'), available_seats=F('capacity') - F('reserved_count'))
+        .values(*EVENT_FIELDS)
+        .first()
+    )
+    if row is None:
+        return format_event('flight_deleted', {'id': flight_id})
+    return format_event('flight', row)
+
+
+def publish_flight(flight_id):
+    """Рассылает состояние рейса всем подписчикам (вызывается после commit)"""
+    broker = get_broker()
+    if broker.has_listeners():
+        broker.publish(flight_event(flight_id))
@@ -0,0 +1,250 @@
+import asyncio
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from flights.models import Flight, Reservation
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочные замеры на текущей БД (запускать после load_sample_data). '
+            'views — страницы табло через WSGI- и ASGI-обработчик Django; '
+            'connections — цена открытия соединения с БД на каждый запрос; '
+            'auth — регистрация и вход: время и число SQL-запросов; '
+            'sessions — авторизованные страницы с сессией и пользователем из БД, '
+            'cached_db и signed_cookies с кэшем пользователя')
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', choices=['views', 'connections', 'auth', 'sessions'], help='Что измерять')
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на каждый обработчик')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Одновременных клиентов (потоков для WSGI, задач для ASGI)')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Не отключать кэш страниц (по умолчанию замеряются сами представления)')
+        parser.add_argument('--fast-hashers', action='store_true',
+                            help='MD5 вместо PBKDF2 (замер без стоимости хэширования паролей)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        settings_override = {'ALLOWED_HOSTS': ['*']}
+        if options['fast_hashers']:
+            settings_override['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        # Авторизованные страницы мимо кэша страниц, а кэш нужен для сессий и пользователя
+        if not options['with_cache'] and options['mode'] != 'sessions':
+            settings_override['CACHES'] = {
+                'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+            }
+        with override_settings(**settings_override):
+            getattr(self, f'bench_{options["mode"]}')(options)
+
+    def report(self, title, latencies, elapsed):
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+        self.stdout.write(
+            f'{title:<18} {len(latencies) / elapsed:8.1f} запр/с   '
+            f'p50 {statistics.median(latencies) * 1000:7.1f} мс   p95 {p95 * 1000:7.1f} мс'
+        )
+
+    # views
+
+    def view_urls(self, count):
+        """Смесь страниц: табло, карточки рейсов и брони пользователя"""
+        flight_ids = list(Flight.objects.values_list('pk', flat=True)[:1000])
+        user_id = Reservation.objects.values_list('user_id', flat=True).first()
+        if not flight_ids or user_id is None:
+            raise CommandError('БД пуста: сначала выполните load_sample_data')
+
+        pages = []
+        for index in range(count):
+            kind = index % 3
+            if kind == 0:
+                pages.append((reverse('flight_list'), False))
+            elif kind == 1:
+                pages.append((reverse('flight_detail', args=[self.rng.choice(flight_ids)]), False))
+            else:
+                pages.append((reverse('user_reservations'), True))
+        return pages, User.objects.get(pk=user_id)
+
+    def bench_views(self, options):
+        pages, user = self.view_urls(options['requests'])
+        concurrency = options['concurrency']
+        self.stdout.write(f'{len(pages)} запросов, {concurrency} клиентов, '
+                          f'БД {connections["default"].vendor}')
+
+        latencies, elapsed = self.run_wsgi(pages, user, concurrency)
+        self.report('WSGI', latencies, elapsed)
+        latencies, elapsed = asyncio.run(self.run_asgi(pages, user, concurrency))
+        self.report('ASGI', latencies, elapsed)
+
+    def run_wsgi(self, pages, user, concurrency):
+        local = threading.local()
+
+        def fetch(page):
+            url, authenticated = page
+            if not hasattr(local, 'clients'):
+                local.clients = (Client(), Client())
+                local.clients[1].force_login(user)
+            started = time.perf_counter()
+            response = local.clients[authenticated].get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: HTTP {response.status_code}')
+            return time.perf_counter() - started
+
+        def worker(chunk):
+            try:
+                return [fetch(page) for page in chunk]
+            finally:
+                connections.close_all()
+
+        chunks = [pages[index::concurrency] for index in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = [value for chunk in executor.map(worker, chunks) for value in chunk]
+        return latencies, time.perf_counter() - started
+
+    async def run_asgi(self, pages, user, concurrency):
+        async def worker(chunk):
+            clients = (AsyncClient(), AsyncClient())
+            await clients[1].aforce_login(user)
+            latencies = []
+            for url, authenticated in chunk:
+                started = time.perf_counter()
+                response = await clients[authenticated].get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url}: HTTP {response.status_code}')
+                latencies.append(time.perf_counter() - started)
+            return latencies
+
+        chunks = [pages[index::concurrency] for index in range(concurrency)]
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker(chunk) for chunk in chunks))
+        return [value for chunk in results for value in chunk], time.perf_counter() - started
+
+    # connections
+
+    def bench_connections(self, options):
+        """Одни и те же запросы с новым соединением на каждый запрос и с постоянным"""
+        flight_id = Flight.objects.values_list('pk', flat=True).first()
+        if flight_id is None:
+            raise CommandError('БД пуста: сначала выполните load_sample_data')
+        url = reverse('flight_detail', args=[flight_id])
+        settings_dict = connections[DEFAULT_DB_ALIAS].settings_dict
+        configured = settings_dict['CONN_MAX_AGE']
+        self.stdout.write(f'{options["requests"]} запросов {url}, БД {connections[DEFAULT_DB_ALIAS].vendor}')
+
+        if settings_dict['OPTIONS'].get('pool'):
+            # Пул не отключается на лету: для сравнения запустите еще раз с DB_POOL=False
+            variants = [('пул psycopg', 0)]
+        else:
+            persistent = configured or 600
+            variants = [('CONN_MAX_AGE=0', 0), (f'CONN_MAX_AGE={persistent}', persistent)]
+
+        opened = []
+        count_connection = lambda sender, connection, **kwargs: opened.append(connection.alias)
+        connection_created.connect(count_connection)
+        try:
+            for title, max_age in variants:
+                connections.close_all()
+                settings_dict['CONN_MAX_AGE'] = max_age
+                opened.clear()
+                client = Client()
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(options['requests']):
+                    request_started = time.perf_counter()
+                    # Тестовый клиент не закрывает соединения сам: повторяем то,
+                    # что делает WSGI-обработчик в начале и конце запроса
+                    close_old_connections()
+                    client.get(url)
+                    close_old_connections()
+                    latencies.append(time.perf_counter() - request_started)
+                self.report(title, latencies, time.perf_counter() - started)
+                self.stdout.write(f'{"":<18} открыто соединений: {len(opened)}')
+        finally:
+            connection_created.disconnect(count_connection)
+            settings_dict['CONN_MAX_AGE'] = configured
+            connections.close_all()
+
+    # auth
+
+    def bench_auth(self, options):
+        """Регистрация и вход по одному запросу за раз; пользователи удаляются после замера"""
+        count = options['requests']
+        prefix = f'bench{self.rng.randrange(10 ** 6)}_'
+        password = 'Bench-password-2025'
+        self.stdout.write(f'{count} регистраций и входов, БД {connections[DEFAULT_DB_ALIAS].vendor}')
+
+        def register(index):
+            return Client().post(reverse('register'), {
+                'username': f'{prefix}{index}', 'password1': password, 'password2': password,
+                'phone': '+79990000000', 'passport_number': '4510 123456',
+            })
+
+        def log_in(index):
+            return Client().post(reverse('login'), {'username': f'{prefix}{index}', 'password': password})
+
+        try:
+            for title, request in (('регистрация', register), ('вход', log_in)):
+                latencies, queries = [], []
+                started = time.perf_counter()
+                for index in range(count):
+                    request_started = time.perf_counter()
+                    with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as captured:
+                        response = request(index)
+                    if response.status_code != 302:
+                        raise CommandError(f'{title}: HTTP {response.status_code}')
+                    latencies.append(time.perf_counter() - request_started)
+                    queries.append(len(captured))
+                self.report(title, latencies, time.perf_counter() - started)
+                self.stdout.write(f'{"":<18} SQL-запросов на запрос: {min(queries)}–{max(queries)}')
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    # sessions
+
+    SESSION_VARIANTS = [
+        ('db', 'django.contrib.sessions.backends.db', 0),
+        ('cached_db+user', 'django.contrib.sessions.backends.cached_db', 300),
+        ('signed+user', 'django.contrib.sessions.backends.signed_cookies', 300),
+    ]
+
+    def bench_sessions(self, options):
+        """Одни и те же авторизованные страницы при разном хранении сессии и User"""
+        user_id = Reservation.objects.values_list('user_id', flat=True).first()
+        flight_id = Flight.objects.values_list('pk', flat=True).first()
+        if user_id is None:
+            raise CommandError('БД пуста: сначала выполните load_sample_data')
+        user = User.objects.get(pk=user_id)
+        urls = [reverse('user_reservations'), reverse('flight_detail', args=[flight_id])]
+        self.stdout.write(f'{options["requests"]} запросов {", ".join(urls)}, '
+                          f'БД {connections[DEFAULT_DB_ALIAS].vendor}')
+
+        for title, engine, user_cache_timeout in self.SESSION_VARIANTS:
+            with override_settings(SESSION_ENGINE=engine, USER_CACHE_TIMEOUT=user_cache_timeout):
+                client = Client()
+                client.force_login(user)
+                # Первый запрос заполняет кэш сессии и пользователя
+                client.get(urls[0])
+                latencies, queries = [], []
+                started = time.perf_counter()
+                for index in range(options['requests']):
+                    url = urls[index % len(urls)]
+                    request_started = time.perf_counter()
+                    with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as captured:
+                        response = client.get(url)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url}: HTTP {response.status_code}')
+                    latencies.append(time.perf_counter() - request_started)
+                    queries.append(len(captured))
+                self.report(title, latencies, time.perf_counter() - started)
+                self.stdout.write(f'{"":<18} SQL-запросов на запрос: {statistics.mean(queries):.1f}')
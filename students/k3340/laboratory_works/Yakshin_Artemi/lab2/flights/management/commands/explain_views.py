@@ -0,0 +1,83 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from flights.models import Flight, Reservation, Review
+from flights.views import board_queryset
+
+
+# Строки плана, означающие полный просмотр таблицы
+FULL_SCAN_PATTERNS = {
+    'postgresql': r'Seq Scan on {table}\b',
+    'sqlite': r'\bSCAN {table}\b(?! USING (COVERING )?INDEX)',
+}
+INDEX_PATTERNS = {
+    'postgresql': r'(?:Index Scan|Index Only Scan|Bitmap Index Scan)(?: Backward)? (?:using|on) (\w+)',
+    'sqlite': r'USING (?:COVERING )?INDEX (\w+)|USING (INTEGER PRIMARY KEY)',
+}
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для основных запросов страниц и сообщает, '
+            'используются ли индексы (запускать на заполненной БД)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strict', action='store_true',
+                            help='Завершиться с ошибкой, если основная таблица читается полным просмотром')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f'Разбор планов для {vendor} не поддерживается')
+
+        failures = []
+        for name, table, queryset, indexed_on in self.view_querysets():
+            plan = queryset.explain()
+            indexes = sorted({next(group for group in match.groups() if group)
+                              for match in re.finditer(INDEX_PATTERNS[vendor], plan)})
+            full_scan = re.search(FULL_SCAN_PATTERNS[vendor].format(table=table), plan)
+
+            if full_scan and vendor not in indexed_on:
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: полный просмотр {table} (индекс есть только для {", ".join(indexed_on)})'))
+            elif full_scan:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: полный просмотр {table}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: {table} по индексу'))
+            self.stdout.write(f'  индексы: {", ".join(indexes) or "—"}')
+            if options['verbosity'] > 1:
+                self.stdout.write('  ' + plan.replace('\n', '\n  '))
+
+        if failures and options['strict']:
+            raise CommandError(f'Без индекса: {", ".join(failures)}')
+
+    def view_querysets(self):
+        """(название, основная таблица, queryset, СУБД с индексом) для каждой страницы"""
+        flight = Flight.objects.order_by('pk').first()
+        flight_id = flight.pk if flight else 0
+        user_id = Reservation.objects.values_list('user_id', flat=True).first() or 0
+        flights_table = Flight._meta.db_table
+        page = slice(0, 13)
+        everywhere = set(FULL_SCAN_PATTERNS)
+
+        return [
+            ('flight_list', flights_table,
+             board_queryset().order_by('departure_time', 'id')[page], everywhere),
+            ('flight_list?type', flights_table,
+             board_queryset(flight_type='departure').order_by('departure_time', 'id')[page], everywhere),
+            # LIKE '%...%' индексируется только триграммами PostgreSQL (миграция 0003)
+            ('flight_list?search', flights_table,
+             board_queryset(search_query='SU1')[page], {'postgresql'}),
+            ('flight_detail', flights_table,
+             Flight.objects.select_related('airline').filter(pk=flight_id), everywhere),
+            ('flight_detail:reviews', Review._meta.db_table,
+             Review.objects.select_related('user').filter(flight_id=flight_id).order_by('-created_at'),
+             everywhere),
+            ('flight_detail:passengers', Reservation._meta.db_table,
+             Reservation.objects.select_related('user').filter(flight_id=flight_id).order_by('seat_number'),
+             everywhere),
+            ('user_reservations', Reservation._meta.db_table,
+             Reservation.objects.select_related('flight__airline').filter(user_id=user_id)
+             .order_by('-created_at', '-id')[page], everywhere),
+        ]
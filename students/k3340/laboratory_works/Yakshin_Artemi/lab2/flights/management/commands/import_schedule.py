@@ -0,0 +1,52 @@
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from flights.schedule import SCHEDULE_FIELDS, ScheduleImporter, read_rows
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+SHOWN_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = ('Загружает расписание рейсов из CSV или NDJSON (по объекту JSON в строке). '
+            'Рейс определяется ключом airline (код), flight_number, departure_time; '
+            f'существующие рейсы обновляются ({", ".join(SCHEDULE_FIELDS)}). '
+            'Повторная загрузка того же файла ничего не меняет')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл расписания или - для стандартного ввода')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or FORMATS.get(Path(path).suffix.lower())
+        if file_format is None:
+            raise CommandError('Не удалось определить формат по расширению: укажите --format')
+
+        importer = ScheduleImporter(options['batch_size'])
+        started = time.perf_counter()
+        try:
+            # utf-8-sig: файлы из Excel начинаются с BOM
+            file = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+        with file:
+            for stats in importer.run(read_rows(file, file_format)):
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'  строк: {stats["rows"]} ({stats["rows"] / max(elapsed, 1e-9):.0f} строк/с)')
+
+        for line_number, message in importer.errors[:SHOWN_ERRORS]:
+            self.stderr.write(f'Строка {line_number}: {message}')
+        if len(importer.errors) > SHOWN_ERRORS:
+            self.stderr.write(f'... и еще {len(importer.errors) - SHOWN_ERRORS} ошибок')
+
+        stats = importer.stats
+        elapsed = time.perf_counter() - started
+        summary = (f'Обработано {stats["rows"]} строк за {elapsed:.1f} с ({stats["rows"] / max(elapsed, 1e-9):.0f} строк/с): '
+                   f'создано {stats["created"]}, обновлено {stats["updated"]}, '
+                   f'без изменений {stats["unchanged"]}, с ошибками {stats["errors"]}')
+        self.stdout.write(self.style.WARNING(summary) if stats['errors'] else self.style.SUCCESS(summary))
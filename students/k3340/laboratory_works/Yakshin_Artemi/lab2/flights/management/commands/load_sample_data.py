@@ -1,28 +1,112 @@
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from datetime import timedelta
+from flights import cache
 from flights.models import Airline, Flight, Reservation, Review
+from flights.tickets import ticket_numbers
 import random
+import time
+
+
+REVIEW_TEXTS = [
+    'Отличный рейс! Все прошло гладко.',
+    'Хорошее обслуживание, вовремя прилетели.',
+    'Неплохо, но можно было бы и лучше.',
+    'Экипаж очень вежливый, полет комфортный.',
+    'Задержка была, но в целом нормально.',
+    'Превосходное качество обслуживания!',
+    'Среднее качество за свою цену.',
+    'Рекомендую эту авиакомпанию!',
+]
+
+CITIES = [
+    ('Москва', 'Санкт-Петербург'),
+    ('Москва', 'Сочи'),
+    ('Санкт-Петербург', 'Екатеринбург'),
+    ('Москва', 'Новосибирск'),
+    ('Санкт-Петербург', 'Калининград'),
+    ('Москва', 'Краснодар'),
+    ('Сочи', 'Екатеринбург'),
+    ('Новосибирск', 'Владивосток'),
+]
+
+AIRLINES = [
+    {'name': 'Аэрофлот', 'code': 'SU'},
+    {'name': 'S7 Airlines', 'code': 'S7'},
+    {'name': 'Россия', 'code': 'FV'},
+    {'name': 'ЮТэйр', 'code': 'UT'},
+    {'name': 'Победа', 'code': 'DP'},
+]
 
 
 class Command(BaseCommand):
-    help = 'Загружает образцы данных для демонстрации приложения'
+    help = ('Загружает образцы данных для демонстрации приложения; с параметрами '
+            '--flights/--reservations/--reviews строит большую базу для нагрузочных тестов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flights', type=int, default=20, help='Количество рейсов')
+        parser.add_argument('--reservations', type=int, default=15, help='Количество резервирований')
+        parser.add_argument('--reviews', type=int, default=10, help='Количество отзывов')
+        parser.add_argument('--users', type=int, default=5, help='Количество тестовых пользователей')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки bulk_create')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Зерно генератора: одинаковые параметры дают одинаковые данные')
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Начинаю загрузку образцов данных...'))
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        airlines = self.create_airlines()
+        self.create_admin()
+        user_ids = self.create_users(options['users'])
 
-        # Создаем авиакомпании
-        airlines_data = [
-            {'name': 'Аэрофлот', 'code': 'SU'},
-            {'name': 'S7 Airlines', 'code': 'S7'},
-            {'name': 'Россия', 'code': 'FV'},
-            {'name': 'ЮТэйр', 'code': 'UT'},
-            {'name': 'Победа', 'code': 'DP'},
-        ]
+        flights_count = options['flights']
+        reservations = self.spread(options['reservations'], flights_count, cap=None)
+        reviews = self.spread(options['reviews'], flights_count, cap=len(user_ids))
 
+        created = {'flights': 0, 'reservations': 0, 'reviews': 0}
+        self.airline_ratings = {}
+        for offset in range(0, flights_count, self.batch_size):
+            batch = range(offset, min(offset + self.batch_size, flights_count))
+            with transaction.atomic():
+                counts = self.create_flight_batch(airlines, user_ids, batch, reservations, reviews)
+            for key, value in counts.items():
+                created[key] += value
+            self.stdout.write(f'  рейсов: {created["flights"]}/{flights_count}, '
+                              f'резервирований: {created["reservations"]}, отзывов: {created["reviews"]}')
+
+        # bulk_create не отправляет сигналы: сводку рейтинга авиакомпаний
+        # дополняем и кэш табло сбрасываем вручную
+        for airline_id, (rating_sum, rating_count) in self.airline_ratings.items():
+            Airline.objects.filter(pk=airline_id).update(
+                rating_sum=F('rating_sum') + rating_sum,
+                rating_count=F('rating_count') + rating_count,
+            )
+        cache.bump_board()
+
+        elapsed = time.perf_counter() - started
+        total = sum(created.values())
+        self.stdout.write(f'Создано {created["flights"]} рейсов, {created["reservations"]} резервирований, '
+                          f'{created["reviews"]} отзывов за {elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f} строк/с)')
+        self.stdout.write(
+            self.style.SUCCESS('Загрузка образцов данных завершена!')
+        )
+        self.stdout.write(
+            self.style.WARNING('Для входа в админку используйте: admin/admin123')
+        )
+        self.stdout.write(
+            self.style.WARNING(f'Тестовые пользователи: user1-user{len(user_ids)}/password123')
+        )
+
+    def create_airlines(self):
         airlines = []
-        for airline_data in airlines_data:
+        for airline_data in AIRLINES:
             airline, created = Airline.objects.get_or_create(
                 code=airline_data['code'],
                 defaults={'name': airline_data['name']}
@@ -30,51 +114,9 @@ class Command(BaseCommand):
             airlines.append(airline)
             if created:
                 self.stdout.write(f'Создана авиакомпания: {airline.name}')
+        return airlines
 
-        # Создаем рейсы
-        cities = [
-            ('Москва', 'Санкт-Петербург'),
-            ('Москва', 'Сочи'),
-            ('Санкт-Петербург', 'Екатеринбург'),
-            ('Москва', 'Новосибирск'),
-            ('Санкт-Петербург', 'Калининград'),
-            ('Москва', 'Краснодар'),
-            ('Сочи', 'Екатеринбург'),
-            ('Новосибирск', 'Владивосток'),
-        ]
-
-        flights = []
-        for i in range(20):
-            airline = random.choice(airlines)
-            origin, destination = random.choice(cities)
-            
-            # Случайное время в ближайшие 30 дней
-            departure_time = timezone.now() + timedelta(
-                days=random.randint(0, 30),
-                hours=random.randint(6, 22),
-                minutes=random.choice([0, 15, 30, 45])
-            )
-            
-            flight_duration = timedelta(hours=random.randint(1, 8), minutes=random.choice([0, 30]))
-            arrival_time = departure_time + flight_duration
-            
-            flight = Flight.objects.create(
-                flight_number=f'{airline.code}{random.randint(100, 999)}',
-                airline=airline,
-                departure_time=departure_time,
-                arrival_time=arrival_time,
-                flight_type=random.choice(['departure', 'arrival']),
-                gate_number=f'{random.randint(1, 20)}{random.choice("ABCD")}',
-                origin=origin,
-                destination=destination,
-                capacity=random.choice([100, 150, 200, 250]),
-                price=random.randint(5000, 25000)
-            )
-            flights.append(flight)
-
-        self.stdout.write(f'Создано {len(flights)} рейсов')
-
-        # Создаем тестового пользователя-администратора
+    def create_admin(self):
         admin_user, created = User.objects.get_or_create(
             username='admin',
             defaults={
@@ -90,79 +132,129 @@ class Command(BaseCommand):
             admin_user.save()
             self.stdout.write('Создан администратор: admin/admin123')
 
-        # Создаем тестовых пользователей
-        test_users = []
-        for i in range(5):
-            user, created = User.objects.get_or_create(
-                username=f'user{i+1}',
-                defaults={
-                    'email': f'user{i+1}@example.com',
-                    'first_name': f'Пользователь',
-                    'last_name': f'{i+1}',
-                }
+    def create_users(self, count):
+        """Тестовые пользователи user1..userN с одним заранее вычисленным хэшем пароля"""
+        usernames = [f'user{i + 1}' for i in range(count)]
+        existing = dict(User.objects.filter(username__startswith='user').values_list('username', 'pk'))
+        missing = [name for name in usernames if name not in existing]
+
+        password = make_password('password123')
+        for offset in range(0, len(missing), self.batch_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=name, email=f'{name}@example.com', password=password,
+                         first_name='Пользователь', last_name=name[4:])
+                    for name in missing[offset:offset + self.batch_size]
+                ])
+            existing.update((user.username, user.pk) for user in users)
+
+        self.stdout.write(f'Создано {len(missing)} тестовых пользователей')
+        return [existing[name] for name in usernames]
+
+    def spread(self, total, flights_count, cap):
+        """Случайно распределяет total строк по рейсам (не больше cap на рейс)"""
+        counts = [0] * flights_count
+        if not flights_count or cap == 0:
+            return counts
+        if cap is not None:
+            total = min(total, cap * flights_count)
+        for _ in range(total):
+            counts[self.rng.randrange(flights_count)] += 1
+        if cap is not None:
+            # Излишки переносим на соседние рейсы
+            overflow = 0
+            for index in range(flights_count * 2):
+                index %= flights_count
+                if counts[index] > cap:
+                    overflow += counts[index] - cap
+                    counts[index] = cap
+                elif overflow and counts[index] < cap:
+                    moved = min(overflow, cap - counts[index])
+                    counts[index] += moved
+                    overflow -= moved
+        return counts
+
+    def create_flight_batch(self, airlines, user_ids, batch, reservation_counts, review_counts):
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        flights = []
+        seats = []
+        ratings = []
+        for index in batch:
+            airline = self.rng.choice(airlines)
+            origin, destination = self.rng.choice(CITIES)
+
+            # Случайное время в ближайшие 30 дней
+            departure_time = now + timedelta(
+                days=self.rng.randint(0, 30),
+                hours=self.rng.randint(6, 22),
+                minutes=self.rng.choice([0, 15, 30, 45])
             )
-            if created:
-                user.set_password('password123')
-                user.save()
-                test_users.append(user)
-
-        self.stdout.write(f'Создано {len(test_users)} тестовых пользователей')
-
-        # Создаем некоторые резервирования
-        for i in range(15):
-            user = random.choice(test_users)
-            flight = random.choice(flights)
-            
-            # Проверяем, нет ли уже резервирования у этого пользователя на этот рейс
-            if not Reservation.objects.filter(user=user, flight=flight).exists():
-                seat_number = f'{random.randint(1, 30)}{random.choice("ABCDEF")}'
-                
-                # Проверяем, свободно ли место
-                if not Reservation.objects.filter(flight=flight, seat_number=seat_number).exists():
-                    reservation = Reservation.objects.create(
-                        user=user,
-                        flight=flight,
-                        seat_number=seat_number,
-                        ticket_number=f'T{random.randint(100000, 999999)}'
-                    )
-
-        reservations_count = Reservation.objects.count()
-        self.stdout.write(f'Создано {reservations_count} резервирований')
-
-        # Создаем отзывы
-        review_texts = [
-            'Отличный рейс! Все прошло гладко.',
-            'Хорошее обслуживание, вовремя прилетели.',
-            'Неплохо, но можно было бы и лучше.',
-            'Экипаж очень вежливый, полет комфортный.',
-            'Задержка была, но в целом нормально.',
-            'Превосходное качество обслуживания!',
-            'Среднее качество за свою цену.',
-            'Рекомендую эту авиакомпанию!',
-        ]
-
-        for i in range(10):
-            user = random.choice(test_users)
-            flight = random.choice(flights)
-            
-            # Проверяем, нет ли уже отзыва от этого пользователя на этот рейс
-            if not Review.objects.filter(user=user, flight=flight).exists():
-                Review.objects.create(
-                    user=user,
-                    flight=flight,
-                    text=random.choice(review_texts),
-                    rating=random.randint(6, 10)
-                )
+            flight_duration = timedelta(hours=self.rng.randint(1, 8), minutes=self.rng.choice([0, 30]))
 
-        reviews_count = Review.objects.count()
-        self.stdout.write(f'Создано {reviews_count} отзывов')
+            flight = Flight(
+                flight_number=f'{airline.code}{self.rng.randint(100, 999)}',
+                airline=airline,
+                departure_time=departure_time,
+                arrival_time=departure_time + flight_duration,
+                flight_type=self.rng.choice(['departure', 'arrival']),
+                gate_number=f'{self.rng.randint(1, 20)}{self.rng.choice("ABCD")}',
+                origin=origin,
+                destination=destination,
+                capacity=self.rng.choice([100, 150, 200, 250]),
+                price=self.rng.randint(5000, 25000),
+            )
 
-        self.stdout.write(
-            self.style.SUCCESS('Загрузка образцов данных завершена!')
-        )
-        self.stdout.write(
-            self.style.WARNING('Для входа в админку используйте: admin/admin123')
-        )
-        self.stdout.write(
-            self.style.WARNING('Тестовые пользователи: user1-user5/password123')
-        )
+            # Места выбираются без повторов прямо в памяти, счетчик и карта
+            # мест заполняются до вставки — пересчет после загрузки не нужен
+            seat_map = flight.seat_map
+            taken = self.rng.sample(range(seat_map.size), min(reservation_counts[index], flight.capacity))
+            for seat_index in taken:
+                seat_map.occupy(seat_map.seat_number(seat_index))
+            flight.reserved_count = len(taken)
+            flight.seat_bitmap = seat_map.to_bytes()
+            flights.append(flight)
+            seats.append([seat_map.seat_number(seat_index) for seat_index in taken])
+
+            # Отзывы тоже выбираются заранее, чтобы записать сводку рейтинга
+            flight_reviews = [(user_id, self.rng.randint(6, 10))
+                              for user_id in self.rng.sample(user_ids, review_counts[index])]
+            flight.rating_sum = sum(rating for _, rating in flight_reviews)
+            flight.rating_count = len(flight_reviews)
+            totals = self.airline_ratings.setdefault(airline.pk, [0, 0])
+            totals[0] += flight.rating_sum
+            totals[1] += flight.rating_count
+            ratings.append(flight_reviews)
+
+        # Ключ расписания (авиакомпания, номер, время вылета) уникален: номер,
+        # совпавший с уже существующим рейсом, выбирается заново
+        taken = set(Flight.objects.filter(
+            departure_time__in={flight.departure_time for flight in flights},
+        ).values_list('airline_id', 'flight_number', 'departure_time'))
+        for flight in flights:
+            while (flight.airline_id, flight.flight_number, flight.departure_time) in taken:
+                flight.flight_number = f'{flight.airline.code}{self.rng.randint(100, 999)}'
+            taken.add((flight.airline_id, flight.flight_number, flight.departure_time))
+        Flight.objects.bulk_create(flights, batch_size=self.batch_size)
+
+        # Номера билетов для всей пачки — одним обращением к счетчику
+        tickets = iter(ticket_numbers.bulk(sum(len(flight_seats) for flight_seats in seats)))
+        reservations = []
+        reviews = []
+        for flight, flight_seats, flight_reviews in zip(flights, seats, ratings):
+            for seat_number in flight_seats:
+                reservations.append(Reservation(
+                    user_id=self.rng.choice(user_ids),
+                    flight=flight,
+                    seat_number=seat_number,
+                    ticket_number=next(tickets),
+                ))
+            for user_id, rating in flight_reviews:
+                reviews.append(Review(
+                    user_id=user_id,
+                    flight=flight,
+                    text=self.rng.choice(REVIEW_TEXTS),
+                    rating=rating,
+                ))
+        Reservation.objects.bulk_create(reservations, batch_size=self.batch_size)
+        Review.objects.bulk_create(reviews, batch_size=self.batch_size)
+        return {'flights': len(flights), 'reservations': len(reservations), 'reviews': len(reviews)}
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from flights.models import Airline, Flight, Review
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает сводки рейтинга (rating_sum/rating_count) рейсов '
+            'и авиакомпаний по таблице отзывов')
+
+    def handle(self, *args, **options):
+        # Два UPDATE с коррелированными подзапросами: рейсы по отзывам,
+        # авиакомпании по уже пересчитанным рейсам
+        reviews = Review.objects.filter(flight=OuterRef('pk')).order_by().values('flight')
+        flights = Flight.objects.filter(airline=OuterRef('pk')).order_by().values('airline')
+        with transaction.atomic():
+            updated = Flight.objects.update(
+                rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+                rating_count=Coalesce(Subquery(reviews.annotate(total=Count('pk')).values('total')), 0),
+            )
+            Airline.objects.update(
+                rating_sum=Coalesce(Subquery(flights.annotate(total=Sum('rating_sum')).values('total')), 0),
+                rating_count=Coalesce(Subquery(flights.annotate(total=Sum('rating_count')).values('total')), 0),
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Рейтинги пересчитаны для {updated} рейсов'))
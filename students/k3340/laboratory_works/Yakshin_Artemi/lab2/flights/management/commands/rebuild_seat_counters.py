@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from flights.models import Flight, Reservation
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики занятых мест (Flight.reserved_count) '
+            'и карты мест (Flight.seat_bitmap) по таблице резервирований')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Размер пачки при записи карт мест')
+
+    def handle(self, *args, **options):
+        # Один UPDATE с коррелированным подзапросом по сгруппированным резервированиям
+        counts = (
+            Reservation.objects.filter(flight=OuterRef('pk'))
+            .order_by()
+            .values('flight')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        with transaction.atomic():
+            updated = Flight.objects.update(reserved_count=Coalesce(Subquery(counts), 0))
+
+            # Карты мест: один потоковый проход по броням и пакетная запись
+            flights = Flight.objects.select_related('seat_layout').only(
+                'capacity', 'seat_layout__rows', 'seat_layout__seat_letters'
+            )
+            seat_maps = {}
+            for flight in flights.iterator(chunk_size=options['batch_size']):
+                flight.seat_bitmap = b''
+                seat_maps[flight.pk] = flight.seat_map
+            reservations = Reservation.objects.values_list('flight_id', 'seat_number')
+            for flight_id, seat_number in reservations.iterator(chunk_size=10000):
+                seat_map = seat_maps[flight_id]
+                if seat_map.is_valid(seat_number):
+                    seat_map.occupy(seat_number)
+            Flight.objects.bulk_update(
+                [Flight(pk=pk, seat_bitmap=seat_map.to_bytes()) for pk, seat_map in seat_maps.items()],
+                ['seat_bitmap'], batch_size=options['batch_size'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Счетчики и карты мест пересчитаны для {updated} рейсов'))
@@ -0,0 +1,68 @@
+import os
+import signal
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from flights import tasks
+
+# Как часто воркер удаляет старые выполненные задания (секунды)
+PURGE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = ('Выполняет задания очереди flights.tasks (массовые действия админки, письма '
+            'с подтверждением брони, пересчет счетчиков). Воркеров можно запускать '
+            'сколько угодно: каждое задание забирает один из них')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задания и завершиться')
+        parser.add_argument('--max-jobs', type=int,
+                            help='Завершиться после стольких заданий (перезапуск воркера внешним супервизором)')
+        parser.add_argument('--poll', type=float, default=settings.TASK_POLL_SECONDS,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--purge-done-after', type=int, default=settings.TASK_PURGE_DONE_AFTER_HOURS,
+                            help='Удалять выполненные задания старше стольких часов (0 — не удалять)')
+        parser.add_argument('--name', default=f'{socket.gethostname()}:{os.getpid()}',
+                            help='Имя воркера в заданиях (по умолчанию хост:pid)')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Текущее задание дорабатывается, новое не берется
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        name, max_jobs = options['name'], options['max_jobs']
+        self.stdout.write(f'Воркер {name} запущен')
+        done = 0
+        purged_at = None
+        while not self.stopping and (max_jobs is None or done < max_jobs):
+            # Процесс живет долго: соединения закрываются по CONN_MAX_AGE и после ошибок
+            close_old_connections()
+            if options['purge_done_after'] and (purged_at is None or time.monotonic() - purged_at > PURGE_INTERVAL):
+                purged_at = time.monotonic()
+                self.purge(options['purge_done_after'])
+            job = tasks.claim(name)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+                continue
+            result = tasks.execute(job)
+            done += 1
+            self.stdout.write(f'  задание №{job.pk} ({job.action}), попытка {job.attempts}: {result}')
+        close_old_connections()
+        self.stdout.write(self.style.SUCCESS(f'Воркер {name} остановлен, выполнено заданий: {done}'))
+
+    def purge(self, hours):
+        deleted = tasks.purge_done(timezone.now() - timedelta(hours=hours))
+        if deleted:
+            self.stdout.write(f'  удалено выполненных заданий старше {hours} ч: {deleted}')
+
+    def stop(self, signum, frame):
+        self.stopping = True
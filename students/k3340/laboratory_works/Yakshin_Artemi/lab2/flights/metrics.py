@@ -0,0 +1,382 @@
+"""Метрики в формате Prometheus
+
+Запись метрики не берет блокировок: у каждого потока свой шард (словарь),
+в который пишет только он сам. При выдаче /metrics шарды всех потоков
+копируются и суммируются. Шард завершившегося потока (под ASGI каждый
+запрос выполняет синхронный код в новом потоке) переносится в общую сумму
+завершенных потоков, поэтому число шардов не растет с числом запросов.
+
+Если задан METRICS_MULTIPROCESS_DIR, каждый процесс (воркер gunicorn) раз
+в METRICS_FLUSH_SECONDS и при выходе сохраняет свой срез в файл
+<pid>-<метка запуска>.json этого каталога, а /metrics суммирует файлы всех
+процессов. Метка не дает новому процессу с тем же pid затереть срез
+старого. Файлы завершившихся процессов, как в mark_process_dead
+prometheus_client, удаляются, но их срезы прибавляются к retired.json,
+поэтому счетчики не уменьшаются при перезапуске воркеров. Режим рассчитан
+на POSIX (gunicorn): каталог блокируется через fcntl.flock.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Файлы каталога METRICS_MULTIPROCESS_DIR: срезы процессов (до метки
+# запуска файлы назывались <pid>.json) и сумма завершившихся процессов
+PROCESS_FILE_RE = re.compile(r'^(\d+)(?:-[0-9a-f]+)?\.json$')
+RETIRED_FILE = 'retired.json'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._shards = []
+        self._retired = {}
+        # Шарды завершившихся потоков до переноса в _retired (см. _retire)
+        self._finished = deque()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self._file_pid = None
+        self._file_name = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def shard(self):
+        """Словарь текущего потока; блокировка нужна только при его создании"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            # Объект потока удаляется после его завершения
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+            self._start_flusher()
+        return shard
+
+    def _retire(self, shard):
+        """Откладывает шард завершившегося потока до следующего snapshot()
+
+        Финализатор вызывает сборщик мусора в любом потоке, в том числе в
+        том, что уже держит self._lock, поэтому здесь блокировок нет:
+        deque.append потокобезопасна.
+        """
+        self._finished.append(shard)
+
+    def snapshot(self):
+        """Сумма шардов: {(метрика, значения меток): число или список}"""
+        with self._lock:
+            # Шарды завершившихся потоков переносятся в сумму завершенных
+            while self._finished:
+                shard = self._finished.popleft()
+                self._shards = [live for live in self._shards if live is not shard]
+                for key, value in shard.items():
+                    _merge(self._retired, key, value)
+            shards = list(self._shards)
+            totals = {}
+            for key, value in self._retired.items():
+                _merge(totals, key, value)
+        for shard in shards:
+            # dict.copy атомарна под GIL, поэтому поток-владелец может
+            # продолжать писать в шард
+            for key, value in shard.copy().items():
+                _merge(totals, key, value)
+        return totals
+
+    def collect(self):
+        """Срез этого процесса или, в многопроцессном режиме, всех процессов"""
+        directory = settings.METRICS_MULTIPROCESS_DIR
+        if not directory:
+            return self.snapshot()
+        self.flush()
+        totals = {}
+        # Под блокировкой каталога: другой процесс не перенесет файл в
+        # retired.json, пока этот его читает, и не учтет его дважды
+        with _locked(directory):
+            for name, labels, value in _retire_dead_processes(directory):
+                _merge(totals, (name, tuple(labels)), value)
+            for file_name in os.listdir(directory):
+                if not PROCESS_FILE_RE.match(file_name):
+                    continue
+                rows = _read_json(os.path.join(directory, file_name))
+                for name, labels, value in rows or ():
+                    _merge(totals, (name, tuple(labels)), value)
+        return totals
+
+    def flush(self):
+        """Сохраняет срез процесса в METRICS_MULTIPROCESS_DIR/<pid>-<метка>.json"""
+        directory = settings.METRICS_MULTIPROCESS_DIR
+        if not directory:
+            return
+        if self._file_pid != os.getpid():
+            # Метка запуска: после fork и при повторном pid у процесса новый файл
+            self._file_pid = os.getpid()
+            self._file_name = f'{os.getpid()}-{uuid.uuid4().hex[:12]}.json'
+        os.makedirs(directory, exist_ok=True)
+        rows = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        _write_json(os.path.join(directory, self._file_name), rows)
+
+    def _start_flusher(self):
+        if not settings.METRICS_MULTIPROCESS_DIR or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            # После fork у воркера свой pid и свой поток сохранения
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_forever, daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            self.flush()
+
+
+@contextmanager
+def _locked(directory):
+    """Монопольная блокировка каталога срезов между процессами"""
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # Файла уже нет или он поврежден — пропускаем до следующего сбора
+        return None
+
+
+def _write_json(path, data):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    # Замена файла атомарна: читатель видит либо старый срез, либо новый
+    os.replace(temporary, path)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс есть, но принадлежит другому пользователю
+        return True
+    return True
+
+
+def _retire_dead_processes(directory):
+    """Переносит срезы завершившихся процессов в retired.json и удаляет их файлы
+
+    Возвращает строки суммы завершившихся процессов. Вместе с суммой
+    хранятся имена перенесенных файлов: если процесс упадет между записью
+    суммы и удалением файлов, файл не будет прибавлен второй раз.
+    """
+    path = os.path.join(directory, RETIRED_FILE)
+    retired = _read_json(path) or {'files': [], 'rows': []}
+    dead = [
+        file_name for file_name in os.listdir(directory)
+        if (match := PROCESS_FILE_RE.match(file_name))
+        and file_name not in retired['files'] and not _process_alive(int(match.group(1)))
+    ]
+    if dead:
+        totals = {}
+        for name, labels, value in retired['rows']:
+            _merge(totals, (name, tuple(labels)), value)
+        for file_name in dead:
+            # Процесс завершился, файл больше не перезаписывается
+            for name, labels, value in _read_json(os.path.join(directory, file_name)) or ():
+                _merge(totals, (name, tuple(labels)), value)
+        retired = {
+            'files': retired['files'] + dead,
+            'rows': [[name, list(labels), value] for (name, labels), value in totals.items()],
+        }
+        _write_json(path, retired)
+    if retired['files']:
+        for file_name in retired['files']:
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except FileNotFoundError:
+                pass
+        retired['files'] = []
+        _write_json(path, retired)
+    return retired['rows']
+
+
+def _merge(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        totals[key] = [a + b for a, b in zip(current, value)] if current else list(value)
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        registry.register(self)
+
+    def key(self, labels):
+        return self.name, tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry.shard()
+        key = self.key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Гистограмма: счетчики по корзинам, затем сумма и количество наблюдений"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self.registry.shard()
+        key = self.key(labels)
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0] * (len(self.buckets) + 3)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def timed(self, labels_func):
+        """Декоратор представления: время ответа с метками labels_func(request)"""
+        def decorator(view):
+            if iscoroutinefunction(view):
+                @wraps(view)
+                async def async_wrapper(request, *args, **kwargs):
+                    with self.time(**labels_func(request)):
+                        return await view(request, *args, **kwargs)
+                return async_wrapper
+
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                with self.time(**labels_func(request)):
+                    return view(request, *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+class Gauge(Metric):
+    """Текущее значение, которое вычисляет function() при каждой выдаче /metrics
+
+    function возвращает {кортеж значений меток: число}. Значение не хранится
+    в шардах и не суммируется по процессам: например, глубину очереди заданий
+    процесс, отдающий /metrics, читает из БД сам.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.function = function
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+def _labels(metric, values, extra=()):
+    pairs = list(zip(metric.labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def exposition(registry=REGISTRY):
+    """Текст для Prometheus (text/plain; version=0.0.4)"""
+    samples = {}
+    for (name, labels), value in registry.collect().items():
+        samples.setdefault(name, []).append((labels, value))
+    for name, metric in registry.metrics.items():
+        if isinstance(metric, Gauge):
+            samples[name] = [(tuple(map(str, labels)), value) for labels, value in metric.function().items()]
+
+    lines = []
+    for name, metric in sorted(registry.metrics.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for labels, value in sorted(samples.get(name, ())):
+            if metric.type != 'histogram':
+                lines.append(f'{name}{_labels(metric, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), value):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_labels(metric, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric, labels)} {value[-2]}')
+            lines.append(f'{name}_count{_labels(metric, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики приложения
+
+RESERVATIONS_CREATED = Counter(
+    'flights_reservations_created_total', 'Созданные брони', ['airline'])
+RESERVATIONS_CANCELLED = Counter(
+    'flights_reservations_cancelled_total', 'Отмененные брони', ['airline'])
+BOOKING_CONFLICTS = Counter(
+    'flights_booking_conflicts_total',
+    'Конфликты при бронировании: seat_taken (уникальность места), flight_full, ticket_number, lock',
+    ['reason'])
+BOARD_LATENCY = Histogram(
+    'flights_board_request_seconds', 'Время ответа табло', ['search'])
+CACHE_REQUESTS = Counter(
+    'flights_cache_requests_total', 'Обращения к кэшу страниц', ['cache', 'result'])
+VIEW_QUERIES = Histogram(
+    'flights_view_queries', 'Число SQL-запросов на HTTP-запрос', ['view'],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+TASKS_PROCESSED = Counter(
+    'flights_tasks_total', 'Выполнения заданий очереди: done, retry, failed', ['task', 'result'])
+TASK_WAIT = Histogram(
+    'flights_task_wait_seconds', 'Время от готовности задания до начала выполнения', ['task'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 15, 60, 300, 900, 3600))
+TASK_DURATION = Histogram(
+    'flights_task_seconds', 'Время выполнения задания', ['task'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300))
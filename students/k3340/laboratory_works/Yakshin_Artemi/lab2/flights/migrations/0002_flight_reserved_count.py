@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def rebuild_reserved_count(apps, schema_editor):
+    Flight = apps.get_model('flights', 'Flight')
+    Reservation = apps.get_model('flights', 'Reservation')
+    counts = (
+        Reservation.objects.filter(flight=OuterRef('pk'))
+        .order_by()
+        .values('flight')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    Flight.objects.update(reserved_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flight',
+            name='reserved_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Забронировано мест'),
+        ),
+        migrations.RunPython(rebuild_reserved_count, migrations.RunPython.noop),
+    ]
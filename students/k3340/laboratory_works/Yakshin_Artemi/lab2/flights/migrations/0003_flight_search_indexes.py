@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Выражения совпадают с тем, что Django генерирует для icontains/istartswith
+# на PostgreSQL: UPPER("столбец"::text) LIKE UPPER(%s)
+TRIGRAM_INDEXES = [
+    ('flights_flight_number_trgm', 'flights_flight', 'flight_number'),
+    ('flights_flight_origin_trgm', 'flights_flight', 'origin'),
+    ('flights_flight_destination_trgm', 'flights_flight', 'destination'),
+    ('flights_airline_name_trgm', 'flights_airline', 'name'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0002_flight_reserved_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='flight',
+            constraint=models.CheckConstraint(condition=models.Q(('reserved_count__lte', models.F('capacity'))), name='flight_reserved_count_lte_capacity'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:16
+
+import re
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Копия формата flights.seatmap на момент миграции: миграция не должна
+# зависеть от кода приложения, который может измениться
+SEAT_LETTERS = 'ABCDEF'
+SEAT_RE = re.compile(r'^([0-9]+)([A-Z])$')
+
+
+def seat_index(seat_number, rows):
+    """Номер бита места вида '12A' или None, если места нет в салоне"""
+    match = SEAT_RE.match(seat_number or '')
+    if not match:
+        return None
+    row, column = int(match.group(1)), SEAT_LETTERS.find(match.group(2))
+    if not 1 <= row <= rows or column < 0:
+        return None
+    return (row - 1) * len(SEAT_LETTERS) + column
+
+
+def fill_seat_bitmaps(apps, schema_editor):
+    Flight = apps.get_model('flights', 'Flight')
+    Reservation = apps.get_model('flights', 'Reservation')
+    # Салон по вместимости: ряды по 6 мест, бит (ряд - 1) * 6 + индекс буквы
+    rows = {}
+    bitmaps = {}
+    for flight_id, capacity in Flight.objects.values_list('pk', 'capacity'):
+        rows[flight_id] = -(-capacity // len(SEAT_LETTERS))
+        bitmaps[flight_id] = bytearray((rows[flight_id] * len(SEAT_LETTERS) + 7) // 8)
+    for flight_id, seat_number in Reservation.objects.values_list('flight_id', 'seat_number').iterator():
+        index = seat_index(seat_number, rows[flight_id])
+        # Места вне салона (старые данные) в карту не попадают, но учтены в reserved_count
+        if index is not None:
+            bitmaps[flight_id][index >> 3] |= 1 << (index & 7)
+    Flight.objects.bulk_update(
+        [Flight(pk=flight_id, seat_bitmap=bytes(bitmap)) for flight_id, bitmap in bitmaps.items()],
+        ['seat_bitmap'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0005_flight_capacity_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('rows', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество рядов')),
+                ('seat_letters', models.CharField(default='ABCDEF', max_length=10, validators=[django.core.validators.RegexValidator('^[A-Z]+$', 'Только заглавные латинские буквы.')], verbose_name='Буквы мест в ряду')),
+            ],
+            options={
+                'verbose_name': 'Компоновка салона',
+                'verbose_name_plural': 'Компоновки салона',
+            },
+        ),
+        migrations.AddField(
+            model_name='flight',
+            name='seat_bitmap',
+            field=models.BinaryField(default=b'', verbose_name='Карта занятых мест'),
+        ),
+        migrations.AddField(
+            model_name='flight',
+            name='seat_layout',
+            field=models.ForeignKey(blank=True, help_text='Если не указана, салон строится по вместимости: ряды по 6 мест', null=True, on_delete=django.db.models.deletion.PROTECT, to='flights.seatlayout', verbose_name='Компоновка салона'),
+        ),
+        migrations.RunPython(fill_seat_bitmaps, migrations.RunPython.noop),
+    ]
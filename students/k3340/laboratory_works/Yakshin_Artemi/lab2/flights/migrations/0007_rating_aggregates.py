@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    Airline = apps.get_model('flights', 'Airline')
+    Flight = apps.get_model('flights', 'Flight')
+    Review = apps.get_model('flights', 'Review')
+    reviews = Review.objects.filter(flight=OuterRef('pk')).order_by().values('flight')
+    Flight.objects.update(
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+        rating_count=Coalesce(Subquery(reviews.annotate(total=Count('pk')).values('total')), 0),
+    )
+    flights = Flight.objects.filter(airline=OuterRef('pk')).order_by().values('airline')
+    Airline.objects.update(
+        rating_sum=Coalesce(Subquery(flights.annotate(total=Sum('rating_sum')).values('total')), 0),
+        rating_count=Coalesce(Subquery(flights.annotate(total=Sum('rating_count')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0006_seat_map'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airline',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='airline',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.AddField(
+            model_name='flight',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.AddField(
+            model_name='flight',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:44
+
+from django.core.management.base import CommandError
+from django.db import migrations, models
+from django.db.models import Count
+
+# Сколько совпадающих ключей показывать в сообщении
+SHOWN_DUPLICATES = 20
+
+
+def check_duplicates(apps, schema_editor):
+    """Останавливает миграцию, если у рейсов совпадает ключ расписания
+
+    Такие совпадения мог дать load_sample_data, но отличить их от настоящих
+    рейсов нельзя, а сдвиг времени вылета незаметно испортил бы расписание.
+    Повторы нужно удалить или исправить вручную и повторить migrate.
+    """
+    Flight = apps.get_model('flights', 'Flight')
+    duplicates = list(
+        Flight.objects.values_list('airline__code', 'flight_number', 'departure_time')
+        .annotate(total=Count('pk')).filter(total__gt=1).order_by('departure_time', 'flight_number')
+    )
+    if not duplicates:
+        return
+    lines = [
+        f'  {code} {flight_number}, вылет {departure_time:%Y-%m-%d %H:%M} UTC, рейсов: {total}'
+        for code, flight_number, departure_time, total in duplicates[:SHOWN_DUPLICATES]
+    ]
+    if len(duplicates) > SHOWN_DUPLICATES:
+        lines.append(f'  ... и еще {len(duplicates) - SHOWN_DUPLICATES}')
+    raise CommandError(
+        'Рейсы с одинаковой авиакомпанией, номером и временем вылета '
+        f'({len(duplicates)}):\n' + '\n'.join(lines) +
+        '\nУдалите или исправьте повторы и повторите migrate.'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0007_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='flight',
+            constraint=models.UniqueConstraint(fields=('airline', 'flight_number', 'departure_time'), name='flight_schedule_key'),
+        ),
+    ]
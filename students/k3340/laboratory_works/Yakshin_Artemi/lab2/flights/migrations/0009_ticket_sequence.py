@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:49
+
+from django.db import migrations, models
+
+
+def create_sequence(apps, schema_editor):
+    apps.get_model('flights', 'TicketSequence').objects.create(name='ticket')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0008_flight_schedule_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+                ('next_value', models.PositiveBigIntegerField(default=0, verbose_name='Следующее значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик номеров билетов',
+                'verbose_name_plural': 'Счетчики номеров билетов',
+            },
+        ),
+        migrations.RunPython(create_sequence, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,40 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
-from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
+from django.utils import timezone
+from .seatmap import DEFAULT_SEAT_LETTERS, SeatMap
 
 
-class Airline(models.Model):
+class CounterFieldsMixin:
+    """Счетчики COUNTER_FIELDS, которые ведут сигналы атомарными UPDATE
+
+    Экземпляр в памяти (например, в форме админки) мог устареть, и полное
+    сохранение затерло бы чужие изменения счетчиков. Такие места сохраняют
+    существующую строку с update_fields=editable_fields(); обычный save()
+    пишет все поля, как у любой модели.
+    """
+    COUNTER_FIELDS = ()
+    
+    def editable_fields(self):
+        """Загруженные поля строки, кроме первичного ключа и счетчиков"""
+        deferred = self.get_deferred_fields()
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            and field.attname not in deferred
+        ]
+
+
+class Airline(CounterFieldsMixin, models.Model):
     """Модель авиакомпании"""
     name = models.CharField('Название авиакомпании', max_length=100)
     code = models.CharField('Код авиакомпании', max_length=3, unique=True)
+    # Сводка оценок всех рейсов авиакомпании, ведется сигналами отзывов
+    rating_sum = models.PositiveIntegerField('Сумма оценок', default=0, editable=False)
+    rating_count = models.PositiveIntegerField('Количество оценок', default=0, editable=False)
+    
+    COUNTER_FIELDS = ('rating_sum', 'rating_count')
     
     class Meta:
         verbose_name = 'Авиакомпания'
@@ -14,9 +42,31 @@ class Airline(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.code})"
+    
+    @property
+    def average_rating(self):
+        """Средний рейтинг рейсов авиакомпании (None, если отзывов нет)"""
+        return self.rating_sum / self.rating_count if self.rating_count else None
 
 
-class Flight(models.Model):
+class SeatLayout(models.Model):
+    """Компоновка салона: ряды × буквы мест"""
+    name = models.CharField('Название', max_length=100)
+    rows = models.PositiveSmallIntegerField('Количество рядов', validators=[MinValueValidator(1)])
+    seat_letters = models.CharField(
+        'Буквы мест в ряду', max_length=10, default=DEFAULT_SEAT_LETTERS,
+        validators=[RegexValidator(r'^[A-Z]+$', 'Только заглавные латинские буквы.')]
+    )
+    
+    class Meta:
+        verbose_name = 'Компоновка салона'
+        verbose_name_plural = 'Компоновки салона'
+    
+    def __str__(self):
+        return f"{self.name} ({self.rows}×{len(self.seat_letters)})"
+
+
+class Flight(CounterFieldsMixin, models.Model):
     """Модель рейса"""
     FLIGHT_TYPES = [
         ('departure', 'Вылет'),
@@ -33,28 +83,84 @@ class Flight(models.Model):
     destination = models.CharField('Место назначения', max_length=100)
     capacity = models.PositiveIntegerField('Вместимость', default=100)
     price = models.DecimalField('Цена билета', max_digits=10, decimal_places=2, default=0.00)
+    reserved_count = models.PositiveIntegerField('Забронировано мест', default=0, editable=False)
+    seat_layout = models.ForeignKey(
+        SeatLayout, on_delete=models.PROTECT, null=True, blank=True, verbose_name='Компоновка салона',
+        help_text='Если не указана, салон строится по вместимости: ряды по 6 мест'
+    )
+    seat_bitmap = models.BinaryField('Карта занятых мест', default=b'', editable=False)
+    # Сумма и число оценок отзывов: табло показывает рейтинг без чтения отзывов
+    rating_sum = models.PositiveIntegerField('Сумма оценок', default=0, editable=False)
+    rating_count = models.PositiveIntegerField('Количество отзывов', default=0, editable=False)
+    
+    COUNTER_FIELDS = ('reserved_count', 'seat_bitmap', 'rating_sum', 'rating_count')
     
     class Meta:
         verbose_name = 'Рейс'
         verbose_name_plural = 'Рейсы'
         ordering = ['departure_time']
+        indexes = [
+            # Табло без фильтра: сортировка и курсор по (departure_time, id)
+            models.Index(fields=['departure_time', 'id'], name='flight_departure_idx'),
+            # Табло вылетов/прилетов: фильтр по типу + тот же курсор
+            models.Index(fields=['flight_type', 'departure_time', 'id'], name='flight_type_departure_idx'),
+        ]
+        constraints = [
+            # Вместимость соблюдается на уровне БД при любом способе записи
+            models.CheckConstraint(
+                condition=models.Q(reserved_count__lte=models.F('capacity')),
+                name='flight_reserved_count_lte_capacity',
+            ),
+            # Ключ рейса в расписании: по нему import_schedule обновляет рейсы
+            models.UniqueConstraint(
+                fields=['airline', 'flight_number', 'departure_time'],
+                name='flight_schedule_key',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.flight_number} ({self.airline.code}) - {self.origin} → {self.destination}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходная авиакомпания: при смене рейтинг рейса переносится в сводку новой
+        instance._loaded_airline_id = instance.__dict__.get('airline_id')
+        return instance
+    
+    def clean(self):
+        if self.capacity is not None and self.capacity < self.reserved_count:
+            raise ValidationError({
+                'capacity': f'Вместимость не может быть меньше числа забронированных мест ({self.reserved_count}).'
+            })
+    
     @property
     def available_seats(self):
-        """Количество доступных мест"""
-        return self.capacity - self.reservations.count()
+        """Количество доступных мест (по счетчику reserved_count, без запроса к БД)"""
+        return self.capacity - self.reserved_count
+    
+    @property
+    def seat_map(self):
+        """Карта мест салона с занятостью из seat_bitmap"""
+        if self.seat_layout_id:
+            return SeatMap(self.seat_layout.rows, self.seat_layout.seat_letters, self.seat_bitmap)
+        rows = -(-self.capacity // len(DEFAULT_SEAT_LETTERS))
+        return SeatMap(rows, DEFAULT_SEAT_LETTERS, self.seat_bitmap)
+    
+    def rebuild_seat_bitmap(self):
+        """Пересобирает карту мест по броням (после смены компоновки или вместимости)"""
+        seat_map = self.seat_map
+        seat_map.bits[:] = bytes(len(seat_map.bits))
+        for seat_number in self.reservations.values_list('seat_number', flat=True):
+            if seat_map.is_valid(seat_number):
+                seat_map.occupy(seat_number)
+        self.seat_bitmap = seat_map.to_bytes()
+        Flight.objects.filter(pk=self.pk).update(seat_bitmap=self.seat_bitmap)
     
     @property
     def average_rating(self):
-        """Средний рейтинг рейса"""
-        reviews = self.reviews.all()
-        if reviews.exists():
-            total_rating = sum(review.rating for review in reviews)
-            return total_rating / reviews.count()
-        return 0
+        """Средний рейтинг рейса по сохраненной сводке (None, если отзывов нет)"""
+        return self.rating_sum / self.rating_count if self.rating_count else None
 
 
 class Reservation(models.Model):
@@ -70,9 +176,35 @@ class Reservation(models.Model):
         verbose_name = 'Резервирование'
         verbose_name_plural = 'Резервирования'
         unique_together = ['flight', 'seat_number']
+        indexes = [
+            # «Мои бронирования»: фильтр по пользователю + курсор (created_at, id)
+            models.Index(fields=['user', 'created_at', 'id'], name='reservation_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.flight.flight_number} (место {self.seat_number})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходные рейс и место, чтобы при переносе брони поправить
+        # счетчики и карты мест обоих рейсов
+        instance._loaded_flight_id = instance.__dict__.get('flight_id')
+        instance._loaded_seat_number = instance.__dict__.get('seat_number')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # Вставка и обработчик post_save (SELECT ... FOR UPDATE рейса и счетчик
+        # мест) — одна транзакция, даже если save() вызван вне atomic()
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
+        # Обработчики post_save уже увидели исходные значения, теперь они текущие
+        self._loaded_flight_id = self.flight_id
+        self._loaded_seat_number = self.seat_number
+    
+    def clean(self):
+        if self.flight_id and self.seat_number and not self.flight.seat_map.is_valid(self.seat_number):
+            raise ValidationError({'seat_number': 'Такого места нет в салоне этого рейса.'})
 
 
 class Review(models.Model):
@@ -91,13 +223,37 @@ class Review(models.Model):
         verbose_name_plural = 'Отзывы'
         unique_together = ['user', 'flight']
         ordering = ['-created_at']
+        indexes = [
+            # Отзывы на странице рейса в порядке добавления
+            models.Index(fields=['flight', 'created_at'], name='review_flight_created_idx'),
+        ]
     
     def __str__(self):
         return f"Отзыв {self.user.username} на рейс {self.flight.flight_number} (рейтинг: {self.rating})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходные рейс и оценка нужны, чтобы поправить сводку рейтинга при изменении
+        instance._loaded_flight_id = instance.__dict__.get('flight_id')
+        instance._loaded_rating = instance.__dict__.get('rating')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_flight_id = self.flight_id
+        self._loaded_rating = self.rating
 
 
 class UserProfile(models.Model):
-    """Дополнительные данные пользователя"""
+    """Дополнительные данные пользователя
+
+    Профиль не создается и не сохраняется сигналом на каждый User.save()
+    (в том числе на обновление last_login при входе): его записывает
+    регистрация, а пользователям, созданным иначе, — админка, когда профиль
+    заполняют. Код, читающий профиль, учитывает, что его может не быть
+    (LEFT JOIN в выгрузках).
+    """
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name='Пользователь')
     phone = models.CharField('Телефон', max_length=20, blank=True)
     passport_number = models.CharField('Номер паспорта', max_length=20, blank=True)
@@ -107,4 +263,62 @@ class UserProfile(models.Model):
         verbose_name_plural = 'Профили пользователей'
     
     def __str__(self):
-        return f"Профиль {self.user.username}"
\ No newline at end of file
+        return f"Профиль {self.user.username}"
+
+
+class TicketSequence(models.Model):
+    """Счетчик для номеров билетов; процессы забирают из него блоки (flights.tickets)"""
+    name = models.CharField('Название', max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField('Следующее значение', default=0)
+    
+    class Meta:
+        verbose_name = 'Счетчик номеров билетов'
+        verbose_name_plural = 'Счетчики номеров билетов'
+    
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class BackgroundJob(models.Model):
+    """Задание очереди flights.tasks: массовое действие админки или отложенная работа"""
+    STATUSES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнено'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    action = models.CharField('Действие', max_length=50)
+    params = models.JSONField('Параметры', default=dict, blank=True)
+    object_ids = models.JSONField('Объекты', default=list, blank=True)
+    status = models.CharField('Статус', max_length=10, choices=STATUSES, default='pending')
+    total = models.PositiveIntegerField('Всего объектов', default=0)
+    processed = models.PositiveIntegerField('Обработано', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField('Максимум попыток', default=5)
+    # Для ожидающего задания — когда его можно выполнять, для выполняемого —
+    # до какого времени воркер его держит; после этого задание заберет другой
+    run_after = models.DateTimeField('Выполнить после', default=timezone.now)
+    worker = models.CharField('Воркер', max_length=100, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Автор')
+    created_at = models.DateTimeField('Создано', auto_now_add=True)
+    started_at = models.DateTimeField('Начато', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершено', null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Фоновое задание'
+        verbose_name_plural = 'Фоновые задания'
+        ordering = ['-created_at']
+        indexes = [
+            # Выборка воркера: готовые к выполнению задания по времени
+            models.Index(fields=['status', 'run_after'], name='flights_job_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Задание №{self.pk}: {self.action} ({self.get_status_display()})"
+    
+    @property
+    def progress(self):
+        """Доля выполненного в процентах"""
+        return 100 * self.processed // self.total if self.total else 100
@@ -0,0 +1,183 @@
+"""Пагинация больших таблиц
+
+CursorPaginator — курсорная (keyset) пагинация табло. В отличие от
+django.core.paginator.Paginator не выполняет COUNT(*) и не
+использует OFFSET: следующая страница выбирается условием
+``(departure_time, id) > (последнее значение)``, которое обслуживается
+индексом, поэтому глубокие страницы открываются так же быстро, как первая.
+Курсор — непрозрачный токен base64 с значениями ключа последней строки.
+
+EstimatedCountPaginator — обычный Paginator для админки с оценкой числа
+строк вместо COUNT(*) по большой таблице.
+"""
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    """Страница результатов; совместима с шаблонами по iteration/len"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class CursorPaginator:
+    """Keyset-пагинатор по уникальному набору полей
+
+    ordering — поля в порядке сортировки, последнее должно быть уникальным
+    (обычно id), например ('departure_time', 'id') или ('-created_at', '-id').
+    Все поля сортируются в одном направлении.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith('-')
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def encode_cursor(self, obj, reverse=False):
+        values = [self._serialize(self._value(obj, name)) for name in self.fields]
+        payload = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = [self._field(name).to_python(value)
+                      for name, value in zip(self.fields, payload['v'], strict=True)]
+            return values, bool(payload.get('r'))
+        except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def get_page(self, cursor=None):
+        """Страница по курсору; неверный или пустой курсор — первая страница"""
+        queryset, values, reverse = self._page_queryset(cursor)
+        return self._make_page(list(queryset), values, reverse)
+
+    async def aget_page(self, cursor=None):
+        """Асинхронный вариант get_page для async-представлений"""
+        queryset, values, reverse = self._page_queryset(cursor)
+        return self._make_page([row async for row in queryset], values, reverse)
+
+    def _page_queryset(self, cursor):
+        values, reverse = None, False
+        if cursor:
+            try:
+                values, reverse = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+
+        queryset = self.queryset
+        # Для движения назад выбираем в обратном порядке и переворачиваем
+        ascending = self.descending == reverse
+        if values is not None:
+            queryset = queryset.filter(self._after(values, ascending))
+        if ascending:
+            queryset = queryset.order_by(*self.fields)
+        else:
+            queryset = queryset.order_by(*[f'-{name}' for name in self.fields])
+        return queryset[:self.per_page + 1], values, reverse
+
+    def _make_page(self, rows, values, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return CursorPage([])
+
+        next_cursor = previous_cursor = None
+        if has_more or reverse:
+            next_cursor = self.encode_cursor(rows[-1])
+        if values is not None and (has_more or not reverse):
+            previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+    @staticmethod
+    def _value(obj, name):
+        # Строки из values() — словари, обычные выборки — модели
+        return obj[name] if isinstance(obj, dict) else getattr(obj, name)
+
+    @staticmethod
+    def _serialize(value):
+        return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+    def _field(self, name):
+        return self.queryset.model._meta.get_field(name)
+
+    def _after(self, values, ascending):
+        """(f1, f2, ...) > (v1, v2, ...) в виде дерева Q для любой СУБД"""
+        lookup = 'gt' if ascending else 'lt'
+        condition = Q()
+        for index, name in enumerate(self.fields):
+            equal = {field: value for field, value in zip(self.fields[:index], values)}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[index]})
+        return condition
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator для админки: без фильтров берет число строк из статистики PostgreSQL
+
+    Точный COUNT(*) по таблице из миллионов строк читает ее целиком на каждое
+    открытие списка. Для таблицы без условий PostgreSQL хранит оценку в
+    pg_class.reltuples; если она больше ADMIN_ESTIMATED_COUNT_THRESHOLD,
+    используется она. С фильтрами и на других СУБД — обычный COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None and estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where or queryset.query.distinct:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        # -1: таблица еще не анализировалась
+        return row[0] if row and row[0] >= 0 else None
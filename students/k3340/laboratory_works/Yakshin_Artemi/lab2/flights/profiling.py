@@ -0,0 +1,175 @@
+"""Профилирование запросов без DEBUG
+
+ProfilingMiddleware заводит на каждый HTTP-запрос RequestProfile и кладет его
+в contextvar. Обертка execute_wrapper, которая ставится на каждое соединение
+с БД при его открытии, и бэкенд шаблонов ProfilingTemplates дописывают в
+текущий профиль число и время SQL-запросов и время рендеринга. В ответ
+добавляется заголовок Server-Timing, а медленные запросы и запросы с
+повторяющимся SQL (N+1) с заданной вероятностью пишутся в журнал
+flights.profiling.
+"""
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+from .metrics import VIEW_QUERIES
+
+logger = logging.getLogger('flights.profiling')
+
+_current_profile = ContextVar('request_profile', default=None)
+
+# Управление транзакциями повторяется в каждом запросе с atomic() и повтором не считается
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+class RequestProfile:
+    """Счетчики одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def duplicates(self):
+        """SQL, выполненный в запросе больше одного раза (с любыми параметрами)"""
+        return [(sql, count) for sql, count in self.statements.most_common()
+                if count > 1 and not sql.startswith(TRANSACTION_STATEMENTS)]
+
+    def server_timing(self, total_time):
+        metrics = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total_time * 1000:.1f}',
+        ]
+        duplicates = self.duplicates()
+        if duplicates:
+            repeated = sum(count - 1 for _, count in duplicates)
+            metrics.append(f'dup;desc="{repeated} repeated queries"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def profile():
+    """Собирает профиль для кода внутри блока (используется middleware и тестами)"""
+    request_profile = RequestProfile()
+    token = _current_profile.set(request_profile)
+    try:
+        yield request_profile
+    finally:
+        _current_profile.reset(token)
+
+
+def query_timer(execute, sql, params, many, context):
+    """execute_wrapper: время и текст запроса в профиль текущего HTTP-запроса"""
+    request_profile = _current_profile.get()
+    if request_profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_profile.db_time += time.perf_counter() - started
+        request_profile.queries += 1
+        request_profile.statements[sql] += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    """Ставит обертку на каждое новое соединение (в любом потоке и для любой БД)"""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class ProfilingTemplate(Template):
+    def render(self, context=None, request=None):
+        request_profile = _current_profile.get()
+        if request_profile is None:
+            return super().render(context, request)
+        # Вложенный render_to_string уже учтен во времени внешнего шаблона
+        request_profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            request_profile.template_depth -= 1
+            if not request_profile.template_depth:
+                request_profile.template_time += time.perf_counter() - started
+
+
+class ProfilingTemplates(DjangoTemplates):
+    """DjangoTemplates, замеряющий время рендеринга для Server-Timing"""
+
+    def from_string(self, template_code):
+        return ProfilingTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return ProfilingTemplate(template.template, self)
+
+
+class ProfilingMiddleware:
+    """Server-Timing и журнал медленных запросов; ставится первым в MIDDLEWARE"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.PROFILING_ENABLED:
+            return self.get_response(request)
+        with profile() as request_profile:
+            response = self.get_response(request)
+        self.finish(request, response, request_profile)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.PROFILING_ENABLED:
+            return await self.get_response(request)
+        with profile() as request_profile:
+            response = await self.get_response(request)
+        self.finish(request, response, request_profile)
+        return response
+
+    def finish(self, request, response, request_profile):
+        total_time = request_profile.total_time
+        if request.resolver_match is not None:
+            VIEW_QUERIES.observe(request_profile.queries, view=request.resolver_match.view_name)
+        if settings.PROFILING_SERVER_TIMING:
+            response['Server-Timing'] = request_profile.server_timing(total_time)
+        if response.streaming:
+            # Время потокового ответа (живое табло) определяет клиент
+            return
+
+        duplicates = request_profile.duplicates()
+        slow = total_time * 1000 >= settings.PROFILING_SLOW_MS
+        if (slow or duplicates) and random.random() < settings.PROFILING_SAMPLE_RATE:
+            lines = [
+                f'{request.method} {request.get_full_path()} -> {response.status_code}: '
+                f'{total_time * 1000:.1f} мс, БД {request_profile.db_time * 1000:.1f} мс '
+                f'({request_profile.queries} запросов), шаблоны {request_profile.template_time * 1000:.1f} мс'
+            ]
+            lines.extend(f'  повтор x{count}: {sql[:300]}' for sql, count in duplicates)
+            logger.warning('\n'.join(lines))
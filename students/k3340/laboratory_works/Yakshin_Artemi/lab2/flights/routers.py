@@ -0,0 +1,99 @@
+"""Маршрутизация запросов между основной БД и репликой
+
+Чтобы пользователь сразу видел свою бронь, после записи ему ставится
+подписанная cookie на REPLICA_STICKY_SECONDS: пока она действует,
+представления с декоратором read_your_writes читают основную БД.
+Страницы, которые сохраняются в кэш табло, строятся по основной БД
+(flights.cache): иначе отставшая реплика попала бы в кэш под новой версией.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+STICKY_COOKIE = 'primary_sticky'
+STICKY_SALT = 'flights.routers.sticky'
+
+# Признак «читать с основной БД» для текущего запроса; contextvar, а не
+# глобальная переменная, — корректно и для потоков WSGI, и для задач ASGI
+_use_primary = ContextVar('use_primary', default=False)
+
+
+class ReplicaRouter:
+    """Чтение данных табло — с реплики, запись — в основную БД
+
+    На реплику уходят только модели приложения flights: сессии и
+    пользователи читаются из основной БД, иначе задержка репликации
+    разлогинивала бы только что вошедшего пользователя. Чтение внутри
+    транзакции (бронирование, SELECT ... FOR UPDATE) и в окне
+    read-your-writes остается на основной БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DB_ALIAS not in connections.settings or model._meta.app_label != 'flights':
+            return DEFAULT_DB_ALIAS
+        if _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной БД, связи между ними допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_primary():
+    """Все чтения внутри блока — с основной БД"""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def stick_to_primary(response):
+    """Помечает ответ после записи: следующие чтения пользователя — с основной БД"""
+    response.set_signed_cookie(
+        STICKY_COOKIE, '1', salt=STICKY_SALT, max_age=settings.REPLICA_STICKY_SECONDS,
+        httponly=True, samesite='Lax',
+    )
+    return response
+
+
+def is_sticky(request):
+    """Запрос изменяет данные или пользователь недавно что-то записал"""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return True
+    return request.get_signed_cookie(
+        STICKY_COOKIE, default=None, salt=STICKY_SALT, max_age=settings.REPLICA_STICKY_SECONDS,
+    ) is not None
+
+
+def read_your_writes(view):
+    """Представление читает основную БД, пока у пользователя действует окно после записи"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not is_sticky(request):
+                return await view(request, *args, **kwargs)
+            with use_primary():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_sticky(request):
+            return view(request, *args, **kwargs)
+        with use_primary():
+            return view(request, *args, **kwargs)
+    return wrapper
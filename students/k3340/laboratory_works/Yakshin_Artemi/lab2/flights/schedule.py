@@ -0,0 +1,178 @@
+"""Загрузка расписания рейсов из CSV и NDJSON
+
+Файл читается построчно и обрабатывается пачками. Строки пачки проверяются
+в Python, существующие рейсы пачки читаются одним запросом с блокировкой
+строк (иначе параллельная бронь обойдет проверку вместимости), и только новые
+и изменившиеся рейсы записываются одним INSERT ... ON CONFLICT DO UPDATE
+по ключу (авиакомпания, номер рейса, время вылета). Повторная загрузка
+того же файла ничего не пишет в БД и не сбрасывает кэш табло.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import bulk
+from .models import Airline, Flight
+
+KEY_FIELDS = ('airline', 'flight_number', 'departure_time')
+# Поля, которые расписание задает и обновляет; счетчики мест и рейтинга не трогаются
+SCHEDULE_FIELDS = ('arrival_time', 'flight_type', 'gate_number', 'origin', 'destination', 'capacity', 'price')
+DEFAULTS = {'capacity': 100, 'price': '0'}
+FLIGHT_TYPES = dict(Flight.FLIGHT_TYPES)
+MAX_LENGTHS = {name: Flight._meta.get_field(name).max_length
+               for name in ('flight_number', 'gate_number', 'origin', 'destination')}
+
+
+class RowError(ValueError):
+    """Строка файла не прошла проверку; текст пригоден для отчета"""
+
+
+def read_rows(file, file_format):
+    """(номер строки, словарь или RowError) — файл читается потоком"""
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, RowError(f'некорректный JSON: {exc}')
+            continue
+        yield line_number, row if isinstance(row, dict) else RowError('ожидается объект JSON')
+
+
+def _text(row, name):
+    value = str(row.get(name) or '').strip()
+    if not value:
+        raise RowError(f'не заполнено поле {name}')
+    if len(value) > MAX_LENGTHS[name]:
+        raise RowError(f'{name}: не длиннее {MAX_LENGTHS[name]} символов')
+    return value
+
+
+def _datetime(row, name, tz):
+    value = parse_datetime(str(row.get(name) or '').strip())
+    if value is None:
+        raise RowError(f'{name}: ожидается дата и время в формате ISO 8601')
+    # Время без смещения считается местным (TIME_ZONE)
+    return timezone.make_aware(value, tz) if timezone.is_naive(value) else value
+
+
+class ScheduleImporter:
+    def __init__(self, batch_size=2000):
+        self.batch_size = batch_size
+        self.airlines = dict(Airline.objects.values_list('code', 'pk'))
+        self.tz = timezone.get_current_timezone()
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+        self.errors = []
+
+    def parse(self, row):
+        """Значения полей рейса из строки файла или RowError
+
+        Экземпляр Flight создается позже и только для новых и изменившихся
+        рейсов: при ночной загрузке почти все строки совпадают с БД.
+        """
+        code = str(row.get('airline') or '').strip().upper()
+        if code not in self.airlines:
+            raise RowError(f'неизвестная авиакомпания {code!r}')
+        flight_type = str(row.get('flight_type') or '').strip()
+        if flight_type not in FLIGHT_TYPES:
+            raise RowError(f'flight_type: одно из {", ".join(FLIGHT_TYPES)}')
+        try:
+            capacity = int(row.get('capacity') or DEFAULTS['capacity'])
+            price = Decimal(str(row.get('price') or DEFAULTS['price'])).quantize(Decimal('0.01'))
+        except (ValueError, InvalidOperation):
+            raise RowError('capacity и price должны быть числами')
+        if capacity < 1 or price < 0 or price >= 10 ** 8:
+            raise RowError('capacity должна быть положительной, price — от 0 до 10^8')
+
+        values = {
+            'airline_id': self.airlines[code],
+            'flight_number': _text(row, 'flight_number').upper(),
+            'departure_time': _datetime(row, 'departure_time', self.tz),
+            'arrival_time': _datetime(row, 'arrival_time', self.tz),
+            'flight_type': flight_type,
+            'gate_number': _text(row, 'gate_number'),
+            'origin': _text(row, 'origin'),
+            'destination': _text(row, 'destination'),
+            'capacity': capacity,
+            'price': price,
+        }
+        if values['arrival_time'] <= values['departure_time']:
+            raise RowError('время прилета должно быть позже времени вылета')
+        return values
+
+    def error(self, line_number, exc):
+        self.stats['errors'] += 1
+        self.errors.append((line_number, str(exc)))
+
+    def run(self, rows):
+        """Загружает строки из read_rows пачками; после каждой пачки отдает статистику"""
+        batch = {}
+        for line_number, row in rows:
+            self.stats['rows'] += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                values = self.parse(row)
+            except RowError as exc:
+                self.error(line_number, exc)
+                continue
+            # Повтор ключа внутри пачки: ON CONFLICT не обновляет строку дважды
+            # за один INSERT, поэтому остается последняя версия
+            key = (values['airline_id'], values['flight_number'], values['departure_time'])
+            batch[key] = (line_number, values)
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch)
+                batch = {}
+                yield self.stats
+        if batch:
+            self.save_batch(batch)
+            yield self.stats
+
+    def save_batch(self, batch):
+        airline_ids, flight_numbers, departure_times = (set(part) for part in zip(*batch))
+        with transaction.atomic():
+            # Надмножество существующих рейсов пачки одним запросом по индексу
+            # ключа; в транзакции чтение идет с основной БД. Строки блокируются
+            # до конца пачки, чтобы бронь не увеличила reserved_count после
+            # проверки вместимости, — по возрастанию id, как и в signals
+            existing = {
+                (row[0], row[1], row[2]): row[3:]
+                for row in Flight.objects.select_for_update(of=('self',)).filter(
+                    airline_id__in=airline_ids,
+                    flight_number__in=flight_numbers,
+                    departure_time__range=(min(departure_times), max(departure_times)),
+                ).order_by('pk').values_list('airline_id', 'flight_number', 'departure_time', 'pk', 'reserved_count', *SCHEDULE_FIELDS)
+            }
+            changed, changed_ids = [], []
+            for key, (line_number, values) in batch.items():
+                current = existing.get(key)
+                if current is None:
+                    changed.append(Flight(**values))
+                    self.stats['created'] += 1
+                    continue
+                pk, reserved_count, *current_values = current
+                if current_values == [values[name] for name in SCHEDULE_FIELDS]:
+                    self.stats['unchanged'] += 1
+                elif values['capacity'] < reserved_count:
+                    self.error(line_number, RowError(
+                        f'вместимость {values["capacity"]} меньше числа броней рейса ({reserved_count})'))
+                else:
+                    changed.append(Flight(**values))
+                    changed_ids.append(pk)
+                    self.stats['updated'] += 1
+            Flight.objects.bulk_create(
+                changed, update_conflicts=True, unique_fields=KEY_FIELDS, update_fields=SCHEDULE_FIELDS,
+            )
+            if changed:
+                # bulk_create не отправляет сигналы: кэш и живое табло обновляем сами
+                bulk.flights_changed(changed_ids)
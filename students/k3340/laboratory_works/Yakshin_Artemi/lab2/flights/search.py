@@ -0,0 +1,72 @@
+"""Поиск рейсов для табло
+
+На PostgreSQL фильтры icontains/istartswith обслуживаются GIN-индексами
+pg_trgm по UPPER(столбец) (миграция 0003), а ранжирование дополняется
+триграммным сходством. На SQLite используется тот же фильтр без индексов
+и без триграмм — этого достаточно для тестов и локальной разработки.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Airline
+
+# Ранги совпадений: чем выше, тем раньше рейс в выдаче
+RANK_EXACT_NUMBER = 3
+RANK_NUMBER_PREFIX = 2
+RANK_PLACE_PREFIX = 1
+
+
+def normalize_flight_number(query):
+    """'su 12' -> 'SU12': номера рейсов ищем без пробелов и дефисов"""
+    return re.sub(r'[\s-]+', '', query).upper()
+
+
+def search_flights(queryset, query):
+    """Фильтрует и ранжирует рейсы по строке поиска
+
+    Совпадения: номер рейса (в том числе по началу номера), название
+    авиакомпании, место отправления или назначения. Результат упорядочен
+    по рангу, затем по времени вылета.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+
+    number = normalize_flight_number(query) or query
+    # Авиакомпаний мало: подзапрос по id не мешает использовать индексы
+    # таблицы рейсов, в отличие от OR через JOIN
+    airlines = Airline.objects.filter(name__icontains=query).values('pk')
+
+    queryset = queryset.filter(
+        Q(flight_number__istartswith=number)
+        | Q(flight_number__icontains=query)
+        | Q(airline__in=airlines)
+        | Q(origin__icontains=query)
+        | Q(destination__icontains=query)
+    ).annotate(
+        search_rank=Case(
+            When(flight_number__iexact=number, then=Value(RANK_EXACT_NUMBER)),
+            When(flight_number__istartswith=number, then=Value(RANK_NUMBER_PREFIX)),
+            When(Q(origin__istartswith=query) | Q(destination__istartswith=query),
+                 then=Value(RANK_PLACE_PREFIX)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+    ordering = ['-search_rank']
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models.functions import Greatest
+
+        queryset = queryset.annotate(
+            search_similarity=Greatest(
+                TrigramSimilarity('origin', query),
+                TrigramSimilarity('destination', query),
+            )
+        )
+        ordering.append('-search_similarity')
+
+    return queryset.order_by(*ordering, 'departure_time', 'id')
@@ -0,0 +1,78 @@
+"""Карта мест рейса
+
+Салон — сетка rows × letters. Занятость хранится битовой картой: бит с
+номером (ряд - 1) * len(letters) + индекс буквы. Для салона на 250 мест это
+32 байта в строке рейса, поэтому проверка места — O(1) без чтения броней.
+"""
+import re
+
+DEFAULT_SEAT_LETTERS = 'ABCDEF'
+SEAT_RE = re.compile(r'^([0-9]+)([A-Z])$')
+
+
+class InvalidSeat(ValueError):
+    pass
+
+
+class SeatMap:
+    def __init__(self, rows, letters=DEFAULT_SEAT_LETTERS, bitmap=b''):
+        self.rows = rows
+        self.letters = letters
+        self.size = rows * len(letters)
+        self.bits = bytearray((self.size + 7) // 8)
+        bitmap = bytes(bitmap or b'')[:len(self.bits)]
+        self.bits[:len(bitmap)] = bitmap
+
+    def index(self, seat_number):
+        """Номер бита для места вида '12A'; InvalidSeat, если места нет в салоне"""
+        match = SEAT_RE.match(seat_number or '')
+        if not match:
+            raise InvalidSeat(seat_number)
+        row, letter = int(match.group(1)), match.group(2)
+        column = self.letters.find(letter)
+        if not 1 <= row <= self.rows or column < 0:
+            raise InvalidSeat(seat_number)
+        return (row - 1) * len(self.letters) + column
+
+    def seat_number(self, index):
+        row, column = divmod(index, len(self.letters))
+        return f'{row + 1}{self.letters[column]}'
+
+    def is_valid(self, seat_number):
+        try:
+            self.index(seat_number)
+        except InvalidSeat:
+            return False
+        return True
+
+    def is_free(self, seat_number):
+        index = self.index(seat_number)
+        return not self.bits[index >> 3] & (1 << (index & 7))
+
+    def occupy(self, seat_number):
+        index = self.index(seat_number)
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+    def release(self, seat_number):
+        index = self.index(seat_number)
+        self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def occupied_count(self):
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+    def to_bytes(self):
+        return bytes(self.bits)
+
+    def layout(self):
+        """Ряды для шаблона: [(ряд, [(место, свободно) или None для прохода])]"""
+        aisle = len(self.letters) // 2 if len(self.letters) > 3 else None
+        result = []
+        for row in range(1, self.rows + 1):
+            seats = []
+            for column, letter in enumerate(self.letters):
+                if column == aisle:
+                    seats.append(None)
+                index = (row - 1) * len(self.letters) + column
+                seats.append((f'{row}{letter}', not self.bits[index >> 3] & (1 << (index & 7))))
+            result.append((row, seats))
+        return result
@@ -1,20 +1,156 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from . import cache, live
+from .models import Airline, Flight, Reservation, Review
 
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    """Создание профиля пользователя при создании пользователя"""
+def _apply_seat_changes(changes):
+    """Обновляет счетчики и карты мест рейсов под блокировкой их строк
+
+    changes — {id рейса: (занимаемое место, освобождаемое место)}. Блокировка
+    (SELECT ... FOR UPDATE) держится до конца транзакции брони, поэтому
+    параллельные брони одного рейса не затирают биты друг друга. Строки всех
+    рейсов блокируются одним запросом по возрастанию id: встречные переносы
+    броней между двумя рейсами не ждут друг друга по кругу.
+    """
+    flights = (
+        Flight.objects.select_for_update(of=('self',))
+        .select_related('seat_layout')
+        .only('capacity', 'seat_bitmap', 'seat_layout__rows', 'seat_layout__seat_letters')
+        .filter(pk__in=changes)
+        .order_by('pk')
+    )
+    for flight in flights:
+        occupy, release = changes[flight.pk]
+        seat_map = flight.seat_map
+        for seat_number, change in ((release, seat_map.release), (occupy, seat_map.occupy)):
+            if seat_number and seat_map.is_valid(seat_number):
+                change(seat_number)
+        delta = (occupy is not None) - (release is not None)
+        Flight.objects.filter(pk=flight.pk).update(
+            reserved_count=F('reserved_count') + delta,
+            seat_bitmap=seat_map.to_bytes(),
+        )
+
+
+@receiver(post_save, sender=Reservation)
+def count_reservation(sender, instance, created, raw=False, **kwargs):
+    """Поддержка Flight.reserved_count и карты мест при создании и переносе брони"""
+    if raw:
+        return
+    if created:
+        _apply_seat_changes({instance.flight_id: (instance.seat_number, None)})
+        return
+    loaded_flight_id = getattr(instance, '_loaded_flight_id', None)
+    loaded_seat_number = getattr(instance, '_loaded_seat_number', None)
+    if loaded_flight_id is not None and loaded_flight_id != instance.flight_id:
+        # Бронь перенесли на другой рейс (например, в админке)
+        _apply_seat_changes({
+            loaded_flight_id: (None, loaded_seat_number),
+            instance.flight_id: (instance.seat_number, None),
+        })
+    elif loaded_seat_number is not None and loaded_seat_number != instance.seat_number:
+        # Пересадка в пределах рейса: счетчик не меняется, меняются биты
+        _apply_seat_changes({instance.flight_id: (instance.seat_number, loaded_seat_number)})
+
+
+@receiver(post_delete, sender=Reservation)
+def uncount_reservation(sender, instance, **kwargs):
+    """Поддержка Flight.reserved_count и карты мест при удалении брони"""
+    _apply_seat_changes({instance.flight_id: (None, instance.seat_number)})
+
+
+def _apply_rating_change(flight_id, rating=0, count=0):
+    """Сдвигает сумму и число оценок рейса и его авиакомпании атомарными UPDATE"""
+    Flight.objects.filter(pk=flight_id).update(
+        rating_sum=F('rating_sum') + rating,
+        rating_count=F('rating_count') + count,
+    )
+    Airline.objects.filter(pk=Subquery(Flight.objects.filter(pk=flight_id).values('airline_id'))).update(
+        rating_sum=F('rating_sum') + rating,
+        rating_count=F('rating_count') + count,
+    )
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, raw=False, **kwargs):
+    """Поддержка сводки рейтинга при добавлении и изменении отзыва"""
+    if raw:
+        return
     if created:
-        UserProfile.objects.create(user=instance)
+        _apply_rating_change(instance.flight_id, instance.rating, 1)
+        return
+    loaded_flight_id = getattr(instance, '_loaded_flight_id', None)
+    loaded_rating = getattr(instance, '_loaded_rating', None)
+    if loaded_flight_id is None or loaded_rating is None:
+        return
+    if loaded_flight_id != instance.flight_id:
+        _apply_rating_change(loaded_flight_id, -loaded_rating, -1)
+        _apply_rating_change(instance.flight_id, instance.rating, 1)
+    elif loaded_rating != instance.rating:
+        _apply_rating_change(instance.flight_id, instance.rating - loaded_rating)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    """Поддержка сводки рейтинга при удалении отзыва"""
+    _apply_rating_change(instance.flight_id, -instance.rating, -1)
+
+
+@receiver(post_save, sender=Flight)
+def move_flight_rating(sender, instance, created, raw=False, **kwargs):
+    """Переносит оценки рейса в сводку новой авиакомпании при ее смене"""
+    loaded_airline_id = getattr(instance, '_loaded_airline_id', None)
+    instance._loaded_airline_id = instance.airline_id
+    if raw or created or loaded_airline_id in (None, instance.airline_id):
+        return
+    flight = Flight.objects.filter(pk=instance.pk)
+    rating_sum = Subquery(flight.values('rating_sum'))
+    rating_count = Subquery(flight.values('rating_count'))
+    Airline.objects.filter(pk=loaded_airline_id).update(
+        rating_sum=F('rating_sum') - rating_sum, rating_count=F('rating_count') - rating_count,
+    )
+    Airline.objects.filter(pk=instance.airline_id).update(
+        rating_sum=F('rating_sum') + rating_sum, rating_count=F('rating_count') + rating_count,
+    )
+
+
+# Инвалидация кэша табло. Версии увеличиваются только после фиксации
+# транзакции, иначе параллельный запрос мог бы закэшировать под новой
+# версией еще не зафиксированное состояние.
+
+@receiver(post_save, sender=Flight)
+@receiver(post_delete, sender=Flight)
+def invalidate_flight_pages(sender, instance, **kwargs):
+    transaction.on_commit(lambda: cache.bump_flight(instance.pk))
+    transaction.on_commit(lambda: live.publish_flight(instance.pk))
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_flight_pages_on_change(sender, instance, **kwargs):
+    flight_ids = {instance.flight_id, getattr(instance, '_loaded_flight_id', None)} - {None}
+    for flight_id in flight_ids:
+        transaction.on_commit(lambda flight_id=flight_id: cache.bump_flight(flight_id))
+        if sender is Reservation:
+            # Живое табло показывает свободные места, отзывы на него не влияют
+            transaction.on_commit(lambda flight_id=flight_id: live.publish_flight(flight_id))
+
+
+@receiver(post_save, sender=Airline)
+@receiver(post_delete, sender=Airline)
+def invalidate_airline_pages(sender, instance, **kwargs):
+    transaction.on_commit(cache.bump_airlines)
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Сохранение профиля пользователя"""
-    if hasattr(instance, 'userprofile'):
-        instance.userprofile.save()
-    else:
-        UserProfile.objects.create(user=instance)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Пользователь в кэше flights.auth (вход, смена пароля, блокировка)"""
+    user_id = instance.pk
+    transaction.on_commit(lambda: cache.bump_user(user_id))
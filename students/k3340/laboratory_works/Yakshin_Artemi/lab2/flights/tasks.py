@@ -0,0 +1,215 @@
+"""Очередь фоновых заданий в БД, без внешнего брокера
+
+Задание — строка BackgroundJob. enqueue() вставляет ее в текущей транзакции:
+если транзакция откатится, задания не будет, а после фиксации его увидит
+воркер (команда run_worker). Воркер забирает готовое задание одним
+условным UPDATE: статус running, счетчик попыток +1 и run_after = сейчас +
+TASK_LEASE_SECONDS. На PostgreSQL кандидат выбирается с SELECT ... FOR UPDATE
+SKIP LOCKED, поэтому воркеры не ждут друг друга.
+
+Доставка «хотя бы один раз»: если воркер упал или завис, срок аренды
+истекает и задание выполняет другой воркер. Поэтому задания должны быть
+идемпотентными; долгие задания продлевают аренду через heartbeat(). Ошибка
+откладывает задание с экспоненциальной задержкой, после max_attempts
+попыток оно остается со статусом failed. TaskFailed завершает задание
+сразу, без повторов.
+"""
+import logging
+import random
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import Count, F, Min
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import cache
+from .metrics import TASK_DURATION, TASK_WAIT, TASKS_PROCESSED, Gauge
+from .models import BackgroundJob, Flight, Reservation
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+# Потолок задержки между попытками
+MAX_RETRY_DELAY = 3600
+
+Task = namedtuple('Task', ['func', 'label', 'max_attempts'])
+
+
+class TaskFailed(Exception):
+    """Ошибка, которую повтор не исправит: задание сразу получает статус failed"""
+
+
+def register(name, func, label, max_attempts=None):
+    """Регистрирует задание: func(job) -> None"""
+    TASKS[name] = Task(func, label, max_attempts)
+    return func
+
+
+def task(name, label, max_attempts=None):
+    """Декоратор задания, которому нужны только параметры: func(**job.params)"""
+    def decorator(func):
+        register(name, lambda job: func(**job.params), label, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, params=None, object_ids=(), user=None, delay=0):
+    """Ставит задание в очередь; выполнение — после фиксации текущей транзакции"""
+    object_ids = list(object_ids)
+    return BackgroundJob.objects.create(
+        action=name, params=params or {}, object_ids=object_ids, total=len(object_ids),
+        max_attempts=TASKS[name].max_attempts or settings.TASK_MAX_ATTEMPTS,
+        run_after=timezone.now() + timedelta(seconds=delay), created_by=user,
+    )
+
+
+def _ready(now):
+    # Ожидающие задания, которым пора, и выполняемые с истекшей арендой
+    return BackgroundJob.objects.using(DEFAULT_DB_ALIAS).filter(
+        status__in=['pending', 'running'], run_after__lte=now,
+    )
+
+
+def claim(worker):
+    """Забирает одно готовое задание или возвращает None"""
+    now = timezone.now()
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        candidates = _ready(now).order_by('run_after')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        candidate = candidates.values_list('pk', 'run_after').first()
+        if candidate is None:
+            return None
+        pk, ready_at = candidate
+        # Условие повторяется в UPDATE: на БД без SKIP LOCKED (SQLite) задание
+        # между SELECT и UPDATE мог забрать другой воркер
+        claimed = _ready(now).filter(pk=pk, run_after=ready_at).update(
+            status='running', worker=worker, attempts=F('attempts') + 1,
+            run_after=now + timedelta(seconds=settings.TASK_LEASE_SECONDS),
+            started_at=Coalesce('started_at', now),
+        )
+    if not claimed:
+        return None
+    job = BackgroundJob.objects.using(DEFAULT_DB_ALIAS).get(pk=pk)
+    TASK_WAIT.observe((now - ready_at).total_seconds(), task=job.action)
+    return job
+
+
+def heartbeat(job, **fields):
+    """Продлевает аренду задания (и обновляет fields тем же запросом)"""
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        run_after=timezone.now() + timedelta(seconds=settings.TASK_LEASE_SECONDS), **fields,
+    )
+
+
+def retry_delay(attempts):
+    """Задержка перед следующей попыткой: удваивается, с разбросом до 25%"""
+    delay = min(settings.TASK_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+
+def execute(job):
+    """Выполняет забранное задание и записывает результат"""
+    jobs = BackgroundJob.objects.filter(pk=job.pk)
+    registered = TASKS.get(job.action)
+    started = time.perf_counter()
+    try:
+        if registered is None:
+            raise LookupError(f'Неизвестное задание {job.action!r}')
+        registered.func(job)
+    except Exception as exc:
+        retryable = registered is not None and not isinstance(exc, TaskFailed)
+        if retryable and job.attempts < job.max_attempts:
+            delay = retry_delay(job.attempts)
+            logger.warning('Задание %s (%s), попытка %s: %s; повтор через %.0f с',
+                           job.pk, job.action, job.attempts, exc, delay, exc_info=True)
+            jobs.update(status='pending', error=str(exc),
+                        run_after=timezone.now() + timedelta(seconds=delay))
+            result = 'retry'
+        else:
+            logger.exception('Задание %s (%s) завершилось ошибкой', job.pk, job.action)
+            jobs.update(status='failed', error=str(exc), finished_at=timezone.now())
+            result = 'failed'
+    else:
+        jobs.update(status='done', error='', finished_at=timezone.now())
+        result = 'done'
+    TASK_DURATION.observe(time.perf_counter() - started, task=job.action)
+    TASKS_PROCESSED.inc(task=job.action, result=result)
+    return result
+
+
+def purge_done(older_than, batch_size=1000):
+    """Удаляет выполненные задания, завершенные раньше older_than; failed остаются"""
+    finished = BackgroundJob.objects.filter(status='done', finished_at__lt=older_than).order_by()
+    deleted = 0
+    while True:
+        ids = list(finished.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # У заданий нет связанных объектов и обработчиков удаления: один DELETE
+        deleted += BackgroundJob.objects.filter(pk__in=ids).delete()[0]
+
+
+def queue_depth():
+    """Незавершенные задания по типам и статусам (для /metrics)"""
+    rows = (
+        BackgroundJob.objects.filter(status__in=['pending', 'running'])
+        .values_list('action', 'status').annotate(total=Count('pk')).order_by()
+    )
+    return {(action, status): total for action, status, total in rows}
+
+
+def queue_lag():
+    """Сколько секунд ждет самое старое готовое задание каждого типа"""
+    now = timezone.now()
+    rows = (
+        BackgroundJob.objects.filter(status='pending', run_after__lte=now)
+        .values_list('action').annotate(oldest=Min('run_after')).order_by()
+    )
+    return {(action,): (now - oldest).total_seconds() for action, oldest in rows}
+
+
+QUEUE_DEPTH = Gauge(
+    'flights_task_queue_depth', 'Незавершенные задания очереди', ['task', 'status'], function=queue_depth)
+QUEUE_LAG = Gauge(
+    'flights_task_queue_lag_seconds', 'Ожидание самого старого готового задания', ['task'], function=queue_lag)
+
+
+# Задания приложения
+
+@task('send_confirmation', 'Подтверждение брони')
+def send_confirmation(reservation_id):
+    """Письмо с номером билета; отмененная бронь и пользователь без email пропускаются"""
+    reservation = (
+        Reservation.objects.using(DEFAULT_DB_ALIAS)
+        .select_related('user', 'flight__airline')
+        .filter(pk=reservation_id).first()
+    )
+    if reservation is None or not reservation.user.email:
+        return
+    message = render_to_string('flights/emails/booking_confirmation.txt', {'reservation': reservation})
+    send_mail(f'Бронь на рейс {reservation.flight.flight_number}: билет {reservation.ticket_number}',
+              message, None, [reservation.user.email])
+
+
+@task('reconcile_seat_counters', 'Пересчет счетчиков мест')
+def reconcile_seat_counters(flight_ids):
+    """Счетчик и карта мест выбранных рейсов заново по таблице броней"""
+    for flight_id in flight_ids:
+        with transaction.atomic():
+            # Блокировка рейса: бронь, оформляемая параллельно, дождется пересчета
+            flight = (
+                Flight.objects.select_for_update(of=('self',)).select_related('seat_layout')
+                .filter(pk=flight_id).first()
+            )
+            if flight is None:
+                continue
+            Flight.objects.filter(pk=flight_id).update(reserved_count=flight.reservations.count())
+            flight.rebuild_seat_bitmap()
+    cache.bump_flights(flight_ids)
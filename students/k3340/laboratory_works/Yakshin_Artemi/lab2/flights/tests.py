@@ -1,3 +1,1689 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import bulk, cache as board_cache, live, metrics, profiling, tasks, tickets
+from .booking import BookingError, FlightFull, SeatTaken, _classify, book_seat
+from .forms import ReservationForm
+from .models import Airline, BackgroundJob, Flight, Reservation, Review, TicketSequence, UserProfile
+from .pagination import CursorPaginator, EstimatedCountPaginator
+from .routers import STICKY_COOKIE, ReplicaRouter
+from .seatmap import InvalidSeat, SeatMap
+
+
+SEAT_LETTERS = 'ABCDEF'
+
+# Тесты не пишут журнал медленных запросов; тесты журнала включают его сами
+test_settings = override_settings(PROFILING_SAMPLE_RATE=0)
+
+
+def setUpModule():
+    test_settings.enable()
+
+
+def tearDownModule():
+    test_settings.disable()
+
+
+def seed_board(flights_count, reservations_per_flight, reviews_per_flight, users_count):
+    """Заполняет БД синтетическими данными через bulk_create (без сигналов)"""
+    rng = random.Random(42)
+    airlines = Airline.objects.bulk_create([
+        Airline(name=f'Авиакомпания {code}', code=code) for code in ('SU', 'S7', 'FV', 'UT', 'DP')
+    ])
+
+    password = make_password('password123')
+    users = User.objects.bulk_create([
+        User(username=f'bench{i}', password=password) for i in range(users_count)
+    ])
+
+    now = timezone.now()
+    flights = Flight.objects.bulk_create([
+        Flight(
+            flight_number=f'{airlines[i % len(airlines)].code}{100 + i % 900}',
+            airline=airlines[i % len(airlines)],
+            departure_time=now + timedelta(minutes=15 * i),
+            arrival_time=now + timedelta(minutes=15 * i + 120),
+            flight_type='departure' if i % 2 else 'arrival',
+            gate_number=f'{i % 20 + 1}A',
+            origin='Москва',
+            destination='Сочи',
+            capacity=250,
+            price=10000,
+        )
+        for i in range(flights_count)
+    ])
+
+    reservations = []
+    reviews = []
+    for index, flight in enumerate(flights):
+        for n in range(reservations_per_flight):
+            reservations.append(Reservation(
+                user=users[(index + n) % users_count],
+                flight=flight,
+                seat_number=f'{n // len(SEAT_LETTERS) + 1}{SEAT_LETTERS[n % len(SEAT_LETTERS)]}',
+                ticket_number=f'B{flight.pk:08d}{n:03d}',
+            ))
+        for n in range(reviews_per_flight):
+            reviews.append(Review(
+                user=users[(index + n) % users_count],
+                flight=flight,
+                text='Синтетический отзыв для нагрузочного теста.',
+                rating=rng.randint(1, 10),
+            ))
+    Reservation.objects.bulk_create(reservations, batch_size=2000)
+    Review.objects.bulk_create(reviews, batch_size=2000)
+    call_command('rebuild_seat_counters', stdout=open(os.devnull, 'w'))
+    call_command('rebuild_ratings', stdout=open(os.devnull, 'w'))
+    return flights, users
+
+
+class QueryBudgetMixin:
+    """Бюджеты SQL-запросов на страницу: не должны зависеть от объема данных"""
+
+    # Сессия и пользователь для авторизованных запросов уже учтены в бюджете
+    QUERY_BUDGETS = {
+        'flight_list': 1,
+        'flight_list_search': 2,
+        'flight_detail': 3,
+        'flight_detail_auth': 6,
+        'make_reservation': 3,
+        'edit_reservation': 3,
+        'cancel_reservation': 3,
+        'add_review': 4,
+        'register': 0,
+        'user_reservations': 4,
+        'flight_board_api': 1,
+        'admin_airline': 5,
+        'admin_flight': 5,
+        'admin_reservation': 5,
+        'admin_review': 5,
+        'admin_reservation_add': 3,
+        'admin_flight_autocomplete': 4,
+    }
+
+    def setUp(self):
+        # Данные откатываются между тестами, а локальный кэш страниц — нет
+        cache.clear()
+
+    def budget_urls(self):
+        flight = self.flights[len(self.flights) // 2]
+        reservation = Reservation.objects.filter(user=self.user).order_by('pk').first()
+        return {
+            'flight_list': (reverse('flight_list'), False),
+            'flight_list_search': (reverse('flight_list') + '?search=SU&type=departure', False),
+            'flight_detail': (reverse('flight_detail', args=[flight.pk]), False),
+            'flight_detail_auth': (reverse('flight_detail', args=[flight.pk]), True),
+            'make_reservation': (reverse('make_reservation', args=[flight.pk]), True),
+            'edit_reservation': (reverse('edit_reservation', args=[reservation.pk]), True),
+            'cancel_reservation': (reverse('cancel_reservation', args=[reservation.pk]), True),
+            'add_review': (reverse('add_review', args=[self.unreviewed_flight.pk]), True),
+            'register': (reverse('register'), False),
+            'user_reservations': (reverse('user_reservations'), True),
+            'flight_board_api': (reverse('flight_board_api') + '?type=departure', False),
+            'admin_airline': (reverse('admin:flights_airline_changelist'), 'admin'),
+            'admin_flight': (reverse('admin:flights_flight_changelist'), 'admin'),
+            'admin_reservation': (reverse('admin:flights_reservation_changelist'), 'admin'),
+            'admin_review': (reverse('admin:flights_review_changelist'), 'admin'),
+            'admin_reservation_add': (reverse('admin:flights_reservation_add'), 'admin'),
+            'admin_flight_autocomplete': (
+                reverse('admin:autocomplete') + '?app_label=flights&model_name=reservation&field_name=flight&term=SU',
+                'admin',
+            ),
+        }
+
+    def login_as(self, who):
+        self.client.logout()
+        if who == 'admin':
+            self.client.force_login(self.admin)
+        elif who:
+            self.client.force_login(self.user)
+
+    def fetch(self, name):
+        url, who = self.budget_urls()[name]
+        self.login_as(who)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, name)
+        return ctx
+
+    def assertWithinBudget(self, name):
+        ctx = self.fetch(name)
+        budget = self.QUERY_BUDGETS[name]
+        executed = len(ctx.captured_queries)
+        self.assertLessEqual(
+            executed, budget,
+            f'{name}: {executed} запросов при бюджете {budget}:\n'
+            + '\n'.join(q['sql'] for q in ctx.captured_queries),
+        )
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Каждая страница укладывается в фиксированное число запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=30, reservations_per_flight=5,
+                                        reviews_per_flight=3, users_count=6)
+        cls.user = users[0]
+        cls.unreviewed_flight = cls.flights[-1]
+        Review.objects.filter(flight=cls.unreviewed_flight).delete()
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'root')
+
+    def test_query_budgets(self):
+        for name in self.QUERY_BUDGETS:
+            with self.subTest(url=name):
+                self.assertWithinBudget(name)
+
+    def test_flight_list_does_not_query_per_card(self):
+        ctx = self.fetch('flight_list')
+        reservation_table = connection.ops.quote_name(Reservation._meta.db_table)
+        review_table = connection.ops.quote_name(Review._meta.db_table)
+        # Отдельный запрос на карточку выглядит как "FROM таблица WHERE ..." без алиаса
+        for query in ctx.captured_queries:
+            self.assertNotIn(f'FROM {reservation_table} WHERE', query['sql'])
+            self.assertNotIn(f'FROM {review_table} WHERE', query['sql'])
+
+
+# Нагрузочные тесты долгие и зависят от машины: только по запросу,
+# ``BENCH=1 manage.py test --tag=benchmark``
+run_benchmarks = skipUnless(os.environ.get('BENCH'), 'нагрузочные тесты запускаются с BENCH=1')
+
+
+@tag('benchmark')
+@run_benchmarks
+class ViewPerformanceTests(QueryBudgetMixin, TestCase):
+    """Бюджеты запросов и p95 времени ответа на большом наборе данных"""
+
+    FLIGHTS = int(os.environ.get('BENCH_FLIGHTS', 2000))
+    RESERVATIONS_PER_FLIGHT = int(os.environ.get('BENCH_RESERVATIONS_PER_FLIGHT', 10))
+    REVIEWS_PER_FLIGHT = int(os.environ.get('BENCH_REVIEWS_PER_FLIGHT', 5))
+    REPEATS = int(os.environ.get('BENCH_REPEATS', 20))
+    P95_SECONDS = float(os.environ.get('BENCH_P95_SECONDS', 1.0))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(
+            flights_count=cls.FLIGHTS,
+            reservations_per_flight=cls.RESERVATIONS_PER_FLIGHT,
+            reviews_per_flight=cls.REVIEWS_PER_FLIGHT,
+            users_count=int(os.environ.get('BENCH_USERS', 500)),
+        )
+        cls.user = users[0]
+        cls.unreviewed_flight = cls.flights[-1]
+        Review.objects.filter(flight=cls.unreviewed_flight).delete()
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'root')
+
+    def test_query_budgets_at_scale(self):
+        for name in self.QUERY_BUDGETS:
+            with self.subTest(url=name):
+                self.assertWithinBudget(name)
+
+    def test_p95_response_time(self):
+        for name, (url, who) in self.budget_urls().items():
+            with self.subTest(url=name):
+                self.login_as(who)
+                timings = []
+                for _ in range(self.REPEATS):
+                    started = time.perf_counter()
+                    self.client.get(url)
+                    timings.append(time.perf_counter() - started)
+                p95 = statistics.quantiles(timings, n=20)[-1]
+                self.assertLess(p95, self.P95_SECONDS, f'{name}: p95 {p95 * 1000:.1f} мс')
+
+
+class AsyncViewTests(TestCase):
+    """Страницы табло под ASGI-обработчиком"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=20, reservations_per_flight=3,
+                                        reviews_per_flight=2, users_count=4)
+        cls.user = users[0]
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_pages_render_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        flight = self.flights[0]
+
+        response = await self.async_client.get(reverse('flight_list'))
+        self.assertEqual(len(response.context['page_obj']), 12)
+
+        response = await self.async_client.get(reverse('flight_detail', args=[flight.pk]))
+        self.assertEqual(len(response.context['passengers']), 3)
+        self.assertEqual(len(response.context['reviews']), 2)
+        self.assertEqual(response.context['available_seats'], flight.capacity - 3)
+        own = [r.seat_number for r in response.context['passengers'] if r.user_id == self.user.pk]
+        self.assertEqual([r.seat_number for r in response.context['user_reservations']], own)
+
+        response = await self.async_client.get(reverse('user_reservations'))
+        self.assertEqual(response.context['reservations_total'], 15)
+
+    async def test_missing_flight_is_404(self):
+        response = await self.async_client.get(reverse('flight_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+class BoardCacheTests(TestCase):
+    """Анонимное табло отдается из кэша и сбрасывается при изменениях"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=3, reservations_per_flight=2,
+                                        reviews_per_flight=1, users_count=4)
+        cls.user = users[-1]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_board_is_served_from_cache(self):
+        self.client.get(reverse('flight_list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('flight_list'))
+        self.assertContains(response, 'Свободно мест: 248/250')
+
+    def test_reservation_invalidates_board_and_detail(self):
+        flight = self.flights[0]
+        detail_url = reverse('flight_detail', args=[flight.pk])
+        self.client.get(reverse('flight_list'))
+        self.client.get(detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(user=self.user, flight=flight, seat_number='20A')
+
+        self.assertContains(self.client.get(reverse('flight_list')), 'Свободно мест: 247/250')
+        self.assertContains(self.client.get(detail_url), '20A')
+
+    def test_authenticated_users_bypass_cache(self):
+        self.client.get(reverse('flight_list'))
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('flight_list'))
+        self.assertGreater(len(ctx.captured_queries), 0)
+
+
+class FlightSearchTests(TestCase):
+    """Поиск по табло: префикс номера рейса, ранжирование, города"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, _ = seed_board(flights_count=10, reservations_per_flight=0,
+                                    reviews_per_flight=0, users_count=1)
+        Flight.objects.filter(pk=cls.flights[2].pk).update(origin='Новый Сургут')
+        Flight.objects.filter(pk=cls.flights[8].pk).update(destination='Сургут')
+
+    def search(self, query):
+        from .views import board_queryset
+        return list(board_queryset(query))
+
+    def test_partial_flight_number_matches_by_prefix(self):
+        results = self.search('su 10')
+        self.assertTrue(results)
+        self.assertTrue(all(f.flight_number.startswith('SU10') for f in results))
+
+    def test_exact_number_ranks_first(self):
+        exact = self.flights[5]
+        results = self.search(exact.flight_number.lower())
+        self.assertEqual(results[0].pk, exact.pk)
+
+    def test_place_prefix_ranks_above_substring(self):
+        results = self.search('Сур')
+        self.assertEqual([f.pk for f in results], [self.flights[8].pk, self.flights[2].pk])
+
+
+class CursorPaginationTests(TestCase):
+    """Курсорная пагинация проходит выборку без пропусков и повторов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, _ = seed_board(flights_count=30, reservations_per_flight=0,
+                                    reviews_per_flight=0, users_count=1)
+        # Одинаковое время вылета у части рейсов: порядок решает id
+        Flight.objects.filter(pk__in=[f.pk for f in cls.flights[10:14]]).update(
+            departure_time=cls.flights[10].departure_time)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, paginator):
+        pages = [paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return pages
+
+    def test_forward_and_backward_walk(self):
+        paginator = CursorPaginator(Flight.objects.all(), 7, ordering=['departure_time', 'id'])
+        pages = self.walk(paginator)
+        seen = [f.pk for page in pages for f in page]
+        expected = list(Flight.objects.order_by('departure_time', 'id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertFalse(pages[0].has_previous)
+
+        page = pages[-1]
+        for expected_page in reversed(pages[:-1]):
+            page = paginator.get_page(page.previous_cursor)
+            self.assertEqual([f.pk for f in page], [f.pk for f in expected_page])
+        self.assertFalse(page.has_previous)
+
+    def test_descending_ordering(self):
+        paginator = CursorPaginator(Flight.objects.all(), 4, ordering=['-departure_time', '-id'])
+        seen = [f.pk for page in self.walk(paginator) for f in page]
+        expected = list(Flight.objects.order_by('-departure_time', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = CursorPaginator(Flight.objects.all(), 5, ordering=['departure_time', 'id'])
+        self.assertEqual([f.pk for f in paginator.get_page('not-a-cursor')],
+                         [f.pk for f in paginator.get_page()])
+
+    def test_board_links_carry_cursor(self):
+        response = self.client.get(reverse('flight_list'))
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'?cursor={next_cursor}')
+        response = self.client.get(reverse('flight_list'), {'cursor': next_cursor})
+        self.assertEqual(response.context['page_obj'][0].pk, self.flights[12].pk)
+
+
+class BookingTests(TestCase):
+    """Ошибки бронирования превращаются в понятные сообщения, а не в 500"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=1, reservations_per_flight=0,
+                                        reviews_per_flight=0, users_count=2)
+        cls.flight = cls.flights[0]
+        Flight.objects.filter(pk=cls.flight.pk).update(capacity=2)
+        cls.user, cls.other = users
+
+    def test_taken_seat_is_reported_on_the_form(self):
+        book_seat(self.other, self.flight, '1A')
+        self.client.force_login(self.user)
+        # Форма считает место свободным (гонка), ограничение БД ловит конфликт
+        with mock.patch.object(ReservationForm, 'clean_seat_number', lambda form: '1A'):
+            response = self.client.post(reverse('make_reservation', args=[self.flight.pk]),
+                                        {'seat_number': '1A'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'seat_number', 'Это место уже занято.')
+
+    def test_only_seat_constraint_means_seat_taken(self):
+        postgres = ('duplicate key value violates unique constraint '
+                    '"flights_reservation_flight_id_seat_number_5a5b3b3e_uniq"\n'
+                    'DETAIL:  Key (flight_id, seat_number)=(1, 1A) already exists.')
+        self.assertIsInstance(_classify(IntegrityError(postgres)), SeatTaken)
+        self.assertIsNone(_classify(IntegrityError(
+            'UNIQUE constraint failed: flights_reservation.ticket_number')))
+        # Удаленный пользователь — не занятое место: ошибка не маскируется
+        with mock.patch.object(Reservation, 'save', side_effect=IntegrityError('FOREIGN KEY constraint failed')), \
+                self.assertRaisesMessage(IntegrityError, 'FOREIGN KEY'):
+            book_seat(self.user, self.flight, '1A')
+
+    def test_capacity_is_enforced_by_database(self):
+        book_seat(self.user, self.flight, '1A')
+        book_seat(self.user, self.flight, '1B')
+        with self.assertRaises(FlightFull):
+            book_seat(self.other, self.flight, '1C')
+        self.flight.refresh_from_db()
+        self.assertEqual(self.flight.reserved_count, 2)
+        self.assertEqual(self.flight.reservations.count(), 2)
+
+
+@tag('benchmark')
+@run_benchmarks
+class BookingConcurrencyTests(TransactionTestCase):
+    """Много потоков одновременно бронируют места на одном рейсе"""
+
+    THREADS = int(os.environ.get('BENCH_BOOKING_THREADS', 16))
+    ATTEMPTS_PER_THREAD = 12
+    CAPACITY = 40
+
+    def setUp(self):
+        flights, self.users = seed_board(flights_count=1, reservations_per_flight=0,
+                                         reviews_per_flight=0, users_count=self.THREADS)
+        self.flight = flights[0]
+        Flight.objects.filter(pk=self.flight.pk).update(capacity=self.CAPACITY)
+
+    def test_no_overbooking_and_no_double_seats(self):
+        outcomes = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def buyer(user):
+            barrier.wait()
+            try:
+                for n in range(self.ATTEMPTS_PER_THREAD):
+                    # Потоки выбирают места из одного небольшого набора, чтобы конфликтовать
+                    seat = f'{n % 7 + 1}{SEAT_LETTERS[(user.pk + n) % len(SEAT_LETTERS)]}'
+                    try:
+                        book_seat(user, self.flight, seat, attempts=100)
+                        outcomes.append('ok')
+                    except BookingError as exc:
+                        outcomes.append(type(exc).__name__)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.flight.refresh_from_db()
+        booked = Reservation.objects.filter(flight=self.flight)
+        self.assertEqual(outcomes.count('ok'), booked.count())
+        self.assertEqual(self.flight.reserved_count, booked.count())
+        self.assertLessEqual(booked.count(), self.CAPACITY)
+        self.assertEqual(self.flight.seat_map.occupied_count(), booked.count())
+        self.assertEqual(booked.values('seat_number').distinct().count(), booked.count())
+        self.assertEqual(len(outcomes), self.THREADS * self.ATTEMPTS_PER_THREAD)
+
+
+class AutocommitReservationTests(TransactionTestCase):
+    """Бронь, сохраненная вне atomic(): счетчик мест меняется в той же транзакции"""
+
+    def test_create_outside_atomic(self):
+        flight = seed_board(flights_count=1, reservations_per_flight=0, reviews_per_flight=0, users_count=1)[0][0]
+        user = User.objects.get()
+        # SQLite не поддерживает FOR UPDATE: включаем проверки Django, как на PostgreSQL
+        features = connection.features
+        with mock.patch.object(features, 'has_select_for_update', True), \
+                mock.patch.object(features, 'has_select_for_update_of', True), \
+                mock.patch.object(connection.ops, 'for_update_sql', return_value=''):
+            reservation = Reservation.objects.create(user=user, flight=flight, seat_number='1A')
+        flight.refresh_from_db()
+        self.assertEqual(flight.reserved_count, 1)
+        self.assertFalse(flight.seat_map.is_free('1A'))
+        reservation.delete()
+        flight.refresh_from_db()
+        self.assertEqual(flight.reserved_count, 0)
+
+
+class AutocommitReviewTests(TransactionTestCase):
+    """Отзыв из формы и сводка рейтинга сохраняются вместе или не сохраняются"""
+
+    def test_rating_failure_rolls_back_review(self):
+        flight = seed_board(flights_count=1, reservations_per_flight=0, reviews_per_flight=0, users_count=1)[0][0]
+        self.client.force_login(User.objects.get())
+
+        def flight_updated_then_failed(flight_id, rating=0, count=0):
+            Flight.objects.filter(pk=flight_id).update(rating_count=F('rating_count') + count)
+            raise DatabaseError('сбой обновления авиакомпании')
+
+        with mock.patch('flights.signals._apply_rating_change', flight_updated_then_failed), \
+                self.assertRaises(DatabaseError):
+            self.client.post(reverse('add_review', args=[flight.pk]),
+                             {'text': 'Хороший рейс, все вовремя.', 'rating': 9})
+        self.assertFalse(Review.objects.exists())
+        flight.refresh_from_db()
+        self.assertEqual(flight.rating_count, 0)
+
+
+class SeatMapTests(TestCase):
+    """Битовая карта мест и ее синхронизация с бронями"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=2, reservations_per_flight=0,
+                                        reviews_per_flight=0, users_count=1)
+        cls.flight = cls.flights[0]
+        cls.user = users[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_seat_map_bits(self):
+        seat_map = SeatMap(rows=3, letters='ABCD')
+        self.assertEqual(len(seat_map.to_bytes()), 2)
+        seat_map.occupy('2C')
+        self.assertFalse(seat_map.is_free('2C'))
+        self.assertTrue(seat_map.is_free('2D'))
+        restored = SeatMap(rows=3, letters='ABCD', bitmap=seat_map.to_bytes())
+        self.assertEqual(restored.occupied_count(), 1)
+        restored.release('2C')
+        self.assertTrue(restored.is_free('2C'))
+        for seat in ('4A', '1E', '0A', 'A1', ''):
+            with self.assertRaises(InvalidSeat):
+                seat_map.index(seat)
+
+    def test_bitmap_follows_reservation_lifecycle(self):
+        reservation = book_seat(self.user, self.flight, '3B')
+        self.flight.refresh_from_db()
+        self.assertFalse(self.flight.seat_map.is_free('3B'))
+
+        reservation.seat_number = '4C'
+        reservation.save()
+        self.flight.refresh_from_db()
+        self.assertTrue(self.flight.seat_map.is_free('3B'))
+        self.assertFalse(self.flight.seat_map.is_free('4C'))
+
+        reservation.flight = self.flights[1]
+        reservation.save()
+        self.flight.refresh_from_db()
+        self.assertEqual(self.flight.seat_map.occupied_count(), 0)
+        self.assertEqual(self.flight.reserved_count, 0)
+
+        reservation.delete()
+        other = Flight.objects.get(pk=self.flights[1].pk)
+        self.assertEqual((other.reserved_count, other.seat_map.occupied_count()), (0, 0))
+
+    def test_move_locks_both_flights_in_one_query(self):
+        reservation = book_seat(self.user, self.flight, '3B')
+        reservation = Reservation.objects.get(pk=reservation.pk)
+        reservation.flight = self.flights[1]
+        with CaptureQueriesContext(connection) as queries:
+            reservation.save()
+        # Встречные переносы не взаимоблокируются: оба рейса — один SELECT по возрастанию id
+        table = Flight._meta.db_table
+        selects = [query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']]
+        self.assertEqual(len(selects), 1)
+        self.assertIn(' IN (', selects[0])
+        self.assertIn(f'ORDER BY "{table}"."id" ASC', selects[0])
+        self.assertEqual([Flight.objects.get(pk=flight.pk).reserved_count for flight in self.flights], [0, 1])
+
+    def test_form_validates_seat_without_reading_reservations(self):
+        book_seat(self.user, self.flight, '1A')
+        flight = Flight.objects.get(pk=self.flight.pk)
+        with self.assertNumQueries(0):
+            form = ReservationForm({'seat_number': '1a'}, flight=flight)
+            form.fields['seat_number'].clean('1A')
+            form.is_valid()
+        self.assertFormError(form, 'seat_number', 'Это место уже занято.')
+        self.assertFalse(ReservationForm({'seat_number': '99A'}, flight=flight).is_valid())
+
+    def test_detail_page_renders_clickable_map(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('flight_detail', args=[self.flight.pk]))
+        self.assertContains(response, reverse('make_reservation', args=[self.flight.pk]) + '?seat=1A')
+        response = self.client.get(reverse('make_reservation', args=[self.flight.pk]), {'seat': '2B'})
+        self.assertEqual(response.context['form']['seat_number'].value(), '2B')
+
+
+class RatingAggregateTests(TestCase):
+    """Сводка рейтинга рейсов и авиакомпаний ведется без чтения отзывов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, cls.users = seed_board(flights_count=10, reservations_per_flight=0,
+                                            reviews_per_flight=2, users_count=4)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertRatingsConsistent(self):
+        expected = {
+            flight.pk: (flight.rating_sum, flight.rating_count)
+            for flight in Flight.objects.only('rating_sum', 'rating_count')
+        }
+        airlines = dict(Airline.objects.values_list('pk', 'rating_sum'))
+        call_command('rebuild_ratings', stdout=open(os.devnull, 'w'))
+        for flight in Flight.objects.only('rating_sum', 'rating_count'):
+            self.assertEqual(expected[flight.pk], (flight.rating_sum, flight.rating_count))
+        self.assertEqual(airlines, dict(Airline.objects.values_list('pk', 'rating_sum')))
+
+    def test_review_changes_update_flight_and_airline(self):
+        flight = self.flights[0]
+        self.client.force_login(self.users[3])
+        self.client.post(reverse('add_review', args=[flight.pk]),
+                         {'text': 'Хороший рейс, все вовремя.', 'rating': 9})
+        self.assertRatingsConsistent()
+
+        review = Review.objects.get(user=self.users[3], flight=flight)
+        self.assertEqual(review.rating, 9)
+        review.rating = 3
+        review.save()
+        self.assertRatingsConsistent()
+
+        review.flight = self.flights[1]
+        review.save()
+        self.assertRatingsConsistent()
+
+        review.delete()
+        self.assertRatingsConsistent()
+
+    def test_flight_airline_change_moves_rating(self):
+        flight = Flight.objects.get(pk=self.flights[0].pk)
+        flight.airline = Airline.objects.exclude(pk=flight.airline_id).first()
+        flight.save()
+        self.assertRatingsConsistent()
+
+    def test_stale_flight_admin_save_keeps_counters(self):
+        flight = Flight.objects.get(pk=self.flights[0].pk)
+        Review.objects.create(user=self.users[3], flight=flight, text='Отлично', rating=10)
+        flight.gate_number = '7B'
+        form = mock.Mock(changed_data=['gate_number'])
+        admin.site._registry[Flight].save_model(None, flight, form, change=True)
+        flight.refresh_from_db()
+        self.assertEqual((flight.gate_number, flight.rating_count), ('7B', 3))
+        self.assertRatingsConsistent()
+
+    def test_plain_save_keeps_model_semantics(self):
+        # Вне админки save() пишет все поля и вставляет удаленную строку заново
+        airline = Airline.objects.get(pk=self.flights[0].airline_id)
+        Airline.objects.filter(pk=airline.pk).delete()
+        airline.save()
+        self.assertEqual(Airline.objects.get(pk=airline.pk).rating_count, airline.rating_count)
+
+    def test_board_does_not_read_reviews(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('flight_list'))
+        self.assertFalse([q for q in queries.captured_queries if Review._meta.db_table in q['sql']])
+        flight = next(f for f in response.context['page_obj'] if f.pk == self.flights[0].pk)
+        self.assertEqual(flight.reviews_count, 2)
+        self.assertAlmostEqual(flight.avg_rating, Flight.objects.get(pk=flight.pk).average_rating)
+
+class FlightBoardApiTests(TestCase):
+    """JSON-табло: компактные строки и условные GET-запросы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=60, reservations_per_flight=3,
+                                        reviews_per_flight=2, users_count=4)
+        cls.user = users[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rows_and_cursor(self):
+        response = self.client.get(reverse('flight_board_api'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual(len(data['results']), 50)
+        first = data['results'][0]
+        self.assertEqual(first['id'], self.flights[0].pk)
+        self.assertEqual(first['available_seats'], 247)
+        self.assertEqual(first['reviews_count'], 2)
+        self.assertEqual(first['airline_code'], self.flights[0].airline.code)
+
+        rest = self.client.get(reverse('flight_board_api'), {'cursor': data['next']}).json()
+        self.assertEqual(len(rest['results']), 10)
+        self.assertIsNone(rest['next'])
+
+    def test_conditional_get_returns_304_until_change(self):
+        url = reverse('flight_board_api')
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book_seat(self.user, self.flights[0], '30A')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['available_seats'], 246)
+
+
+class LiveBoardTests(TestCase):
+    """Живое табло: одно событие на изменение и доставка по SSE"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=3, reservations_per_flight=2,
+                                        reviews_per_flight=0, users_count=2)
+        cls.user = users[0]
+
+    def setUp(self):
+        # Свежий брокер в памяти процесса на каждый тест
+        self.broker = live.InProcessBroker(queue_size=4)
+        patcher = mock.patch.object(live, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def book(self, seat_number):
+        """Бронирует место и возвращает запросы, построившие события табло"""
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                book_seat(self.user, self.flights[0], seat_number)
+        return [q for q in queries.captured_queries if '"available_seats"' in q['sql']]
+
+    async def test_one_query_per_change_for_all_subscribers(self):
+        subscriptions = [self.broker.subscribe() for _ in range(50)]
+        self.assertEqual(len(await sync_to_async(self.book)('30A')), 1)
+
+        messages = [await subscription.get(1) for subscription in subscriptions]
+        self.assertEqual(len(set(messages)), 1)
+        self.assertTrue(messages[0].startswith('event: flight\n'))
+        self.assertIn(f'"id":{self.flights[0].pk},', messages[0])
+        self.assertIn('"available_seats":247', messages[0])
+
+    def test_no_query_without_subscribers(self):
+        self.assertEqual(self.book('30A'), [])
+
+    async def test_slow_subscriber_gets_resync(self):
+        subscription = self.broker.subscribe()
+        for _ in range(6):
+            self.broker.publish(live.format_event('flight', {}))
+        await asyncio.sleep(0)
+        self.assertEqual(await subscription.get(1), live.format_event('resync', {}))
+
+    async def test_stream_delivers_updates(self):
+        response = await self.async_client.get(reverse('flight_updates'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        self.assertEqual(self.broker.subscribers_count(), 1)
+
+        await sync_to_async(self.book)('30B')
+        message = await asyncio.wait_for(anext(stream), 1)
+        self.assertIn(b'"available_seats":247', message)
+        await stream.aclose()
+
+    def test_stream_rejected_under_wsgi(self):
+        response = self.client.get(reverse('flight_updates'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.broker.subscribers_count(), 0)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """Чтение табло с реплики, запись и транзакции — на основной БД"""
+
+    router = ReplicaRouter()
+
+    def with_replica(self):
+        return mock.patch.dict(connections.settings, {'replica': connections.settings['default']})
+
+    def test_without_replica_everything_goes_to_default(self):
+        self.assertEqual(self.router.db_for_read(Flight), 'default')
+        self.assertEqual(self.router.db_for_write(Flight), 'default')
+
+    def test_board_reads_go_to_replica(self):
+        with self.with_replica(), mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(self.router.db_for_read(Flight), 'replica')
+            self.assertEqual(self.router.db_for_read(Reservation), 'replica')
+            # Сессии и пользователи — только с основной БД
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Reservation), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'flights'))
+
+    def test_reads_inside_transaction_stay_on_primary(self):
+        with self.with_replica(), mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertEqual(self.router.db_for_read(Flight), 'default')
+
+
+class ReadYourWritesTests(TransactionTestCase):
+    """Окно read-your-writes на двух файлах SQLite: реплика — отстающий снимок основной БД"""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Снимок реплики делается через VACUUM INTO SQLite')
+        cache.clear()
+        self.flights, (self.user, self.other) = seed_board(flights_count=3, reservations_per_flight=0,
+                                                           reviews_per_flight=0, users_count=2)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        replica_name = os.path.join(directory.name, 'replica.sqlite3')
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [replica_name])
+        # Реплика подключается только на время теста, поэтому и в список
+        # разрешенных тесту БД она добавляется здесь, а не в атрибуте класса
+        for patcher in (
+            mock.patch.dict(connections.settings, {
+                'replica': {**connections.settings['default'], 'NAME': replica_name},
+            }),
+            mock.patch.object(type(self), 'databases', {'default', 'replica'}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: (connections['replica'].close(), connections.__delitem__('replica')))
+
+    def test_writer_reads_primary_others_read_replica(self):
+        flight = self.flights[0]
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('make_reservation', args=[flight.pk]), {'seat_number': '1A'})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        # Сразу после брони пользователь видит ее, хотя реплика отстает
+        response = self.client.get(reverse('flight_detail', args=[flight.pk]))
+        self.assertEqual([r.seat_number for r in response.context['user_reservations']], ['1A'])
+        response = self.client.get(reverse('user_reservations'))
+        self.assertEqual(response.context['reservations_total'], 1)
+
+        # Остальные читают реплику
+        self.client.force_login(self.other)
+        self.client.cookies.pop(STICKY_COOKIE)
+        response = self.client.get(reverse('flight_detail', args=[flight.pk]))
+        self.assertEqual(response.context['passengers'], [])
+        self.assertEqual(response.context['available_seats'], flight.capacity)
+
+    def test_cached_pages_are_filled_from_primary(self):
+        flight = self.flights[0]
+        book_seat(self.user, flight, '1A')
+
+        # Версия табло уже новая, реплика еще нет: в кэш попадают данные основной БД
+        response = self.client.get(reverse('flight_board_api'))
+        seats = {row['id']: row['available_seats'] for row in response.json()['results']}
+        self.assertEqual(seats[flight.pk], flight.capacity - 1)
+        self.assertContains(self.client.get(reverse('flight_detail', args=[flight.pk])),
+                            f'{flight.capacity - 1}/{flight.capacity}')
+
+
+@override_settings(PROFILING_SERVER_TIMING=True)
+class ProfilingTests(TestCase):
+    """Server-Timing, поиск повторяющихся запросов и журнал медленных запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=5, reservations_per_flight=3,
+                                        reviews_per_flight=1, users_count=3)
+        cls.user = users[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def server_timing(self, response):
+        return dict(re.findall(r'(\w+);(?:dur=[\d.]+;?)?(?:desc="(\d+) [^"]*")?', response['Server-Timing']))
+
+    def test_server_timing_counts_queries(self):
+        self.client.force_login(self.user)
+        url = reverse('flight_detail', args=[self.flights[0].pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        timing = self.server_timing(response)
+        self.assertEqual(int(timing['db']), len(queries))
+        self.assertIn('tpl', timing)
+        self.assertIn('total', timing)
+        self.assertNotIn('dup', timing)
+
+    async def test_server_timing_under_asgi(self):
+        response = await self.async_client.get(reverse('flight_list'))
+        self.assertEqual(self.server_timing(response)['db'], '1')
+
+    def test_repeated_queries_are_flagged(self):
+        with profiling.profile() as request_profile:
+            for reservation in Reservation.objects.all()[:3]:
+                reservation.flight.gate_number
+        [(sql, count)] = request_profile.duplicates()
+        self.assertIn(Flight._meta.db_table, sql)
+        self.assertEqual(count, 3)
+        self.assertIn('dup;desc="2 repeated queries"', request_profile.server_timing(0))
+
+    def test_transaction_statements_are_not_duplicates(self):
+        with profiling.profile() as request_profile:
+            for _ in range(3):
+                with transaction.atomic(), transaction.atomic():
+                    Flight.objects.filter(pk=self.flights[0].pk).update(gate_number='1')
+        self.assertEqual(request_profile.duplicates(), [('UPDATE "flights_flight" SET "gate_number" = %s WHERE "flights_flight"."id" = %s', 3)])
+
+    @override_settings(PROFILING_SLOW_MS=0, PROFILING_SAMPLE_RATE=1)
+    def test_slow_request_is_logged(self):
+        url = reverse('flight_detail', args=[self.flights[0].pk])
+        with self.assertLogs('flights.profiling', 'WARNING') as logs:
+            self.client.get(url)
+        self.assertIn(f'GET {url} -> 200', logs.output[0])
+
+
+class MetricsTests(TestCase):
+    """Счетчики бронирования, формат /metrics и многопроцессный режим"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=2, reservations_per_flight=0,
+                                        reviews_per_flight=0, users_count=2)
+        cls.user, cls.other = users
+
+    def value(self, metric, **labels):
+        return metrics.REGISTRY.snapshot().get(metric.key(labels), 0)
+
+    def test_finished_thread_shards_are_merged(self):
+        # Под ASGI у каждого запроса свой поток для синхронного кода
+        async def requests():
+            for _ in range(200):
+                async with ThreadSensitiveContext():
+                    await sync_to_async(metrics.CACHE_REQUESTS.inc)(cache='shards', result='hit')
+        before = self.value(metrics.CACHE_REQUESTS, cache='shards', result='hit')
+        asyncio.run(requests())
+        gc.collect()
+        self.assertEqual(self.value(metrics.CACHE_REQUESTS, cache='shards', result='hit'), before + 200)
+        self.assertLess(len(metrics.REGISTRY._shards), 20)
+
+    def test_finalizer_does_not_take_the_lock(self):
+        # Сборщик мусора может вызвать финализатор в потоке, который держит блокировку
+        registry = metrics.Registry()
+        counter = metrics.Counter('test_total', 'Тест', ['kind'], registry=registry)
+        counter.inc(3, kind='a')
+        shard = registry.shard()
+        with registry._lock:
+            registry._retire(shard)
+        del registry._local.shard
+        self.assertEqual(registry.snapshot(), {('test_total', ('a',)): 3})
+        self.assertEqual(registry._shards, [])
+
+    def test_booking_counters(self):
+        flight = self.flights[0]
+        created = self.value(metrics.RESERVATIONS_CREATED, airline=flight.airline.code)
+        conflicts = self.value(metrics.BOOKING_CONFLICTS, reason='seat_taken')
+        book_seat(self.user, flight, '1A')
+        with self.assertRaises(SeatTaken):
+            book_seat(self.other, flight, '1A')
+        self.assertEqual(self.value(metrics.RESERVATIONS_CREATED, airline=flight.airline.code), created + 1)
+        self.assertEqual(self.value(metrics.BOOKING_CONFLICTS, reason='seat_taken'), conflicts + 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        histogram = metrics.Histogram('test_seconds', 'Тест', ['kind'], buckets=(1, 5), registry=registry)
+        for value in (0.5, 3, 3, 10):
+            histogram.observe(value, kind='a')
+        text = metrics.exposition(registry)
+        self.assertIn('test_seconds_bucket{kind="a",le="1"} 1', text)
+        self.assertIn('test_seconds_bucket{kind="a",le="5"} 3', text)
+        self.assertIn('test_seconds_bucket{kind="a",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_sum{kind="a"} 16.5', text)
+        self.assertIn('test_seconds_count{kind="a"} 4', text)
+
+    def test_endpoint(self):
+        cache.clear()
+        self.client.get(reverse('flight_list'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', password='password123', is_staff=True))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE flights_board_request_seconds histogram', text)
+        self.assertIn('flights_cache_requests_total{cache="board_page_key",result="miss"}', text)
+        self.assertIn('flights_view_queries_count{view="flight_list"}', text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_multiprocess_files_are_summed(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter('test_total', 'Тест', ['kind'], registry=registry)
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_MULTIPROCESS_DIR=directory, METRICS_FLUSH_SECONDS=3600):
+            counter.inc(2, kind='a')
+            # Срез другого воркера
+            with open(os.path.join(directory, '1.json'), 'w', encoding='utf-8') as file:
+                file.write('[["test_total", ["a"], 5], ["test_total", ["b"], 1]]')
+            text = metrics.exposition(registry)
+            own = [name for name in os.listdir(directory) if name.startswith(f'{os.getpid()}-')]
+            self.assertEqual(len(own), 1)
+        self.assertIn('test_total{kind="a"} 7', text)
+        self.assertIn('test_total{kind="b"} 1', text)
+
+    def test_dead_process_files_are_retired(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter('test_total', 'Тест', ['kind'], registry=registry)
+        # pid завершившегося процесса
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_MULTIPROCESS_DIR=directory, METRICS_FLUSH_SECONDS=3600):
+            counter.inc(2, kind='a')
+            for name in (f'{process.pid}-0a1b.json', f'{process.pid}-2c3d.json'):
+                with open(os.path.join(directory, name), 'w', encoding='utf-8') as file:
+                    file.write('[["test_total", ["a"], 5]]')
+            self.assertIn('test_total{kind="a"} 12', metrics.exposition(registry))
+            self.assertFalse([name for name in os.listdir(directory) if name.startswith(f'{process.pid}-')])
+
+            # Сумма завершившихся процессов сохраняется и при следующих сборах
+            counter.inc(1, kind='a')
+            self.assertIn('test_total{kind="a"} 13', metrics.exposition(registry))
+
+
+class ExportTests(TestCase):
+    """Потоковые выгрузки манифеста и броней"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, users = seed_board(flights_count=3, reservations_per_flight=4,
+                                        reviews_per_flight=0, users_count=2)
+        UserProfile.objects.create(user=users[0], phone='+79990000000', passport_number='4510 123456')
+        cls.staff = User.objects.create_user('staff', password='password123', is_staff=True)
+        cls.user = users[0]
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_manifest_csv(self):
+        flight = self.flights[0]
+        url = reverse('flight_manifest', args=[flight.pk, 'csv'])
+        response = self.client.get(url)
+        self.assertIn(f'manifest-{flight.flight_number}-', response['Content-Disposition'])
+        # Строки читаются одним запросом уже во время отправки ответа
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(csv.DictReader(self.content(response).lstrip('\ufeff').splitlines()))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([row['seat_number'] for row in rows], ['1A', '1B', '1C', '1D'])
+        passenger = next(row for row in rows if row['username'] == self.user.username)
+        self.assertEqual(passenger['passport_number'], '4510 123456')
+        other = next(row for row in rows if row['username'] != self.user.username)
+        self.assertEqual(other['passport_number'], '')
+
+    async def test_asgi_streams_without_buffering(self):
+        await self.async_client.aforce_login(self.staff)
+        # Синхронный итератор под ASGI Django собрал бы целиком с этим предупреждением
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = await self.async_client.get(reverse('reservations_export', args=['ndjson']))
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(content.splitlines()), 12)
+
+    def test_reservations_ndjson_by_day_and_airline(self):
+        flight = self.flights[1]
+        day = timezone.localtime(flight.departure_time).date()
+        response = self.client.get(reverse('reservations_export', args=['ndjson']),
+                                   {'date': day.isoformat(), 'airline': flight.airline.code.lower()})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual({row['flight'] for row in rows}, {flight.flight_number})
+        self.assertEqual(len(rows), 4)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('reservations_export', args=['xml'])).status_code, 404)
+        response = self.client.get(reverse('reservations_export', args=['csv']), {'date': 'вчера'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('flight_manifest', args=[self.flights[0].pk, 'csv']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_admin_action(self):
+        self.staff.is_superuser = True
+        self.staff.save()
+        response = self.client.post(reverse('admin:flights_reservation_changelist'), {
+            'action': 'export_ndjson',
+            '_selected_action': list(Reservation.objects.filter(flight=self.flights[2]).values_list('pk', flat=True)),
+        })
+        self.assertEqual(len(self.content(response).splitlines()), 4)
+
+
+class ExplainViewsTests(TestCase):
+    """explain_views: планы основных запросов страниц используют индексы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_board(flights_count=20, reservations_per_flight=3, reviews_per_flight=2, users_count=4)
+
+    def test_strict_passes_with_indexes(self):
+        out = StringIO()
+        call_command('explain_views', '--strict', stdout=out)
+        output = out.getvalue()
+        for name in ('flight_list', 'flight_detail:reviews', 'flight_detail:passengers', 'user_reservations'):
+            self.assertIn(f'{name}: ', output)
+        self.assertIn('flight_departure_idx', output)
+        self.assertIn('review_flight_created_idx', output)
+        self.assertNotIn('flight_list: полный просмотр', output)
+
+    def test_unsupported_vendor(self):
+        with mock.patch.object(connection, 'vendor', 'oracle'), \
+                self.assertRaisesMessage(CommandError, 'для oracle не поддерживается'):
+            call_command('explain_views', stdout=StringIO())
+
+
+class SampleDataTests(TestCase):
+    """load_sample_data: пачки bulk_create со счетчиками и сводками без пересчета"""
+
+    def load(self, **options):
+        out = StringIO()
+        call_command('load_sample_data', flights=9, reservations=40, reviews=12, users=4,
+                     batch_size=4, stdout=out, **options)
+        return out.getvalue()
+
+    def test_counters_match_rebuild(self):
+        output = self.load()
+        self.assertIn('Создано 9 рейсов, 40 резервирований, 12 отзывов', output)
+        self.assertEqual(User.objects.filter(username__startswith='user').count(), 4)
+        self.assertTrue(User.objects.get(username='admin').is_superuser)
+
+        counters = {
+            flight.pk: (flight.reserved_count, bytes(flight.seat_bitmap), flight.rating_sum, flight.rating_count)
+            for flight in Flight.objects.all()
+        }
+        airlines = dict(Airline.objects.values_list('pk', 'rating_sum'))
+        call_command('rebuild_seat_counters', stdout=StringIO())
+        call_command('rebuild_ratings', stdout=StringIO())
+        for flight in Flight.objects.all():
+            self.assertEqual(counters[flight.pk], (flight.reserved_count, bytes(flight.seat_bitmap),
+                                                   flight.rating_sum, flight.rating_count))
+        self.assertEqual(airlines, dict(Airline.objects.values_list('pk', 'rating_sum')))
+
+    def test_repeated_load_adds_flights(self):
+        self.load()
+        self.assertIn('Создано 0 тестовых пользователей', self.load())
+        self.assertEqual(Flight.objects.count(), 18)
+        self.assertEqual(Reservation.objects.count(), 80)
+
+
+class ImportScheduleTests(TestCase):
+    """import_schedule: upsert по ключу расписания, идемпотентность, ошибки строк"""
+
+    HEADER = 'airline,flight_number,departure_time,arrival_time,flight_type,gate_number,origin,destination,capacity,price\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.airline = Airline.objects.create(name='Аэрофлот', code='SU')
+
+    def import_schedule(self, content, suffix='.csv'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_schedule', file.name, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_upsert_is_idempotent(self):
+        rows = (self.HEADER
+                + 'SU,su100,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,150,9000\n'
+                + 'SU,SU101,2030-01-01T11:00:00+03:00,2030-01-01T13:00:00+03:00,arrival,2B,Сочи,Москва,,\n')
+        output, _ = self.import_schedule(rows)
+        self.assertIn('создано 2', output)
+        flight = Flight.objects.get(flight_number='SU100')
+        self.assertEqual((flight.capacity, flight.price), (150, 9000))
+        self.assertEqual(timezone.localtime(flight.departure_time).hour, 10)
+        self.assertEqual(Flight.objects.get(flight_number='SU101').capacity, 100)
+
+        with CaptureQueriesContext(connection) as queries:
+            output, _ = self.import_schedule(rows)
+        self.assertIn('без изменений 2', output)
+        self.assertFalse([query for query in queries if query['sql'].startswith('INSERT')])
+
+    def test_update_keeps_counters_and_bumps_cache(self):
+        self.import_schedule(self.HEADER + 'SU,SU100,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,150,9000\n')
+        flight = Flight.objects.get()
+        user = User.objects.create_user('passenger', password='password123')
+        book_seat(user, flight, '1A')
+        version = board_cache.get_version(board_cache.FLIGHT_VERSION_KEY.format(flight.pk))
+
+        with mock.patch.object(live, 'publish_flight') as publish_flight, \
+                self.captureOnCommitCallbacks(execute=True):
+            output, _ = self.import_schedule(
+                '{"airline": "SU", "flight_number": "SU100", "departure_time": "2030-01-01T10:00", '
+                '"arrival_time": "2030-01-01T12:30", "flight_type": "departure", "gate_number": "7C", '
+                '"origin": "Москва", "destination": "Сочи", "capacity": 150, "price": "9000.00"}\n',
+                suffix='.ndjson')
+        self.assertIn('обновлено 1', output)
+        flight.refresh_from_db()
+        self.assertEqual(flight.gate_number, '7C')
+        self.assertEqual(flight.reserved_count, 1)
+        self.assertTrue(flight.seat_map.is_free('1B'))
+        self.assertFalse(flight.seat_map.is_free('1A'))
+        self.assertNotEqual(board_cache.get_version(board_cache.FLIGHT_VERSION_KEY.format(flight.pk)), version)
+        publish_flight.assert_called_once_with(flight.pk)
+
+    def test_existing_flights_are_locked(self):
+        row = 'SU,SU100,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,150,9000\n'
+        self.import_schedule(self.HEADER + row)
+        # SQLite не поддерживает FOR UPDATE: включаем его, как на PostgreSQL
+        features = connection.features
+        with mock.patch.object(features, 'has_select_for_update', True), \
+                mock.patch.object(features, 'has_select_for_update_of', True), \
+                mock.patch.object(connection.ops, 'for_update_sql', return_value='') as for_update_sql:
+            output, _ = self.import_schedule(self.HEADER + row.replace(',150,', ',120,'))
+        self.assertIn('обновлено 1', output)
+        for_update_sql.assert_called_once()
+        self.assertEqual(for_update_sql.call_args.kwargs['of'], ['"flights_flight"'])
+
+    def test_invalid_rows_are_reported(self):
+        self.import_schedule(self.HEADER + 'SU,SU100,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,2,9000\n')
+        book_seat(User.objects.create_user('a', password='password123'), Flight.objects.get(), '1A')
+        book_seat(User.objects.create_user('b', password='password123'), Flight.objects.get(), '1B')
+        output, errors = self.import_schedule(
+            self.HEADER
+            + 'XX,XX1,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,150,9000\n'
+            + 'SU,SU102,завтра,2030-01-01T12:00,departure,1A,Москва,Сочи,150,9000\n'
+            + 'SU,SU100,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,1,9000\n'
+            + 'SU,SU103,2030-01-01T10:00,2030-01-01T12:00,departure,1A,Москва,Сочи,150,9000\n')
+        self.assertIn('Строка 2: неизвестная авиакомпания', errors)
+        self.assertIn('Строка 3: departure_time', errors)
+        self.assertIn('Строка 4: вместимость 1 меньше числа броней рейса (2)', errors)
+        self.assertIn('создано 1', output)
+        self.assertIn('с ошибками 3', output)
+        self.assertEqual(Flight.objects.get(flight_number='SU100').capacity, 2)
+
+
+class TicketNumberTests(TestCase):
+    """Номера билетов: перестановка без повторов и блоки порядковых номеров"""
+
+    def test_permutation_is_unique_and_fits_ten_chars(self):
+        numbers = [tickets.encode(tickets.permute(value)) for value in range(50000)]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertTrue(all(re.fullmatch(r'[0-9A-Z]{10}', number) for number in numbers))
+        self.assertEqual(len(tickets.encode(tickets.permute((1 << tickets.BITS) - 1))), 10)
+        # Соседние порядковые номера не дают соседних билетов
+        self.assertNotEqual(numbers[1][:8], numbers[2][:8])
+
+    def test_key_changes_numbers(self):
+        default = [tickets.permute(value) for value in range(10)]
+        with override_settings(TICKET_NUMBER_KEY='другой ключ'):
+            self.assertNotEqual([tickets.permute(value) for value in range(10)], default)
+
+    @override_settings(TICKET_BLOCK_SIZE=3)
+    def test_numbers_come_from_blocks(self):
+        issuer = tickets.TicketNumbers()
+        with CaptureQueriesContext(connection) as queries:
+            numbers = [issuer.next() for _ in range(7)]
+        self.assertEqual(len(set(numbers)), 7)
+        self.assertEqual(TicketSequence.objects.get().next_value, 9)
+        self.assertEqual(sum('UPDATE' in query['sql'] for query in queries), 3)
+        self.assertEqual(issuer.bulk(2), [tickets.encode(tickets.permute(value)) for value in (9, 10)])
+
+    def test_forked_worker_takes_new_block(self):
+        issuer = tickets.TicketNumbers()
+        issuer.next()
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            issuer.next()
+        self.assertEqual(TicketSequence.objects.get().next_value, 2 * settings.TICKET_BLOCK_SIZE)
+
+    def test_threads_get_distinct_numbers(self):
+        counter = iter(range(10 ** 6))
+        lock = threading.Lock()
+
+        def allocate(count):
+            with lock:
+                start = next(counter) * count
+            return range(start, start + count)
+
+        issuer = tickets.TicketNumbers()
+        results = []
+        with mock.patch.object(tickets, 'allocate', allocate), override_settings(TICKET_BLOCK_SIZE=5):
+            workers = [threading.Thread(target=lambda: results.extend(issuer.next() for _ in range(200)))
+                       for _ in range(8)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(len(set(results)), 1600)
+
+
+class AdminChangelistTests(TestCase):
+    """Списки админки: сортировка по свободным местам и оценка числа строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, _ = seed_board(flights_count=4, reservations_per_flight=0,
+                                    reviews_per_flight=0, users_count=1)
+        for reserved, flight in zip((3, 0, 7, 1), cls.flights):
+            Flight.objects.filter(pk=flight.pk).update(reserved_count=reserved)
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'root')
+
+    def test_sort_by_available_seats(self):
+        self.client.force_login(self.admin)
+        # Колонка «Свободно мест» — девятая в list_display
+        response = self.client.get(reverse('admin:flights_flight_changelist'), {'o': '9'})
+        seats = [flight.available_seats for flight in response.context['cl'].result_list]
+        self.assertEqual(seats, [243, 247, 249, 250])
+
+    def test_estimated_count(self):
+        flights = Flight.objects.order_by('pk')
+        self.assertIsNone(EstimatedCountPaginator(flights, 10).estimated_count())
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=5_000_000):
+            self.assertEqual(EstimatedCountPaginator(flights, 10).count, 5_000_000)
+            with override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10 ** 7):
+                self.assertEqual(EstimatedCountPaginator(flights, 10).count, 4)
+
+
+class BulkActionTests(TestCase):
+    """Массовые действия админки: UPDATE/DELETE на пачку и фоновые задания"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, _ = seed_board(flights_count=6, reservations_per_flight=4,
+                                    reviews_per_flight=0, users_count=3)
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'root')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def post_action(self, action, flights, **data):
+        return self.client.post(reverse('admin:flights_flight_changelist'), {
+            'action': action, '_selected_action': [flight.pk for flight in flights], **data,
+        })
+
+    def test_form_then_single_update(self):
+        response = self.post_action('change_gate', self.flights)
+        self.assertTemplateUsed(response, 'admin/flights/flight/bulk_action.html')
+        self.assertContains(response, 'Выбрано рейсов: 6')
+
+        version = board_cache.get_version(board_cache.FLIGHT_VERSION_KEY.format(self.flights[0].pk))
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.post_action('change_gate', self.flights[:5], apply='1', gate_number='12B')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "flights_flight"') for query in queries), 1)
+        self.assertEqual(Flight.objects.filter(gate_number='12B').count(), 5)
+        self.assertNotEqual(board_cache.get_version(board_cache.FLIGHT_VERSION_KEY.format(self.flights[0].pk)), version)
+
+    def test_delay(self):
+        flight = self.flights[0]
+        self.post_action('delay', [flight], apply='1', minutes='90')
+        delayed = Flight.objects.get(pk=flight.pk)
+        self.assertEqual(delayed.departure_time - flight.departure_time, timedelta(minutes=90))
+        self.assertEqual(delayed.arrival_time - flight.arrival_time, timedelta(minutes=90))
+
+    def schedule_collision(self, flight, minutes):
+        """Рейс с тем же номером, вылетающий через minutes после flight"""
+        return Flight.objects.create(
+            flight_number=flight.flight_number, airline_id=flight.airline_id,
+            departure_time=flight.departure_time + timedelta(minutes=minutes),
+            arrival_time=flight.arrival_time + timedelta(minutes=minutes),
+            flight_type=flight.flight_type, gate_number='1A', origin='Москва', destination='Сочи',
+        )
+
+    def test_delay_into_schedule_key_is_refused(self):
+        self.schedule_collision(self.flights[0], 30)
+        response = self.post_action('delay', self.flights[:2], apply='1', minutes='30')
+        self.assertEqual(response.status_code, 302)
+        [message] = self.client.get(reverse('admin:flights_flight_changelist')).context['messages']
+        self.assertIn('совпадут с другими рейсами расписания: ' + self.flights[0].flight_number, str(message))
+        for flight in self.flights[:2]:
+            self.assertEqual(Flight.objects.get(pk=flight.pk).departure_time, flight.departure_time)
+
+    @override_settings(ADMIN_BULK_CHUNK_SIZE=2)
+    def test_delay_job_fails_without_retry(self):
+        job = bulk.start_job('delay', [flight.pk for flight in self.flights], {'minutes': 45})
+        self.schedule_collision(self.flights[4], 45)
+        with self.assertLogs('flights.tasks'):
+            self.assertEqual(tasks.execute(tasks.claim('test')), 'failed')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.processed), ('failed', 1, 0))
+        self.assertIn(self.flights[4].flight_number, job.error)
+        for flight in self.flights:
+            self.assertEqual(Flight.objects.get(pk=flight.pk).departure_time, flight.departure_time)
+
+    def test_cancel_reservations_resets_counters(self):
+        flight = self.flights[1]
+        code = Airline.objects.get(flight=flight).code
+        cancelled = metrics.REGISTRY.snapshot().get(metrics.RESERVATIONS_CANCELLED.key({'airline': code}), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_action('cancel_reservations', [flight], apply='1')
+        flight.refresh_from_db()
+        self.assertFalse(flight.reservations.exists())
+        self.assertEqual(flight.reserved_count, 0)
+        self.assertTrue(flight.seat_map.is_free('1A'))
+        self.assertEqual(Reservation.objects.count(), 20)
+        self.assertEqual(metrics.REGISTRY.snapshot()[metrics.RESERVATIONS_CANCELLED.key({'airline': code})],
+                         cancelled + 4)
+        book_seat(self.admin, flight, '1A')
+
+    @override_settings(ADMIN_BULK_BACKGROUND_THRESHOLD=3, ADMIN_BULK_CHUNK_SIZE=2)
+    def test_large_selection_runs_as_job(self):
+        self.post_action('change_gate', self.flights, apply='1', gate_number='3C')
+        job = BackgroundJob.objects.get()
+        self.assertEqual((job.status, job.total, job.processed), ('pending', 6, 0))
+        self.assertFalse(Flight.objects.filter(gate_number='3C').exists())
+
+        call_command('run_worker', '--once', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.progress), ('done', 6, 100))
+        self.assertEqual(Flight.objects.filter(gate_number='3C').count(), 6)
+        response = self.client.get(reverse('admin:flights_backgroundjob_changelist'))
+        self.assertContains(response, '6/6 (100%)')
+        response = self.client.get(reverse('admin:flights_backgroundjob_change', args=[job.pk]))
+        self.assertContains(response, 'Смена гейта')
+
+    @override_settings(ADMIN_BULK_CHUNK_SIZE=2)
+    def test_retried_job_skips_processed_chunks(self):
+        job = bulk.start_job('delay', [flight.pk for flight in self.flights], {'minutes': 30})
+        calls = []
+
+        def fail_second_chunk(flight_ids, minutes):
+            calls.append(flight_ids)
+            if len(calls) == 2:
+                raise RuntimeError('нет связи с БД')
+            bulk.delay(flight_ids, minutes)
+        with mock.patch.dict(bulk.ACTIONS, {'delay': fail_second_chunk}), self.assertLogs('flights.tasks'):
+            self.assertEqual(tasks.execute(tasks.claim('test')), 'retry')
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.processed, job.error), ('pending', 2, 'нет связи с БД'))
+            BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            self.assertEqual(tasks.execute(tasks.claim('test')), 'done')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.attempts), ('done', 6, 2))
+        for flight in self.flights:
+            delayed = Flight.objects.get(pk=flight.pk)
+            self.assertEqual(delayed.departure_time - flight.departure_time, timedelta(minutes=30))
+
+
+class TaskQueueTests(TestCase):
+    """Очередь заданий в БД: аренда, повторы, письма после брони, метрики"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, cls.users = seed_board(flights_count=2, reservations_per_flight=3,
+                                            reviews_per_flight=0, users_count=3)
+
+    def test_enqueue_follows_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            tasks.enqueue('send_confirmation', {'reservation_id': 1})
+            raise RuntimeError
+        self.assertFalse(BackgroundJob.objects.exists())
+
+    def test_expired_lease_is_reclaimed(self):
+        job = tasks.enqueue('reconcile_seat_counters', {'flight_ids': []})
+        self.assertEqual(tasks.claim('first').pk, job.pk)
+        self.assertIsNone(tasks.claim('second'))
+
+        # Воркер first пропал: после конца аренды задание достается другому
+        BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+        claimed = tasks.claim('second')
+        self.assertEqual((claimed.pk, claimed.worker, claimed.attempts), (job.pk, 'second', 2))
+
+    def test_retries_then_fails(self):
+        def broken(job):
+            raise ValueError('шаблон не найден')
+        result = metrics.TASKS_PROCESSED.key({'task': 'broken', 'result': 'failed'})
+        with mock.patch.dict(tasks.TASKS, {'broken': tasks.Task(broken, 'Сломанное', 2)}), \
+                self.assertLogs('flights.tasks'):
+            job = tasks.enqueue('broken')
+            self.assertEqual(tasks.execute(tasks.claim('test')), 'retry')
+            job.refresh_from_db()
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertIsNone(tasks.claim('test'))
+
+            BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            self.assertEqual(tasks.execute(tasks.claim('test')), 'failed')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('failed', 2, 'шаблон не найден'))
+        self.assertEqual(metrics.REGISTRY.snapshot()[result], 1)
+
+    def test_booking_sends_confirmation_from_worker(self):
+        user = self.users[0]
+        User.objects.filter(pk=user.pk).update(email='passenger@example.com')
+        self.client.force_login(user)
+        self.client.post(reverse('make_reservation', args=[self.flights[0].pk]), {'seat_number': '9A'})
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('run_worker', '--once', stdout=StringIO())
+        reservation = Reservation.objects.get(flight=self.flights[0], seat_number='9A')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['passenger@example.com'])
+        self.assertIn(reservation.ticket_number, mail.outbox[0].body)
+        self.assertEqual(BackgroundJob.objects.get().status, 'done')
+
+    def test_confirmation_is_enqueued_with_booking(self):
+        reservation = book_seat(self.users[0], self.flights[0], '9A')
+        job = BackgroundJob.objects.get()
+        self.assertEqual((job.action, job.params), ('send_confirmation', {'reservation_id': reservation.pk}))
+
+        # Место занято: бронь откатывается, письма тоже не будет
+        with self.assertRaises(SeatTaken):
+            book_seat(self.users[1], self.flights[0], '9A')
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+
+    def test_purge_done_keeps_failed_and_recent(self):
+        now = timezone.now()
+        old = tasks.enqueue('send_confirmation', {'reservation_id': 1})
+        recent = tasks.enqueue('send_confirmation', {'reservation_id': 2})
+        failed = tasks.enqueue('send_confirmation', {'reservation_id': 3})
+        BackgroundJob.objects.filter(pk=old.pk).update(status='done', finished_at=now - timedelta(days=8))
+        BackgroundJob.objects.filter(pk=recent.pk).update(status='done', finished_at=now - timedelta(hours=1))
+        BackgroundJob.objects.filter(pk=failed.pk).update(status='failed', finished_at=now - timedelta(days=8))
+
+        out = StringIO()
+        call_command('run_worker', '--once', '--purge-done-after', '168', stdout=out)
+        self.assertIn('удалено выполненных заданий старше 168 ч: 1', out.getvalue())
+        self.assertEqual(set(BackgroundJob.objects.values_list('pk', flat=True)), {recent.pk, failed.pk})
+
+    def test_reconcile_seat_counters(self):
+        flight = self.flights[0]
+        Flight.objects.filter(pk=flight.pk).update(reserved_count=50, seat_bitmap=b'')
+        tasks.enqueue('reconcile_seat_counters', {'flight_ids': [flight.pk]})
+        self.assertEqual(tasks.execute(tasks.claim('test')), 'done')
+        flight.refresh_from_db()
+        self.assertEqual(flight.reserved_count, 3)
+        self.assertEqual(flight.seat_map.occupied_count(), 3)
+
+    def test_queue_depth_metric(self):
+        tasks.enqueue('send_confirmation', {'reservation_id': 1})
+        tasks.enqueue('send_confirmation', {'reservation_id': 2}, delay=60)
+        text = metrics.exposition()
+        self.assertIn('flights_task_queue_depth{task="send_confirmation",status="pending"} 2', text)
+        self.assertIn('# TYPE flights_task_queue_lag_seconds gauge', text)
+
+
+class UserProfileTests(TestCase):
+    """Профиль создается регистрацией или по требованию; вход его не трогает"""
+
+    def test_register_saves_profile(self):
+        response = self.client.post(reverse('register'), {
+            'username': 'passenger', 'password1': 'Sx7-long-password', 'password2': 'Sx7-long-password',
+            'phone': '+79990000000', 'passport_number': '4510 123456',
+        })
+        self.assertRedirects(response, reverse('flight_list'), fetch_redirect_response=False)
+        profile = UserProfile.objects.get(user__username='passenger')
+        self.assertEqual((profile.phone, profile.passport_number), ('+79990000000', '4510 123456'))
+
+    def test_login_does_not_write_profile(self):
+        User.objects.create_user('passenger', password='secret')
+        self.assertFalse(UserProfile.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'username': 'passenger', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([query for query in queries if 'flights_userprofile' in query['sql']])
+        self.assertFalse(UserProfile.objects.exists())
+
+    def test_admin_edits_user_without_profile(self):
+        admin = User.objects.create_superuser('root', 'root@example.com', 'root')
+        user = User.objects.create_user('passenger')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:auth_user_change', args=[user.pk]))
+        self.assertContains(response, 'Номер паспорта')
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies', USER_CACHE_TIMEOUT=300)
+class CachedSessionUserTests(TestCase):
+    """Сессия в cookie и User из кэша: авторизованный запрос без этих двух SELECT"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flights, cls.users = seed_board(flights_count=2, reservations_per_flight=2,
+                                            reviews_per_flight=0, users_count=2)
+
+    def setUp(self):
+        cache.clear()
+        self.user = self.users[0]
+        self.client.force_login(self.user)
+
+    def test_no_session_or_user_queries(self):
+        self.client.get(reverse('user_reservations'))
+        for url in (reverse('user_reservations'), reverse('flight_detail', args=[self.flights[0].pk])):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            lookups = [query['sql'] for query in queries
+                       if 'FROM "auth_user"' in query['sql'] or '"django_session"' in query['sql']]
+            self.assertEqual(lookups, [], url)
+
+    def test_saving_user_invalidates_cache(self):
+        self.client.get(reverse('user_reservations'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('changed')
+            self.user.save()
+        # Хэш сессии считается от пароля: старая сессия больше не действует
+        response = self.client.get(reverse('user_reservations'))
+        self.assertEqual(response.status_code, 302)
+
+
+class ReservedCountTests(TestCase):
+    """Flight.reserved_count следует за бронями и восстанавливается командой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        airline = Airline.objects.create(name='Аэрофлот', code='SU')
+        departure = timezone.now() + timedelta(days=1)
+        cls.flights = [
+            Flight.objects.create(
+                flight_number=f'SU{100 + index}', airline=airline, departure_time=departure,
+                arrival_time=departure + timedelta(hours=2), flight_type='departure',
+                gate_number='1A', origin='Москва', destination='Сочи',
+            )
+            for index in range(2)
+        ]
+        users = [User.objects.create_user(f'passenger{index}', password='password123') for index in range(2)]
+        for flight in cls.flights:
+            for user, seat_number in zip(users, ('1A', '1B')):
+                Reservation.objects.create(user=user, flight=flight, seat_number=seat_number)
+        cls.user = users[0]
+
+    def reserved(self):
+        return [Flight.objects.get(pk=flight.pk).reserved_count for flight in self.flights]
+
+    def test_create_and_delete(self):
+        self.assertEqual(self.reserved(), [2, 2])
+        reservation = Reservation.objects.create(user=self.user, flight=self.flights[0], seat_number='5A')
+        self.assertEqual(self.reserved(), [3, 2])
+        reservation.delete()
+        self.assertEqual(self.reserved(), [2, 2])
+
+    def test_move_to_another_flight(self):
+        reservation = Reservation.objects.get(flight=self.flights[0], seat_number='1A')
+        reservation.flight = self.flights[1]
+        reservation.seat_number = '5A'
+        reservation.save()
+        self.assertEqual(self.reserved(), [1, 3])
+
+        # Повторное сохранение без изменений счетчики не трогает
+        reservation.save()
+        self.assertEqual(self.reserved(), [1, 3])
+
+    def test_rebuild_repairs_drift(self):
+        Flight.objects.filter(pk=self.flights[0].pk).update(reserved_count=40, seat_bitmap=b'\xff' * 4)
+        Flight.objects.filter(pk=self.flights[1].pk).update(reserved_count=0)
+        call_command('rebuild_seat_counters', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.reserved(), [2, 2])
+        seat_map = Flight.objects.get(pk=self.flights[0].pk).seat_map
+        self.assertEqual(seat_map.occupied_count(), 2)
+        self.assertFalse(seat_map.is_free('1B'))
+        self.assertTrue(seat_map.is_free('1C'))
@@ -0,0 +1,105 @@
+"""Номера билетов без повторов и без проверочных запросов
+
+Номер билета — это порядковый номер из TicketSequence, пропущенный через
+перестановку с ключом (сеть Фейстеля на 50 битах) и записанный 10 знаками
+base36. Перестановка взаимно однозначна, поэтому разные порядковые номера
+дают разные билеты, а по номеру билета нельзя угадать соседние.
+
+Порядковые номера процесс забирает у БД блоками по TICKET_BLOCK_SIZE одним
+UPDATE и раздает из памяти: обычная бронь не делает ни одного лишнего
+запроса. Неиспользованный остаток блока при остановке процесса теряется,
+это только пропуск в нумерации.
+"""
+import hashlib
+import hmac
+import os
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+
+from .models import TicketSequence
+
+BITS = 50
+HALF_BITS = BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# 36^10 > 2^50: любой номер помещается в 10 знаков
+LENGTH = 10
+SEQUENCE_NAME = 'ticket'
+
+
+def _round_keys():
+    key = (settings.TICKET_NUMBER_KEY or settings.SECRET_KEY).encode()
+    return [hmac.new(key, f'ticket-round-{index}'.encode(), hashlib.sha256).digest() for index in range(ROUNDS)]
+
+
+def permute(value, round_keys=None):
+    """Перестановка чисел 0..2^50-1 с ключом"""
+    round_keys = round_keys or _round_keys()
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_key in round_keys:
+        digest = hashlib.blake2b(right.to_bytes(4, 'big'), key=round_key, digest_size=4).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'big') & HALF_MASK)
+    return (left << HALF_BITS) | right
+
+
+def encode(value):
+    chars = []
+    for _ in range(LENGTH):
+        value, digit = divmod(value, 36)
+        chars.append(DIGITS[digit])
+    return ''.join(reversed(chars))
+
+
+def allocate(count):
+    """Резервирует в БД count порядковых номеров подряд и возвращает их диапазон"""
+    # Отдельная короткая транзакция на основной БД; внутри чужой транзакции
+    # строка счетчика будет заблокирована до ее конца, поэтому блок берется
+    # до начала транзакции брони
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequences = TicketSequence.objects.using(DEFAULT_DB_ALIAS).filter(name=SEQUENCE_NAME)
+        if not sequences.update(next_value=F('next_value') + count):
+            TicketSequence.objects.using(DEFAULT_DB_ALIAS).get_or_create(name=SEQUENCE_NAME)
+            sequences.update(next_value=F('next_value') + count)
+        end = sequences.values_list('next_value', flat=True).get()
+    if end > 1 << BITS:
+        raise OverflowError('Номера билетов исчерпаны')
+    return range(end - count, end)
+
+
+class TicketNumbers:
+    """Блок порядковых номеров процесса; безопасен для потоков и fork"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._numbers = iter(())
+        self._pid = None
+        self._round_keys = None
+
+    def next(self):
+        with self._lock:
+            # После fork блок родителя достался бы всем воркерам
+            if self._pid != os.getpid():
+                self._numbers = iter(())
+                self._pid = os.getpid()
+                self._round_keys = _round_keys()
+            value = next(self._numbers, None)
+            if value is None:
+                self._numbers = iter(allocate(settings.TICKET_BLOCK_SIZE))
+                value = next(self._numbers)
+            return encode(permute(value, self._round_keys))
+
+    def bulk(self, count):
+        """count номеров одним обращением к БД (массовая загрузка)"""
+        round_keys = _round_keys()
+        return [encode(permute(value, round_keys)) for value in allocate(count)]
+
+
+ticket_numbers = TicketNumbers()
+
+
+def next_ticket_number():
+    return ticket_numbers.next()
@@ -8,6 +8,11 @@ urlpatterns = [
     path('reservation/<int:reservation_id>/edit/', views.edit_reservation, name='edit_reservation'),
     path('reservation/<int:reservation_id>/cancel/', views.cancel_reservation, name='cancel_reservation'),
     path('flight/<int:flight_id>/review/', views.add_review, name='add_review'),
+    path('flight/<int:flight_id>/manifest.<str:export_format>', views.flight_manifest, name='flight_manifest'),
+    path('export/reservations.<str:export_format>', views.reservations_export, name='reservations_export'),
     path('register/', views.register, name='register'),
     path('my-reservations/', views.user_reservations, name='user_reservations'),
+    path('api/flights/', views.flight_board_api, name='flight_board_api'),
+    path('live/', views.flight_updates, name='flight_updates'),
+    path('metrics', views.metrics, name='metrics'),
 ]
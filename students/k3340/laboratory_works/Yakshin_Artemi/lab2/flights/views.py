@@ -1,62 +1,216 @@
-from django.shortcuts import render, get_object_or_404, redirect
+import asyncio
+from datetime import date, datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import render, aget_object_or_404, get_object_or_404, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from django.db.models import Q, Avg
+from django.db import transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast, NullIf
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
-from django.http import JsonResponse
-from .models import Flight, Reservation, Review, UserProfile
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+from .booking import BookingError, FlightFull, book_seat, change_seat
+from .cache import cache_anonymous_page, board_changed_at, board_etag, board_page_key, flight_page_key
+from .exports import export_response
+from .live import get_broker
+from .metrics import BOARD_LATENCY, CACHE_REQUESTS, RESERVATIONS_CANCELLED, exposition
+from .models import Flight, Reservation, Review
+from .pagination import CursorPaginator
+from .routers import read_your_writes, stick_to_primary, use_primary
+from .search import search_flights
 from .forms import ReservationForm, ReviewForm, UserProfileForm
-import random
-import string
 
 
-def flight_list(request):
-    """Список всех рейсов с поиском и фильтрацией"""
-    flights = Flight.objects.select_related('airline').prefetch_related('reviews').order_by('departure_time')
-    
-    # Поиск
-    search_query = request.GET.get('search', '')
-    if search_query:
-        flights = flights.filter(
-            Q(flight_number__icontains=search_query) |
-            Q(airline__name__icontains=search_query) |
-            Q(origin__icontains=search_query) |
-            Q(destination__icontains=search_query)
-        )
+def board_queryset(search_query='', flight_type=''):
+    """Рейсы табло с учетом поиска, фильтра по типу и агрегатов отзывов"""
+    flights = Flight.objects.select_related('airline').order_by('departure_time')
     
     # Фильтрация по типу рейса
-    flight_type = request.GET.get('type', '')
     if flight_type:
         flights = flights.filter(flight_type=flight_type)
     
-    # Добавляем средний рейтинг для каждого рейса
-    flights = flights.annotate(avg_rating=Avg('reviews__rating'))
+    # Поиск (с ранжированием по релевантности)
+    flights = search_flights(flights, search_query)
     
-    # Пагинация
-    paginator = Paginator(flights, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Средний рейтинг и число отзывов — из сводки в строке рейса, таблица
+    # отзывов табло не читается
+    return flights.annotate(
+        avg_rating=Cast('rating_sum', FloatField()) / NullIf('rating_count', Value(0)),
+        reviews_count=F('rating_count'),
+    )
+
+
+async def arender(request, template_name, context):
+    """render для async-представлений
+
+    Шаблон рендерится в потоке: контекстные процессоры (request.user,
+    сообщения) обращаются к сессии синхронно. Запросы к БД представление
+    выполняет заранее, в шаблон передаются уже загруженные списки.
+    """
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def auser(request):
+    """Пользователь запроса для async-представлений
+
+    request.user заменяется уже загруженным объектом, иначе шаблон
+    загрузил бы пользователя повторно через ленивый request.user.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+async def alist(queryset):
+    """Загружает queryset асинхронно"""
+    return [obj async for obj in queryset]
+
+
+def search_page(queryset, number, per_page):
+    """Страница Paginator с уже загруженными объектами"""
+    page_obj = Paginator(queryset, per_page).get_page(number)
+    page_obj.object_list = list(page_obj.object_list)
+    return page_obj
+
+
+def search_label(request):
+    return {'search': 'yes' if request.GET.get('search') else 'no'}
+
+
+@BOARD_LATENCY.timed(search_label)
+@cache_anonymous_page(board_page_key)
+async def flight_list(request):
+    """Список всех рейсов с поиском и фильтрацией"""
+    search_query = request.GET.get('search', '')
+    flight_type = request.GET.get('type', '')
+    flights = board_queryset(search_query, flight_type)
+    
+    # Пагинация: результаты поиска ранжированы и листаются по номерам страниц,
+    # само табло — по курсору (departure_time, id) без COUNT(*) и OFFSET
+    if search_query:
+        page_obj = await sync_to_async(search_page)(flights, request.GET.get('page'), 12)
+    else:
+        paginator = CursorPaginator(flights, 12, ordering=Flight._meta.ordering + ['id'])
+        page_obj = await paginator.aget_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
+        'cursor_pagination': not search_query,
         'search_query': search_query,
         'flight_type': flight_type,
     }
-    return render(request, 'flights/flight_list.html', context)
+    return await arender(request, 'flights/flight_list.html', context)
+
 
+# Поля табло в JSON: компактные строки из values(), без экземпляров моделей
+BOARD_API_FIELDS = (
+    'id', 'flight_number', 'airline_code', 'airline_name', 'flight_type',
+    'origin', 'destination', 'departure_time', 'arrival_time', 'gate_number',
+    'capacity', 'available_seats', 'price', 'avg_rating', 'reviews_count',
+)
 
-def flight_detail(request, flight_id):
+
+@require_GET
+@condition(etag_func=board_etag, last_modified_func=lambda request: board_changed_at())
+def flight_board_api(request):
+    """Табло в JSON для экранов вылета и партнеров
+
+    ETag и Last-Modified берутся из версии табло, поэтому опрос без изменений
+    получает 304 Not Modified, не доходя до БД.
+    """
+    key = f'flights:api:{board_etag(request)}'
+    content = cache.get(key)
+    CACHE_REQUESTS.inc(cache='board_api', result='miss' if content is None else 'hit')
+    if content is None:
+        # Ответ под новой версией табло — с основной БД: реплика могла еще не
+        # получить изменение, увеличившее версию
+        with use_primary():
+            search_query = request.GET.get('search', '')
+            flights = board_queryset(search_query, request.GET.get('type', '')).annotate(
+                airline_code=F('airline__code'),
+                airline_name=F('airline__name'),
+                available_seats=F('capacity') - F('reserved_count'),
+            ).values(*BOARD_API_FIELDS)
+        
+            if search_query:
+                page_obj = Paginator(flights, 50).get_page(request.GET.get('page'))
+                data = {
+                    'results': list(page_obj),
+                    'next': str(page_obj.next_page_number()) if page_obj.has_next() else None,
+                    'previous': str(page_obj.previous_page_number()) if page_obj.has_previous() else None,
+                }
+            else:
+                paginator = CursorPaginator(flights, 50, ordering=Flight._meta.ordering + ['id'])
+                page_obj = paginator.get_page(request.GET.get('cursor'))
+                data = {
+                    'results': page_obj.object_list,
+                    'next': page_obj.next_cursor,
+                    'previous': page_obj.previous_cursor,
+                }
+            content = JsonResponse(data, json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False}).content
+        cache.set(key, content, settings.BOARD_CACHE_TIMEOUT)
+    
+    response = HttpResponse(content, content_type='application/json')
+    # Клиент может хранить ответ, но обязан перепроверять его по ETag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_GET
+async def flight_updates(request):
+    """Живое табло: поток изменений рейсов (Server-Sent Events)
+
+    Соединение только ждет сообщений брокера и к БД не обращается; текущее
+    состояние клиент берет из flight_board_api, а дальше получает изменения.
+    Работает только под ASGI (uvicorn/daphne airline_board.asgi): под WSGI
+    каждое соединение навсегда заняло бы поток сервера.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Живое табло доступно только при запуске под ASGI.',
+                            status=503, content_type='text/plain; charset=utf-8')
+    keepalive = settings.BOARD_STREAM_KEEPALIVE
+    
+    async def stream():
+        async with get_broker().subscribe() as subscription:
+            # Первое сообщение подтверждает подписку и задает паузу переподключения
+            yield 'retry: 3000\n\n'
+            while True:
+                message = await subscription.get(keepalive)
+                yield message if message is not None else ': keepalive\n\n'
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию в nginx, иначе события приходят пачками
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@read_your_writes
+@cache_anonymous_page(flight_page_key)
+async def flight_detail(request, flight_id):
     """Детальная информация о рейсе"""
-    flight = get_object_or_404(Flight, id=flight_id)
-    reviews = flight.reviews.select_related('user').order_by('-created_at')
-    passengers = flight.reservations.select_related('user').order_by('seat_number')
+    user = await auser(request)
     
-    # Получаем все резервирования пользователя на этот рейс
-    user_reservations = []
-    if request.user.is_authenticated:
-        user_reservations = flight.reservations.filter(user=request.user).order_by('seat_number')
+    # Рейс (вместе со счетчиком мест), отзывы, пассажиры и брони пользователя
+    # не зависят друг от друга и запрашиваются одновременно
+    reservations = Reservation.objects.filter(flight_id=flight_id)
+    flight, reviews, passengers, user_reservations = await asyncio.gather(
+        aget_object_or_404(Flight.objects.select_related('airline', 'seat_layout'), id=flight_id),
+        alist(Review.objects.filter(flight_id=flight_id).select_related('user').order_by('-created_at')),
+        alist(reservations.select_related('user').order_by('seat_number')),
+        alist(reservations.filter(user=user).order_by('seat_number') if user.is_authenticated
+              else reservations.none()),
+    )
     
     context = {
         'flight': flight,
@@ -64,72 +218,90 @@ def flight_detail(request, flight_id):
         'passengers': passengers,
         'user_reservations': user_reservations,
         'available_seats': flight.available_seats,
+        'average_rating': flight.average_rating,
+        'seat_map': flight.seat_map,
     }
-    return render(request, 'flights/flight_detail.html', context)
+    return await arender(request, 'flights/flight_detail.html', context)
 
 
+@read_your_writes
 @login_required
 def make_reservation(request, flight_id):
     """Создание резервирования"""
-    flight = get_object_or_404(Flight, id=flight_id)
+    flight = get_object_or_404(Flight.objects.select_related('airline', 'seat_layout'), id=flight_id)
     
     # Пользователь может бронировать несколько мест
     
     if request.method == 'POST':
         form = ReservationForm(request.POST, flight=flight)
         if form.is_valid():
-            reservation = form.save(commit=False)
-            reservation.user = request.user
-            reservation.flight = flight
-            
-            # Генерируем номер билета
-            reservation.ticket_number = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-            reservation.save()
-            
-            messages.success(request, f'Место {reservation.seat_number} успешно забронировано! Номер билета: {reservation.ticket_number}')
-            return redirect('flight_detail', flight_id=flight_id)
+            try:
+                reservation = book_seat(request.user, flight, form.cleaned_data['seat_number'])
+            except FlightFull as exc:
+                messages.error(request, str(exc))
+                return redirect('flight_detail', flight_id=flight_id)
+            except BookingError as exc:
+                form.add_error('seat_number', str(exc))
+            else:
+                messages.success(request, f'Место {reservation.seat_number} успешно забронировано! Номер билета: {reservation.ticket_number}')
+                return stick_to_primary(redirect('flight_detail', flight_id=flight_id))
     else:
-        form = ReservationForm(flight=flight)
+        # Место, выбранное кликом по карте
+        form = ReservationForm(flight=flight, initial={'seat_number': request.GET.get('seat', '')})
     
     context = {
         'form': form,
         'flight': flight,
+        'seat_map': form.seat_map,
     }
     return render(request, 'flights/make_reservation.html', context)
 
 
+@read_your_writes
 @login_required
 def edit_reservation(request, reservation_id):
     """Редактирование резервирования"""
-    reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
+    reservation = get_object_or_404(
+        Reservation.objects.select_related('flight__airline', 'flight__seat_layout'),
+        id=reservation_id, user=request.user
+    )
     
     if request.method == 'POST':
         form = ReservationForm(request.POST, instance=reservation, flight=reservation.flight)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Резервирование успешно изменено!')
-            return redirect('flight_detail', flight_id=reservation.flight.id)
+            try:
+                change_seat(reservation, form.cleaned_data['seat_number'])
+            except BookingError as exc:
+                form.add_error('seat_number', str(exc))
+            else:
+                messages.success(request, 'Резервирование успешно изменено!')
+                return stick_to_primary(redirect('flight_detail', flight_id=reservation.flight.id))
     else:
-        form = ReservationForm(instance=reservation, flight=reservation.flight)
+        form = ReservationForm(instance=reservation, flight=reservation.flight,
+                               initial={'seat_number': request.GET.get('seat', reservation.seat_number)})
     
     context = {
         'form': form,
         'reservation': reservation,
         'flight': reservation.flight,
+        'seat_map': form.seat_map,
     }
     return render(request, 'flights/edit_reservation.html', context)
 
 
+@read_your_writes
 @login_required
 def cancel_reservation(request, reservation_id):
     """Отмена резервирования"""
-    reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
+    reservation = get_object_or_404(Reservation.objects.select_related('flight__airline'), id=reservation_id, user=request.user)
     flight_id = reservation.flight.id
     
     if request.method == 'POST':
-        reservation.delete()
+        with transaction.atomic():
+            reservation.delete()
+        RESERVATIONS_CANCELLED.inc(airline=reservation.flight.airline.code)
         messages.success(request, 'Резервирование отменено.')
-        return redirect('flight_detail', flight_id=flight_id)
+        return stick_to_primary(redirect('flight_detail', flight_id=flight_id))
     
     context = {
         'reservation': reservation,
@@ -137,10 +309,11 @@ def cancel_reservation(request, reservation_id):
     return render(request, 'flights/cancel_reservation.html', context)
 
 
+@read_your_writes
 @login_required
 def add_review(request, flight_id):
     """Добавление отзыва о рейсе"""
-    flight = get_object_or_404(Flight, id=flight_id)
+    flight = get_object_or_404(Flight.objects.select_related('airline'), id=flight_id)
     
     # Проверяем, нет ли уже отзыва от пользователя
     if Review.objects.filter(user=request.user, flight=flight).exists():
@@ -153,9 +326,11 @@ def add_review(request, flight_id):
             review = form.save(commit=False)
             review.user = request.user
             review.flight = flight
-            review.save()
+            # Отзыв и сводка рейтинга рейса и авиакомпании (сигнал) — одной транзакцией
+            with transaction.atomic():
+                review.save()
             messages.success(request, 'Отзыв добавлен!')
-            return redirect('flight_detail', flight_id=flight_id)
+            return stick_to_primary(redirect('flight_detail', flight_id=flight_id))
     else:
         form = ReviewForm()
     
@@ -173,22 +348,11 @@ def register(request):
         profile_form = UserProfileForm(request.POST)
         
         if form.is_valid() and profile_form.is_valid():
-            user = form.save()
-            
-            # Получаем или создаем профиль пользователя
-            profile, created = UserProfile.objects.get_or_create(
-                user=user,
-                defaults={
-                    'phone': profile_form.cleaned_data.get('phone', ''),
-                    'address': profile_form.cleaned_data.get('address', ''),
-                }
-            )
-            
-            # Если профиль уже существовал, обновляем его данные
-            if not created:
-                profile.phone = profile_form.cleaned_data.get('phone', '')
-                profile.address = profile_form.cleaned_data.get('address', '')
-                profile.save()
+            # Пользователь новый, профиля у него нет: один INSERT без проверок
+            with transaction.atomic():
+                user = form.save()
+                profile_form.instance.user = user
+                profile_form.save()
             
             login(request, user)
             messages.success(request, 'Регистрация прошла успешно!')
@@ -204,12 +368,63 @@ def register(request):
     return render(request, 'registration/register.html', context)
 
 
+@read_your_writes
 @login_required
-def user_reservations(request):
+async def user_reservations(request):
     """Список резервирований пользователя"""
-    reservations = Reservation.objects.filter(user=request.user).select_related('flight__airline').order_by('-created_at')
+    user = await auser(request)
+    reservations = Reservation.objects.filter(user=user).select_related('flight__airline')
+    paginator = CursorPaginator(reservations, 12, ordering=['-created_at', '-id'])
+    page_obj = await paginator.aget_page(request.GET.get('cursor'))
     
     context = {
-        'reservations': reservations,
+        'reservations': page_obj,
+        'page_obj': page_obj,
+        'reservations_total': await reservations.acount() if page_obj.has_other_pages else len(page_obj),
     }
-    return render(request, 'flights/user_reservations.html', context)
\ No newline at end of file
+    return await arender(request, 'flights/user_reservations.html', context)
+
+
+@require_GET
+@staff_member_required
+def flight_manifest(request, flight_id, export_format):
+    """Манифест рейса (пассажиры с паспортными данными) потоком CSV/NDJSON"""
+    flight = get_object_or_404(Flight.objects.select_related('airline'), id=flight_id)
+    filename = f'manifest-{flight.flight_number}-{flight.departure_time:%Y-%m-%d}'
+    return export_response(request, Reservation.objects.filter(flight=flight), export_format, filename)
+
+
+@require_GET
+@staff_member_required
+def reservations_export(request, export_format):
+    """Брони рейсов за день вылета (?date=ГГГГ-ММ-ДД, ?airline=код) потоком CSV/NDJSON"""
+    try:
+        day = date.fromisoformat(request.GET['date']) if request.GET.get('date') else timezone.localdate()
+    except ValueError:
+        return HttpResponseBadRequest('Дата должна быть в формате ГГГГ-ММ-ДД')
+    # Диапазон вместо __date, чтобы работал индекс по departure_time
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    reservations = Reservation.objects.filter(
+        flight__departure_time__gte=start,
+        flight__departure_time__lt=start + timedelta(days=1),
+    )
+    filename = f'reservations-{day:%Y-%m-%d}'
+    airline = request.GET.get('airline', '').upper()
+    if airline:
+        reservations = reservations.filter(flight__airline__code=airline)
+        filename += f'-{airline}'
+    return export_response(request, reservations, export_format, filename)
+
+
+@require_GET
+def metrics(request):
+    """Метрики в текстовом формате Prometheus
+
+    Доступны по токену METRICS_TOKEN (Authorization: Bearer) или персоналу:
+    в метриках брони и отмены по авиакомпаниям и состояние очереди заданий.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')